@@ -0,0 +1,147 @@
+"""
+Measures `DB.function_at` and `DB.statement_at` latency against a synthetic AST
+database, both without and with the schema's SQL indexes, and with the in-memory
+`ModuleIndex`.
+
+Usage:
+
+    python benchmarks/lookup.py [--modules N] [--functions N] [--statements N]
+"""
+
+import argparse
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import text
+
+from tourniquet.location import Location, SourceCoordinate
+from tourniquet.models import DB, Base, BulkInserter, Function, Module, Statement
+
+STATEMENT_LOOKUP = (
+    "SELECT id FROM statements "
+    "WHERE module_name = :module_name AND start_line = :line AND start_column = :column"
+)
+
+
+def populate(db, root, modules, functions, statements):
+    inserter = BulkInserter(db.session, batch_size=10000)
+    for module_index in range(modules):
+        # Lookups resolve their locations' filenames, so modules are
+        # named by absolute path, just as collect_info names them.
+        module_name = str(root / f"module{module_index}.c")
+        inserter.add(Module, name=module_name)
+
+        line = 1
+        for function_index in range(functions):
+            end_line = line + statements + 1
+            function_id = inserter.add(
+                Function,
+                module_name=module_name,
+                name=f"function{function_index}",
+                start_line=line,
+                start_column=1,
+                end_line=end_line,
+                end_column=1,
+            )
+            for statement_line in range(line + 1, end_line):
+                inserter.add(
+                    Statement,
+                    module_name=module_name,
+                    function_id=function_id,
+                    expr="x = 1;",
+                    start_line=statement_line,
+                    start_column=3,
+                    end_line=statement_line,
+                    end_column=8,
+                )
+            line = end_line + 1
+    inserter.flush()
+    db.session.commit()
+
+
+def drop_indexes(db):
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            db.session.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+    db.session.commit()
+
+
+def create_indexes(db):
+    # End the session's transaction first, so that it sees the new indexes.
+    db.session.close()
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.session.get_bind(), checkfirst=True)
+
+
+def sample_locations(db, count, seed):
+    statements = db.query(Statement.module_name, Statement.start_line, Statement.start_column)
+    statements = statements.all()
+    rng = random.Random(seed)
+    return [
+        Location(Path(module_name), SourceCoordinate(line, column))
+        for module_name, line, column in rng.sample(statements, min(count, len(statements)))
+    ]
+
+
+def query_plan(db, location):
+    rows = db.session.execute(
+        text(f"EXPLAIN QUERY PLAN {STATEMENT_LOOKUP}"),
+        {
+            "module_name": str(location.filename),
+            "line": location.line,
+            "column": location.column,
+        },
+    )
+    return "; ".join(row[-1] for row in rows)
+
+
+def time_lookups(db, locations):
+    start = time.perf_counter()
+    for location in locations:
+        function = db.function_at(location)
+        statement = db.statement_at(location)
+        assert function is not None and statement is not None, f"no statement at {location}"
+    return (time.perf_counter() - start) / len(locations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--modules", type=int, default=10)
+    parser.add_argument("--functions", type=int, default=500)
+    parser.add_argument("--statements", type=int, default=20, help="statements per function")
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = DB.create(Path(tmpdir) / "bench.db")
+        populate(db, Path(tmpdir).resolve(), args.modules, args.functions, args.statements)
+        locations = sample_locations(db, args.lookups, args.seed)
+        total = args.modules * args.functions * args.statements
+        print(f"{total} statements, {len(locations)} lookups")
+
+        drop_indexes(db)
+        before = time_lookups(db, locations)
+        print(f"no SQL indexes:   {before * 1e6:10.1f} us/lookup")
+        print(f"  plan: {query_plan(db, locations[0])}")
+
+        create_indexes(db)
+        after = time_lookups(db, locations)
+        print(f"SQL indexes:      {after * 1e6:10.1f} us/lookup ({before / after:.1f}x)")
+        print(f"  plan: {query_plan(db, locations[0])}")
+
+        db.indexed = True
+        db.invalidate()
+        start = time.perf_counter()
+        for module_name in {str(location.filename) for location in locations}:
+            db.module_index(module_name)
+        print(f"ModuleIndex build: {time.perf_counter() - start:9.3f} s")
+        in_memory = time_lookups(db, locations)
+        print(f"ModuleIndex:      {in_memory * 1e6:10.1f} us/lookup ({before / in_memory:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
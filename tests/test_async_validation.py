@@ -0,0 +1,160 @@
+import asyncio
+import time
+
+from tourniquet.async_validation import AsyncValidator
+from tourniquet.limits import ResourceLimits
+from tourniquet.location import SourceCoordinate as SC
+from tourniquet.target import Target
+from tourniquet.validation import Verdict
+
+
+def test_validate(tmp_path):
+    source = tmp_path / "program.c"
+    source.write_text("int main(int argc, char *argv[]) {\n  return 0;\n}\n")
+    tests = [("a", 0), ("c", 7)]
+    validator = AsyncValidator(concurrency=2)
+
+    candidates = ["return 1", "this is not C"]
+    report = asyncio.run(validator.validate(source, False, SC(2, 3), SC(2, 10), candidates, tests))
+    assert [result.verdict for result in report.results] == [Verdict.FAILED, Verdict.BUILD_FAILED]
+    assert report.patch is None
+
+    candidates = ["return argv[1][0] == 'c' ? 7 : 0"]
+    report = asyncio.run(validator.validate(source, False, SC(2, 3), SC(2, 10), candidates, tests))
+    assert report.patch == candidates[0]
+    assert report.results[0].executions == 2
+
+    assert source.read_text().count("return 0") == 1
+
+
+def test_validate_candidate_error(tmp_path):
+    source = tmp_path / "program.c"
+    source.write_text("int main(int argc, char *argv[]) {\n  return 1;\n}\n")
+
+    # The lone surrogate can't be encoded into the patched source.
+    candidates = ["\udc80", "return 0"]
+    report = asyncio.run(
+        AsyncValidator(concurrency=1).validate(
+            source, False, SC(2, 3), SC(2, 10), candidates, [("a", 0)]
+        )
+    )
+
+    assert [result.verdict for result in report.results] == [Verdict.ERROR, Verdict.PASSED]
+    assert "UnicodeEncodeError" in report.results[0].error
+    assert report.patch == "return 0"
+
+
+def test_validate_earliest_patch(tmp_path):
+    source = tmp_path / "program.c"
+    source.write_text("#include <unistd.h>\nint main(int argc, char *argv[]) {\n  return 1;\n}\n")
+
+    candidates = ["sleep(1); return 0", "return 0"]
+    report = asyncio.run(
+        AsyncValidator(concurrency=2).validate(
+            source, False, SC(3, 3), SC(3, 10), candidates, [("a", 0)]
+        )
+    )
+
+    assert report.patch == candidates[0]
+
+
+def test_validate_does_not_block_loop(tmp_path):
+    source = tmp_path / "program.c"
+    source.write_text("int main(int argc, char *argv[]) {\n  return 0;\n}\n")
+
+    def candidates():
+        # A stand-in for a slow, database-backed concretization.
+        time.sleep(1)
+        yield "return 0"
+
+    async def validate_with_heartbeat():
+        ticks = 0
+
+        async def heartbeat():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.05)
+
+        beating = asyncio.ensure_future(heartbeat())
+        report = await AsyncValidator(concurrency=1).validate(
+            source, False, SC(2, 3), SC(2, 10), candidates(), [("a", 0)]
+        )
+        beating.cancel()
+        return report, ticks
+
+    report, ticks = asyncio.run(validate_with_heartbeat())
+    assert report.patch == "return 0"
+    # The event loop kept running while the candidate was drawn.
+    assert ticks >= 10
+
+
+def test_validate_timeout(tmp_path):
+    source = tmp_path / "program.c"
+    source.write_text("int main(int argc, char *argv[]) {\n  return 0;\n}\n")
+
+    start = time.monotonic()
+    report = asyncio.run(
+        AsyncValidator(concurrency=1, limits=ResourceLimits(test_timeout=1)).validate(
+            source, False, SC(2, 3), SC(2, 10), ["for (;;) {}"], [("a", 0)]
+        )
+    )
+
+    # The hanging candidate is killed, rather than stalling the whole run.
+    assert report.results[0].verdict == Verdict.HANG
+    assert time.monotonic() - start < 30
+
+
+def test_validate_cancelled(tmp_path):
+    source = tmp_path / "program.c"
+    source.write_text("int main(int argc, char *argv[]) {\n  return 0;\n}\n")
+
+    async def cancel_validation():
+        task = asyncio.ensure_future(
+            AsyncValidator(concurrency=1).validate(
+                source, False, SC(2, 3), SC(2, 10), ["for (;;) {}"], [("a", 0)]
+            )
+        )
+        await asyncio.sleep(1)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            return True
+        return False
+
+    start = time.monotonic()
+    assert asyncio.run(cancel_validation())
+    assert time.monotonic() - start < 30
+
+
+def test_validate_target(tmp_path):
+    helper = tmp_path / "helper.c"
+    helper.write_text("int helper(void) { return 3; }\n")
+    source = tmp_path / "main.c"
+    source.write_text("int helper(void);\nint main(int argc, char *argv[]) {\n  return 0;\n}\n")
+
+    tests = [("a", 3)]
+    target = Target(str(source), tests, [], "", sources=[str(source), str(helper)])
+    report = asyncio.run(
+        AsyncValidator(concurrency=2).validate(
+            source, False, SC(3, 3), SC(3, 10), ["return 0", "return helper()"], tests, target
+        )
+    )
+
+    # The failing candidate may be cancelled, if the passing one finishes first.
+    assert report.results[0].verdict in (Verdict.FAILED, Verdict.SKIPPED)
+    assert report.patch == "return helper()"
+
+
+def test_build_async(tmp_path):
+    source = tmp_path / "main.c"
+    source.write_text("int main(void) { return 0; }\n")
+
+    target = Target(str(source), [], ["true"], "")
+    assert asyncio.run(target.build_async())
+
+    target = Target(str(source), [], ["sleep", "10"], "")
+    start = time.monotonic()
+    assert not asyncio.run(target.build_async(timeout=0.5))
+    assert time.monotonic() - start < 5
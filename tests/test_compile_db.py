@@ -0,0 +1,90 @@
+import json
+
+from tourniquet.compile_db import CompilationDatabase, CompileCommand
+
+
+def test_extraction_arguments(tmp_path):
+    source = tmp_path / "src" / "main.c"
+    command = CompileCommand(
+        tmp_path,
+        source,
+        [
+            "cc",
+            "-Iinclude",
+            "-I",
+            "/usr/local/include",
+            "-isystem",
+            "third_party",
+            "-DDEBUG=1",
+            "-std=c11",
+            "--target=aarch64-linux-gnu",
+            "--sysroot=sysroot",
+            "-MD",
+            "-MF",
+            "main.d",
+            "-c",
+            "-o",
+            "main.o",
+            "src/main.c",
+        ],
+    )
+
+    assert command.extraction_arguments() == [
+        f"-I{tmp_path / 'include'}",
+        "-I",
+        "/usr/local/include",
+        "-isystem",
+        str(tmp_path / "third_party"),
+        "-DDEBUG=1",
+        "-std=c11",
+        "--target=aarch64-linux-gnu",
+        f"--sysroot={tmp_path / 'sysroot'}",
+    ]
+
+
+def test_extraction_arguments_joined_paths(tmp_path):
+    source = tmp_path / "src" / "main.c"
+    command = CompileCommand(
+        tmp_path,
+        source,
+        [
+            "cc",
+            "-includeconfig.h",
+            "-imacrosmacros.h",
+            "-isysrootsysroot",
+            "-include-pch",
+            "prefix.pch",
+            "-c",
+            "./src/../src/main.c",
+        ],
+    )
+
+    assert command.extraction_arguments() == [
+        f"-include{tmp_path / 'config.h'}",
+        f"-imacros{tmp_path / 'macros.h'}",
+        f"-isysroot{tmp_path / 'sysroot'}",
+        "-include-pch",
+        str(tmp_path / "prefix.pch"),
+    ]
+
+
+def test_arguments_for(tmp_path):
+    compile_commands = tmp_path / "compile_commands.json"
+    compile_commands.write_text(
+        json.dumps(
+            [
+                {"directory": str(tmp_path), "file": "a.c", "command": "cc -DFIRST -c a.c"},
+                {"directory": str(tmp_path), "file": "b.c", "arguments": ["cc", "-c", "b.c"]},
+                {"directory": str(tmp_path), "file": "a.c", "command": "cc -DSECOND -c a.c"},
+            ]
+        )
+    )
+
+    database = CompilationDatabase.from_file(compile_commands)
+    assert len(database) == 3
+    assert database.files == [tmp_path / "a.c", tmp_path / "b.c"]
+
+    # The first entry for a file wins, and lookups accept relative paths.
+    assert database.arguments_for(tmp_path / "a.c") == ["-DFIRST"]
+    assert database.arguments_for(tmp_path / "sub" / ".." / "b.c") == []
+    assert database.arguments_for(tmp_path / "c.c") is None
@@ -0,0 +1,199 @@
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from tourniquet import Tourniquet, extractor
+from tourniquet.location import Location as L
+from tourniquet.location import SourceCoordinate as SC
+from tourniquet.models import Function
+from tourniquet.rewrite import SourceBuffer
+
+
+@pytest.fixture
+def preamble_cache(tmp_path):
+    previous = extractor.preamble_cache_stats()["directory"]
+    cache = tmp_path / "preambles"
+    extractor.set_preamble_cache(cache)
+    extractor.reset_preamble_cache_stats()
+    yield cache
+    extractor.set_preamble_cache(previous)
+
+
+def _rss_kib():
+    # Unlike ru_maxrss, this is the current resident set size, so memory
+    # that's freed again (e.g. by a transient spike during parsing) doesn't count.
+    with open("/proc/self/statm") as statm:
+        resident_pages = int(statm.read().split()[1])
+    return resident_pages * resource.getpagesize() // 1024
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="needs /proc/self/statm")
+def test_extract_ast_does_not_leak(test_files):
+    test_file = test_files / "patch_test.c"
+
+    # Let the process reach a steady state before taking a baseline.
+    for _ in range(10):
+        extractor.extract_ast(test_file, False)
+        extractor.extract_ast_columnar(test_file, False)
+    gc.collect()
+    baseline = _rss_kib()
+
+    # Every call produces thousands of objects (patch_test.c pulls in libc headers),
+    # so even a single leaked reference per node would grow RSS by several MiB
+    # with every batch here.
+    samples = []
+    for _ in range(4):
+        for _ in range(50):
+            extractor.extract_ast(test_file, False)
+            extractor.extract_ast_columnar(test_file, False)
+        gc.collect()
+        samples.append(_rss_kib() - baseline)
+
+    assert max(samples) < 4 * 1024, samples
+
+
+def test_parsed_unit(test_files):
+    test_file = test_files / "patch_test.c"
+    unit = extractor.ParsedUnit(test_file, False)
+
+    # Queries against a parsed unit see the same AST as one-shot extraction.
+    assert unit.extract_ast() == extractor.extract_ast(test_file, False)
+
+    # Every rewrite starts from the original source, so they don't accumulate.
+    buffer = SourceBuffer.from_file(test_file)
+    for replacement in ["strncpy(buff, pov, sizeof(buff))", "return 1"]:
+        assert unit.rewrite(replacement, 32, 3, 32, 19) == buffer.replace(
+            SC(32, 3), SC(32, 19), replacement
+        )
+
+
+def test_transform_many(test_files, tmp_path):
+    test_file = test_files / "patch_test.c"
+    buffer = SourceBuffer.from_file(test_file)
+    strncpy = ("strncpy(buff, pov, sizeof(buff))", 32, 3, 32, 19)
+    compare = ("strncmp(buff, pass, sizeof(buff))", 33, 7, 33, 25)
+    edits = [strncpy, [strncpy, compare]]
+
+    single = buffer.replace(SC(32, 3), SC(32, 19), strncpy[0])
+    multi = SourceBuffer(single).replace(SC(33, 7), SC(33, 25), compare[0])
+
+    # Each candidate is either a single edit, or several edits applied together.
+    assert extractor.transform_many(test_file, False, edits) == [single, multi]
+    assert extractor.ParsedUnit(test_file, False).rewrite_many(edits) == [single, multi]
+
+    # With an output directory, each variant is written to its own file.
+    paths = extractor.transform_many(test_file, False, edits, tmp_path)
+    assert paths == [str(tmp_path / str(i) / test_file.name) for i in range(2)]
+    assert [Path(path).read_bytes() for path in paths] == [single, multi]
+
+    # Overlapping edits can't be applied together.
+    with pytest.raises(ValueError, match="candidate 1"):
+        extractor.transform_many(test_file, False, [strncpy, [strncpy, strncpy]])
+
+
+def test_preamble_cache(test_files, preamble_cache):
+    test_file = test_files / "patch_test.c"
+
+    first = extractor.extract_ast(test_file, False)
+    assert extractor.preamble_cache_stats()["misses"] == 1
+    assert list(preamble_cache.glob("*.pch"))
+
+    # The second extraction reuses the preamble, and sees the same AST.
+    second = extractor.extract_ast(test_file, False)
+    assert extractor.preamble_cache_stats()["hits"] == 1
+    assert first == second
+
+    extractor.set_preamble_cache(None)
+    assert extractor.extract_ast(test_file, False) == first
+
+
+def test_preamble_cache_header_changed(tmp_path, preamble_cache):
+    header = tmp_path / "header.h"
+    header.write_text("int x;\n")
+    source = tmp_path / "source.c"
+    source.write_text(f'#include "{header}"\nint main(void) {{ return x; }}\n')
+
+    extractor.extract_ast(source, False)
+    extractor.extract_ast(source, False)
+    assert extractor.preamble_cache_stats()["misses"] == 1
+    assert extractor.preamble_cache_stats()["hits"] == 1
+
+    # Changing a header that the preamble includes invalidates it.
+    header.write_text("int x;\nint y;\n")
+    extractor.extract_ast(source, False)
+    assert extractor.preamble_cache_stats()["misses"] == 2
+
+
+def test_preamble_cache_build_failure(tmp_path, preamble_cache):
+    source = tmp_path / "source.c"
+    source.write_text(f'#include "{tmp_path / "missing.h"}"\nint main(void) {{ return 0; }}\n')
+
+    # A preamble that can't be built is a failure, not a miss.
+    extractor.extract_ast(source, False)
+    assert extractor.preamble_cache_stats()["failures"] == 1
+    assert extractor.preamble_cache_stats()["misses"] == 0
+    assert not list(preamble_cache.glob("*.pch"))
+
+
+def _fresh_preamble_cache_stats(test_file, environment):
+    # The environment is only consulted when the extractor is imported,
+    # so this needs a fresh interpreter.
+    script = (
+        "import json, sys\n"
+        "from tourniquet import extractor\n"
+        "for _ in range(2):\n"
+        "    extractor.extract_ast(sys.argv[1], False)\n"
+        "print(json.dumps(extractor.preamble_cache_stats()))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script, str(test_file)],
+        env=environment,
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    return json.loads(result.stdout)
+
+
+def test_preamble_cache_environment(test_files, tmp_path):
+    test_file = test_files / "patch_test.c"
+    environment = dict(os.environ)
+    environment.pop("TOURNIQUET_PREAMBLE_CACHE", None)
+
+    # The cache is off unless it's asked for.
+    stats = _fresh_preamble_cache_stats(test_file, environment)
+    assert stats["directory"] is None
+    assert stats["hits"] == stats["misses"] == 0
+
+    cache = tmp_path / "preambles"
+    environment["TOURNIQUET_PREAMBLE_CACHE"] = str(cache)
+    stats = _fresh_preamble_cache_stats(test_file, environment)
+    assert stats["directory"] == str(cache)
+    assert (stats["misses"], stats["hits"]) == (1, 1)
+    assert list(cache.glob("*.pch"))
+
+
+def test_preamble_cache_collect_info(test_files, tmp_path, tmp_db, preamble_cache):
+    test_file = tmp_path / "patch_test.c"
+    test_file.write_bytes((test_files / "patch_test.c").read_bytes())
+
+    tourniquet = Tourniquet(tmp_db)
+    assert tourniquet.collect_info(test_file)
+    main = tourniquet.db.query(Function).filter_by(name="main").one()
+    expected = (main.start_line, len(main.var_decls), len(main.calls), len(main.statements))
+
+    # Re-collecting a file whose preamble is unchanged reuses the cached one,
+    # and stores the same AST.
+    with test_file.open("a") as io:
+        io.write("/* a trailing comment */\n")
+    assert tourniquet.collect_info(test_file)
+    assert extractor.preamble_cache_stats()["hits"] == 1
+
+    main = tourniquet.db.query(Function).filter_by(name="main").one()
+    assert (main.start_line, len(main.var_decls), len(main.calls), len(main.statements)) == expected
+    assert tourniquet.db.statement_at(L(test_file, SC(32, 3))) is not None
@@ -0,0 +1,119 @@
+import signal
+import subprocess
+
+import pytest
+
+from tourniquet import forkserver
+from tourniquet.error import ForkServerError
+from tourniquet.forkserver import ForkServer, first_failure
+from tourniquet.limits import ResourceLimits
+from tourniquet.target import Target
+
+PROGRAM = """
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+
+static int calls = 0;
+
+int main(int argc, char *argv[]) {
+  calls++;
+  if (strcmp(argv[1], "crash") == 0) {
+    abort();
+  }
+  if (strcmp(argv[1], "hang") == 0) {
+    for (;;) {
+    }
+  }
+  if (strcmp(argv[1], "parent") == 0) {
+    return (int)(getppid() % 128);
+  }
+  return atoi(argv[1]) + calls;
+}
+"""
+
+
+def _compile(tmp_path, *flags):
+    source = tmp_path / "program.c"
+    source.write_text(PROGRAM)
+    executable = tmp_path / "program"
+    subprocess.run(["clang", *flags, "-o", str(executable), str(source)], check=True)
+    return executable
+
+
+def test_fork_server(tmp_path):
+    executable = _compile(tmp_path)
+    with ForkServer(executable) as server:
+        # Each test is forked from the server, and never sees another test's state.
+        assert server.run("parent") == server._process.pid % 128
+        assert server.run("1") == 2
+        assert server.run("1") == 2
+        assert server.run("crash") == -signal.SIGABRT
+
+        assert server.first_failure([("1", 2), ("2", 3)]) is None
+        assert server.first_failure([("1", 2), ("crash", 0)]) == 1
+
+
+@pytest.mark.parametrize("flags", [(), ("-static",)])
+def test_fork_server_timeout(tmp_path, flags):
+    executable = _compile(tmp_path, *flags)
+    limits = ResourceLimits(test_timeout=0.5)
+
+    # Hung tests time out, with or without a fork server.
+    assert first_failure(executable, [("1", 2), ("hang", 0)], limits=limits) == 1
+    if not flags:
+        with ForkServer(executable, limits=limits) as server:
+            assert server.run("hang") is None
+            assert server.run("1") == 2
+
+
+def test_fork_server_static(tmp_path, monkeypatch):
+    dynamic = tmp_path / "dynamic"
+    dynamic.mkdir()
+    assert forkserver._is_dynamic(_compile(dynamic))
+
+    executable = _compile(tmp_path, "-static")
+    assert not forkserver._is_dynamic(executable)
+
+    # Statically linked programs are detected without being run.
+    def popen(*_args, **_kwargs):
+        raise AssertionError("statically linked program was run")
+
+    with monkeypatch.context() as m:
+        m.setattr(subprocess, "Popen", popen)
+        with pytest.raises(ForkServerError, match="dynamically linked"):
+            ForkServer(executable)
+
+    # Statically linked programs are still tested, one execution per test.
+    assert first_failure(executable, [("1", 2), ("2", 3)]) is None
+    assert first_failure(executable, [("1", 2), ("2", 4)]) == 1
+
+
+def test_fork_server_runtime_cxx():
+    # The runtime is compiled as C, even by a C++ compiler driver.
+    assert forkserver._runtime("g++").is_file()
+
+
+def test_fork_server_runtime_failure(monkeypatch):
+    calls = []
+    compile_ = subprocess.call
+
+    def call(args, **kwargs):
+        calls.append(args)
+        return compile_(args, **kwargs)
+
+    monkeypatch.setattr(subprocess, "call", call)
+    for _ in range(2):
+        with pytest.raises(ForkServerError):
+            forkserver._runtime("false")
+
+    # A compiler that fails is only tried once.
+    assert len(calls) == 1
+
+
+def test_target_run_tests(tmp_path):
+    executable = _compile(tmp_path)
+    source = tmp_path / "program.c"
+
+    assert Target(str(source), [("1", 2), ("5", 6)], [], str(executable)).run_tests()
+    assert not Target(str(source), [("1", 2), ("5", 7)], [], str(executable)).run_tests()
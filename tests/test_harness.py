@@ -0,0 +1,88 @@
+import signal
+import subprocess
+
+import pytest
+
+from tourniquet.harness import SharedObjectHarness
+from tourniquet.limits import ResourceLimits
+
+PROGRAM = """
+#include <signal.h>
+#include <stdlib.h>
+#include <string.h>
+
+static int calls = 0;
+
+int main(int argc, char *argv[]) {
+  calls++;
+  if (strcmp(argv[1], "crash") == 0) {
+    abort();
+  }
+  if (strcmp(argv[1], "hang") == 0) {
+    for (;;) {
+    }
+  }
+  if (strcmp(argv[1], "pipe") == 0) {
+    raise(SIGPIPE);
+  }
+  if (strcmp(argv[1], "exit") == 0) {
+    exit(7);
+  }
+  if (strncmp(argv[1], "alloc", 5) == 0) {
+    volatile char *buffer = malloc((size_t)atoi(argv[1] + 5) << 20);
+    if (buffer == NULL) {
+      return 100;
+    }
+    buffer[0] = 1;
+    return 0;
+  }
+  return atoi(argv[1]) + calls;
+}
+"""
+
+
+@pytest.fixture
+def library(tmp_path):
+    source = tmp_path / "program.c"
+    source.write_text(PROGRAM)
+    library = tmp_path / "program.so"
+    subprocess.run(["clang", "-shared", "-fPIC", "-o", str(library), str(source)], check=True)
+    return library
+
+
+def test_shared_object_harness(library):
+    with SharedObjectHarness(library) as harness:
+        # Each test runs in its own child, so state never leaks between tests.
+        assert harness.run("1") == 2
+        assert harness.run("1") == 2
+        assert harness.run("exit") == 7
+        assert harness.run("crash") == -signal.SIGABRT
+
+        assert harness.first_failure([("1", 2), ("2", 3)]) is None
+        assert harness.first_failure([("1", 2), ("crash", 0), ("2", 3)]) == 1
+
+
+def test_shared_object_harness_default_signals(library):
+    # The interpreter ignores SIGPIPE, but the program under test gets its default action.
+    assert signal.getsignal(signal.SIGPIPE) == signal.SIG_IGN
+    with SharedObjectHarness(library) as harness:
+        assert harness.run("pipe") == -signal.SIGPIPE
+
+
+def test_shared_object_harness_timeout(library):
+    with SharedObjectHarness(library, limits=ResourceLimits(test_timeout=0.5)) as harness:
+        assert harness.run("hang") is None
+        assert harness.run("1") == 2
+
+
+def test_shared_object_harness_memory_limit(library):
+    # The limit is on top of the interpreter's own address space, which is
+    # already larger than the limit.
+    with SharedObjectHarness(library, limits=ResourceLimits(memory=64 << 20)) as harness:
+        assert harness.run("alloc16") == 0
+        assert harness.run("alloc256") == 100
+
+
+def test_shared_object_harness_missing_entry(library):
+    with pytest.raises(AttributeError):
+        SharedObjectHarness(library, entry="not_main")
@@ -0,0 +1,91 @@
+import asyncio
+import os
+import signal
+import sys
+import time
+
+from tourniquet.limits import ResourceLimits, _preexec, call, call_async, wait_exited
+
+
+def _alive(pid):
+    # The orphaned process is reaped by init, which may take a moment.
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def test_call_timeout_kills_group(tmp_path):
+    pidfile = tmp_path / "pid"
+    start = time.monotonic()
+    ret = call(["sh", "-c", f"sleep 30 & echo $! > {pidfile}; wait"], timeout=0.5)
+    assert ret is None
+    assert time.monotonic() - start < 5
+    assert not _alive(int(pidfile.read_text()))
+
+
+def test_call_async_timeout_kills_group(tmp_path):
+    pidfile = tmp_path / "pid"
+    program = ["sh", "-c", f"sleep 30 & echo $! > {pidfile}; wait"]
+    assert asyncio.run(call_async(program, timeout=0.5)) is None
+    assert not _alive(int(pidfile.read_text()))
+    assert asyncio.run(call_async(["sh", "-c", "exit 3"], timeout=5)) == 3
+
+
+def test_call_kills_stray_children(tmp_path):
+    pidfile = tmp_path / "pid"
+    assert call(["sh", "-c", f"sleep 30 & echo $! > {pidfile}"]) == 0
+    assert not _alive(int(pidfile.read_text()))
+
+
+def test_call_cpu_limit():
+    limits = ResourceLimits(cpu=1)
+    ret = call([sys.executable, "-c", "while True: pass"], limits=limits)
+    assert ret == -signal.SIGXCPU
+    assert limits.hung(ret)
+    assert not limits.hung(-signal.SIGSEGV)
+
+
+def test_call_memory_limit():
+    program = [sys.executable, "-c", "bytearray(1 << 30)"]
+    assert call(program) == 0
+    assert call(program, limits=ResourceLimits(memory=256 << 20)) != 0
+
+
+def test_wait_exited_does_not_reap():
+    pid = os.fork()
+    if pid == 0:
+        os._exit(3)
+
+    # The exited child is left as a zombie, so its pid can't be reused yet.
+    assert wait_exited(pid, 5)
+    os.kill(pid, 0)
+    assert os.waitpid(pid, 0)[1] == 3 << 8
+
+    pid = os.fork()
+    if pid == 0:
+        time.sleep(30)
+        os._exit(0)
+    assert not wait_exited(pid, 0.1)
+    os.kill(pid, signal.SIGKILL)
+    assert wait_exited(pid)
+    os.waitpid(pid, 0)
+
+
+def test_default_timeouts():
+    # Candidates that loop forever can't hang a repair unless asked to.
+    limits = ResourceLimits()
+    assert limits.build_timeout is not None
+    assert limits.test_timeout is not None
+
+
+def test_preexec_only_with_rlimits():
+    # Without rlimits to apply, subprocesses can take CPython's fast spawn path.
+    assert _preexec(None) is None
+    assert _preexec(ResourceLimits(test_timeout=1)) is None
+    assert _preexec(ResourceLimits(memory=1 << 30)) is not None
+    assert _preexec(ResourceLimits(cpu=1)) is not None
@@ -1,3 +1,8 @@
+import itertools
+import random
+
+import pytest
+
 from tourniquet import Tourniquet
 from tourniquet.location import Location as L
 from tourniquet.location import SourceCoordinate as SC
@@ -5,14 +10,19 @@ from tourniquet.patch_lang import (
     BinaryBoolOperator,
     BinaryMathOperator,
     ElseStmt,
+    Expression,
     FixPattern,
     IfStmt,
     LessThanExpr,
     Lit,
     NodeStmt,
+    PatchTemplate,
     ReturnStmt,
+    StatementList,
     StaticBufferSize,
     Variable,
+    _random_indices,
+    concretization_cache,
 )
 
 
@@ -44,6 +54,55 @@ def test_concretize_staticbuffersize(test_files, tmp_db):
     assert concretized == {"sizeof(buff)"}
 
 
+def test_concretization_cache(test_files, tmp_db):
+    tourniquet = Tourniquet(tmp_db)
+    test_file = test_files / "patch_test.c"
+    tourniquet.collect_info(test_file)
+
+    variable = Variable()
+    location = L(test_file, SC(23, 3))
+    first = list(variable.concretize(tourniquet.db, location))
+
+    hits = concretization_cache.hits
+    assert list(variable.concretize(tourniquet.db, location)) == first
+    assert concretization_cache.hits == hits + 1
+
+    # Any change to the database invalidates the cache.
+    tourniquet.db.invalidate()
+    misses = concretization_cache.misses
+    assert list(variable.concretize(tourniquet.db, location)) == first
+    assert concretization_cache.misses == misses + 1
+
+
+def test_concretization_cache_per_db(test_files, tmp_db, tmp_path, monkeypatch):
+    test_file = test_files / "patch_test.c"
+    first = Tourniquet(tmp_db)
+    first.collect_info(test_file)
+    second = Tourniquet(tmp_path / "second.db")
+    second.collect_info(test_file)
+
+    variable = Variable()
+    location = L(test_file, SC(23, 3))
+    expected = list(variable.concretize(first.db, location))
+    list(variable.concretize(second.db, location))
+
+    # Alternating between databases doesn't evict either one's entries, and the
+    # enclosing function is only looked up once per location.
+    lookups = []
+    for tourniquet in (first, second):
+        function_at = tourniquet.db.function_at
+        monkeypatch.setattr(
+            tourniquet.db, "function_at", lambda loc, f=function_at: lookups.append(loc) or f(loc)
+        )
+
+    hits = concretization_cache.hits
+    for _ in range(3):
+        assert list(variable.concretize(first.db, location)) == expected
+        assert list(variable.concretize(second.db, location)) == expected
+    assert concretization_cache.hits == hits + 6
+    assert lookups == []
+
+
 def test_concretize_binarymathoperator():
     bmo = BinaryMathOperator(Lit("1"), Lit("2"))
     concretized = set(bmo.concretize(None, None))
@@ -89,10 +148,118 @@ def test_concretize_returnstmt():
     assert set(rets.concretize(None, None)) == {"return foo;"}
 
 
+def test_concretize_statementlist():
+    stmts = StatementList(Lit("a;"), FixPattern(Lit("b;"), Lit("c;")))
+    assert list(stmts.concretize(None, None)) == ["a;\nb;\nc;"]
+
+
+def test_concretize_statementlist_deduplicates():
+    class Duplicates(Expression):
+        def concretize(self, _db, _location):
+            yield from ["a;", "b;", "a;"]
+
+    stmts = StatementList(Duplicates(), Lit("c;"))
+    assert list(stmts.concretize(None, None)) == ["a;\nc;", "b;\nc;"]
+
+
+def test_concretize_statementlist_streams():
+    # 6 ** 16 candidates: far too many to materialize before yielding the first.
+    stmts = StatementList(
+        *[IfStmt(BinaryBoolOperator(Lit("x"), Lit("y")), Lit("z;")) for _ in range(16)]
+    )
+    first = next(stmts.concretize(None, None))
+    assert first == "\n".join(["if (x == y) {\nz;\n}\n"] * 16)
+
+
+def test_concretize_product_concretizes_once():
+    concretizations = []
+
+    class Counted(Expression):
+        def __init__(self, name):
+            self.name = name
+
+        def concretize(self, _db, _location):
+            concretizations.append(self.name)
+            yield from [f"{self.name}1", f"{self.name}2", f"{self.name}3"]
+
+    lhs, rhs = Counted("x"), Counted("y")
+    expr = LessThanExpr(lhs, rhs)
+    assert len(list(expr.concretize(None, None))) == 9
+    assert sorted(concretizations) == ["x", "y"]
+
+
+def test_patchtemplate_count_nth_sample(test_files, tmp_db):
+    tourniquet = Tourniquet(tmp_db)
+    test_file = test_files / "patch_test.c"
+    tourniquet.collect_info(test_file)
+
+    template = PatchTemplate(
+        FixPattern(
+            IfStmt(BinaryBoolOperator(Variable(), Variable()), NodeStmt()),
+            ElseStmt(ReturnStmt(BinaryMathOperator(Lit("1"), StaticBufferSize()))),
+        )
+    )
+    db = tourniquet.db
+    location = L(test_file, SC(23, 3))
+
+    count = template.count(db, location)
+    assert count == (6 * 6 * 6) * 5
+
+    # Indexing into the candidate space agrees with enumeration.
+    concretized = list(template.concretize(db, location))
+    assert [template.nth(db, location, i) for i in range(count)] == concretized
+
+    with pytest.raises(IndexError):
+        template.nth(db, location, count)
+
+    sample = template.sample(db, location, 10, seed=1)
+    assert len(set(sample)) == 10
+    assert set(sample) <= set(concretized)
+    assert template.sample(db, location, 10, seed=1) == sample
+
+
+def test_patchtemplate_sample_distinct():
+    class Duplicates(Expression):
+        def concretize(self, _db, _location):
+            yield from ["a;", "a;", "a;", "b;", "c;"]
+
+    # 25 candidates in the space, but only 9 distinct ones.
+    template = PatchTemplate(FixPattern(Duplicates(), Duplicates()))
+    assert template.count(None, None) == 25
+
+    for seed in range(10):
+        sample = template.sample(None, None, 9, seed=seed)
+        assert len(set(sample)) == 9
+
+    with pytest.raises(ValueError):
+        template.sample(None, None, 10)
+
+
+def test_random_indices_permutation():
+    for count in [0, 1, 2, 3, 7, 16, 100, 1000]:
+        indices = list(_random_indices(random.Random(count), count))
+        assert sorted(indices) == list(range(count))
+
+    # Drawing from an enormous candidate space doesn't materialize it.
+    count = 10**30
+    indices = list(itertools.islice(_random_indices(random.Random(0), count), 1000))
+    assert len(set(indices)) == 1000
+    assert all(0 <= index < count for index in indices)
+
+
+def test_ifstmt_count_includes_duplicates():
+    class Duplicates(Expression):
+        def concretize(self, _db, _location):
+            yield from ["a;", "a;"]
+
+    stmt = IfStmt(Lit("x"), Duplicates())
+    assert list(stmt.concretize(None, None)) == ["if (x) {\na;\n}\n"]
+    assert stmt.count(None, None) == 2
+    assert stmt.nth(None, None, 1) == stmt.nth(None, None, 0)
+
+
 # TODO(ww): Tests for:
 # * Statement
-# * StatementList
-# * PatchTemplate
 
 
 def test_fixpattern():
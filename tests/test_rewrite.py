@@ -0,0 +1,60 @@
+import pytest
+
+from tourniquet.location import SourceCoordinate as SC
+from tourniquet.rewrite import SourceBuffer
+
+
+@pytest.mark.parametrize(
+    "source, length",
+    [
+        (b"foo_bar1 + 1", 8),
+        (b"0x1p-3f;", 7),
+        (b'"a \\" b"x;', 9),
+        (b"L'x' ", 4),
+        (b'R"(a ) b)";', 10),
+        (b">>= 1", 3),
+        (b"->x", 2),
+        (b");", 1),
+        # Digraphs.
+        (b"<:0:>", 2),
+        (b"%:%: x", 4),
+        (b"%>;", 2),
+        # Line splices, which can appear anywhere in a token.
+        (b"foo\\\nbar;", 8),
+        (b"foo\\ \r\nbar;", 10),
+        (b"+\\\n= 1", 4),
+        (b'"a\\\nb";', 6),
+        (b"foo \\\nbar", 3),
+    ],
+)
+def test_sourcebuffer_token_end(source, length):
+    buffer = SourceBuffer(source)
+    assert buffer.token_end(SC(1, 1)) == length
+
+
+def test_sourcebuffer_replace(test_files):
+    test_file = test_files / "patch_test.c"
+    buffer = SourceBuffer.from_file(test_file)
+
+    # strcpy(buff, pov) spans (32, 3) through the start of its last token, at (32, 19).
+    patched = buffer.replace(SC(32, 3), SC(32, 19), "if (len < buff_len) { strcpy(buff, pov); }")
+    lines = patched.decode().splitlines()
+    assert lines[31] == "  if (len < buff_len) { strcpy(buff, pov); };"
+
+    # Every other line is untouched.
+    original = test_file.read_text().splitlines()
+    assert lines[:31] == original[:31]
+    assert lines[32:] == original[32:]
+
+
+def test_sourcebuffer_replace_line_splice():
+    buffer = SourceBuffer(b"int main(void) {\n  return ma\\\nin_result;\n}\n")
+
+    # The statement's last token continues past the line splice.
+    patched = buffer.replace(SC(2, 3), SC(2, 10), "return 0")
+    assert patched == b"int main(void) {\n  return 0;\n}\n"
+
+
+def test_sourcebuffer_multiline_replace():
+    buffer = SourceBuffer(b"int x;\nfoo(\n  1,\n  2);\nint y;\n")
+    assert buffer.replace(SC(2, 1), SC(4, 4), "bar()") == b"int x;\nbar();\nint y;\n"
@@ -0,0 +1,140 @@
+import pytest
+
+from tourniquet import Tourniquet
+from tourniquet.location import Location as L
+from tourniquet.location import SourceCoordinate as SC
+from tourniquet.patch_lang import (
+    Expression,
+    FixPattern,
+    IfStmt,
+    LessThanExpr,
+    NodeStmt,
+    PatchTemplate,
+    Variable,
+)
+from tourniquet.search import (
+    BreadthFirstSearch,
+    ContextScorer,
+    EnumerationSearch,
+    HeuristicSearch,
+    RandomSearch,
+)
+from tourniquet.validation import Validator, Verdict
+
+
+@pytest.fixture
+def tourniquet(test_files, tmp_db):
+    tourniquet = Tourniquet(tmp_db)
+    tourniquet.collect_info(test_files / "patch_test.c")
+    tourniquet.register_template(
+        "guard", PatchTemplate(FixPattern(IfStmt(LessThanExpr(Variable(), Variable()), NodeStmt())))
+    )
+    return tourniquet
+
+
+@pytest.fixture
+def location(test_files):
+    # strcpy(buff, pov);
+    return L(test_files / "patch_test.c", SC(32, 3))
+
+
+def test_enumeration_search(tourniquet, location):
+    assert list(tourniquet.concretize_template("guard", location, EnumerationSearch())) == list(
+        tourniquet.concretize_template("guard", location)
+    )
+
+
+@pytest.mark.parametrize("strategy", [BreadthFirstSearch(), RandomSearch(seed=1)])
+def test_reordering_search(tourniquet, location, strategy):
+    enumerated = list(tourniquet.concretize_template("guard", location))
+    candidates = list(tourniquet.concretize_template("guard", location, strategy))
+
+    # Every candidate is still tried exactly once, just in a different order.
+    assert len(candidates) == len(enumerated) == 36
+    assert set(candidates) == set(enumerated)
+    assert candidates != enumerated
+
+
+def test_breadth_first_search(tourniquet, location):
+    enumerated = list(tourniquet.concretize_template("guard", location))
+    candidates = tourniquet.concretize_template("guard", location, BreadthFirstSearch())
+
+    # The enumeration is sampled at its start, then its middle, then its quarters.
+    assert [next(candidates) for _ in range(4)] == [enumerated[i] for i in (0, 32, 16, 8)]
+
+
+def test_random_search_limit(tourniquet, location):
+    strategy = RandomSearch(seed=1, limit=5)
+    candidates = list(tourniquet.concretize_template("guard", location, strategy))
+    assert len(candidates) == 5
+    assert candidates == list(tourniquet.concretize_template("guard", location, strategy))
+
+
+def test_random_search_limit_distinct():
+    class Duplicates(Expression):
+        def concretize(self, _db, _location):
+            yield from ["a;", "a;", "a;", "b;", "c;"]
+
+    template = PatchTemplate(FixPattern(Duplicates(), Duplicates()))
+    for seed in range(10):
+        candidates = list(RandomSearch(seed=seed, limit=9).candidates(template, None, None))
+        assert len(set(candidates)) == len(candidates) == 9
+
+
+def test_context_scorer(tourniquet, location):
+    score = ContextScorer(tourniquet.db, location)
+
+    # The statement references buff and pov; nothing else shares their types.
+    assert score("buff < pov") == 4
+    assert score("len < buff_len") == -2
+    assert score("sizeof(buff) < strlen(pov)") == 4
+
+
+@pytest.mark.parametrize("window", [1, 8, 1024])
+def test_heuristic_search(tourniquet, location, window):
+    score = ContextScorer(tourniquet.db, location)
+    enumerated = list(tourniquet.concretize_template("guard", location))
+    candidates = list(
+        tourniquet.concretize_template("guard", location, HeuristicSearch(window=window))
+    )
+
+    assert sorted(candidates) == sorted(enumerated)
+    # The first candidate is the best of those that fit in the queue (the first of
+    # them, on ties), along with the one that pushed it out.
+    lookahead = enumerated[: window + 1]
+    assert candidates[0] == max(lookahead, key=score)
+    if window >= len(enumerated):
+        assert [score(c) for c in candidates] == sorted(
+            (score(c) for c in enumerated), reverse=True
+        )
+
+
+def test_heuristic_search_prunes(tourniquet, location):
+    score = ContextScorer(tourniquet.db, location)
+    strategy = HeuristicSearch(min_score=score("strcpy(buff, pov);") + 4)
+    candidates = list(tourniquet.concretize_template("guard", location, strategy))
+
+    # Only the candidates that compare buff and pov with each other are left.
+    conditions = {c.split(" {")[0] for c in candidates}
+    assert conditions == {f"if ({a} < {b})" for a in ("buff", "pov") for b in ("buff", "pov")}
+
+
+def test_heuristic_search_invalid_window():
+    with pytest.raises(ValueError):
+        HeuristicSearch(window=0)
+
+
+def test_auto_patch_strategy(tourniquet, location):
+    # A custom scorer that knows the fix; it's validated first, out of 36 candidates.
+    strategy = HeuristicSearch(scorer=lambda db, location: lambda c: int("(len < buff_len)" in c))
+    report = tourniquet.validate_template(
+        "guard",
+        [("aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa", 2), ("password", 0)],
+        location,
+        validator=Validator(jobs=1),
+        strategy=strategy,
+    )
+
+    assert report.results[0].verdict == Verdict.PASSED
+    assert "(len < buff_len)" in report.patch
+    assert len(report.results) <= 2
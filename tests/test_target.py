@@ -0,0 +1,57 @@
+import subprocess
+
+import pytest
+
+from tourniquet.target import Target
+
+
+@pytest.fixture
+def multi_file_target(tmp_path):
+    helper = tmp_path / "helper.c"
+    helper.write_text("int helper(int x) { return x + 1; }\n")
+    main = tmp_path / "main.c"
+    main.write_text(
+        "#include <stdlib.h>\n"
+        "int helper(int x);\n"
+        "int main(int argc, char *argv[]) { return helper(atoi(argv[1])); }\n"
+    )
+    return Target(
+        str(main), [("1", 2)], [], str(tmp_path / "main"), sources=[str(main), str(helper)]
+    )
+
+
+def test_object_for_is_cached(multi_file_target, tmp_path):
+    helper = tmp_path / "helper.c"
+    obj = multi_file_target.object_for(helper)
+    assert obj is not None and obj.is_file()
+
+    # Unchanged sources reuse their object.
+    mtime = obj.stat().st_mtime_ns
+    assert multi_file_target.object_for(helper) == obj
+    assert obj.stat().st_mtime_ns == mtime
+
+    # Changed sources are recompiled.
+    helper.write_text("int helper(int x) { return x + 2; }\n")
+    assert multi_file_target.object_for(helper) == obj
+
+    helper.write_text("this is not C\n")
+    assert multi_file_target.object_for(helper) is None
+
+
+def test_incremental_build(multi_file_target, tmp_path):
+    build = multi_file_target.incremental_build()
+    assert build is not None
+    assert len(build.objects) == 1
+
+    patched = tmp_path / "scratch" / "main.c"
+    patched.parent.mkdir()
+    patched.write_text((tmp_path / "main.c").read_text().replace("atoi(argv[1])", "2"))
+    executable = patched.parent / "target"
+    assert build.build(patched, executable)
+    assert subprocess.call([str(executable), "1"]) == 3
+
+    # The other translation units are compiled once, and shared by every build.
+    assert multi_file_target.incremental_build() == build
+
+    patched.write_text("int main(void) { return missing(); }\n")
+    assert not build.build(patched, executable)
@@ -1,9 +1,18 @@
+import asyncio
+import json
+import shutil
+import sqlite3
+from pathlib import Path
+
 import pytest
 
 from tourniquet import Tourniquet
+from tourniquet.async_validation import AsyncValidator
+from tourniquet.error import BuildError
+from tourniquet.limits import ResourceLimits
 from tourniquet.location import Location as L
 from tourniquet.location import SourceCoordinate as SC
-from tourniquet.models import Function, Global, Module
+from tourniquet.models import Function, Global, Module, Statement
 from tourniquet.patch_lang import (
     ElseStmt,
     Expression,
@@ -15,6 +24,8 @@ from tourniquet.patch_lang import (
     PatchTemplate,
     ReturnStmt,
 )
+from tourniquet.target import Target
+from tourniquet.validation import Validator, Verdict
 
 
 def test_tourniquet_extract_ast(test_files, tmp_db):
@@ -78,6 +89,331 @@ def test_tourniquet_db(test_files, tmp_db):
     # TODO(ww): Test main.{var_decls,calls,statements}
 
 
+def test_tourniquet_db_batched(test_files, tmp_db):
+    # A tiny batch size forces many intermediate flushes, which shouldn't change
+    # what ends up in the database.
+    tourniquet = Tourniquet(tmp_db, batch_size=3)
+    test_file = test_files / "patch_test.c"
+    tourniquet.collect_info(test_file)
+
+    main = tourniquet.db.query(Function).filter_by(name="main").one()
+    assert main.module.name == str(test_file)
+    assert len(main.var_decls) == 6
+    assert len(main.calls) == 4
+    assert len(main.statements) == 8
+
+    strcpy = next(call for call in main.calls if call.name == "strcpy")
+    assert [arg.name for arg in strcpy.arguments] == ["buff", "pov"]
+
+
+def _db_contents(tourniquet):
+    # Everything in the database, without row IDs, which depend on insertion order.
+    functions = {
+        function.name: (
+            function.start_coordinate,
+            function.end_coordinate,
+            sorted((v.name, v.type_, v.is_array, v.size, v.start_line) for v in function.var_decls),
+            sorted(
+                (
+                    c.name,
+                    c.expr,
+                    c.start_line,
+                    c.start_column,
+                    [(a.name, a.type_) for a in c.arguments],
+                )
+                for c in function.calls
+            ),
+            sorted((s.expr, s.start_line, s.start_column) for s in function.statements),
+        )
+        for function in tourniquet.db.query(Function)
+    }
+    globals_ = sorted((g.name, g.type_, g.is_array, g.size) for g in tourniquet.db.query(Global))
+    return functions, globals_
+
+
+def test_tourniquet_db_columnar(test_files, tmp_path):
+    test_file = test_files / "patch_test.c"
+
+    tourniquet = Tourniquet(tmp_path / "rows.db")
+    tourniquet.collect_info(test_file)
+
+    columnar = Tourniquet(tmp_path / "columnar.db", columnar=True)
+    ast_info = columnar._extract_ast(test_file)
+    assert "strings" in ast_info
+    assert ast_info["module_name"] == str(test_file)
+    columnar.collect_info(test_file)
+
+    # Both extraction formats produce the same database contents.
+    assert _db_contents(columnar) == _db_contents(tourniquet)
+    assert len(columnar.db.query(Function).filter_by(name="main").one().statements) == 8
+
+
+def test_store_ast_redeclared_function(tmp_db):
+    tourniquet = Tourniquet(tmp_db)
+    tourniquet._store_ast(
+        {
+            "module_name": "/redeclared.c",
+            "globals": [],
+            "functions": {
+                "f": [
+                    ["func_decl", 1, 1, 3, 1],
+                    ["stmt_type", 2, 3, 2, 12, "return 0;"],
+                    ["func_decl", 5, 1, 5, 10],
+                ]
+            },
+        }
+    )
+
+    # As in the columnar format, the first declaration wins.
+    function = tourniquet.db.query(Function).filter_by(name="f").one()
+    assert (function.start_line, function.end_line) == (1, 3)
+    assert [statement.expr for statement in function.statements] == ["return 0;"]
+
+
+def test_collect_project_directory(test_files, tmp_db):
+    tourniquet = Tourniquet(tmp_db)
+    stats = tourniquet.collect_project(test_files, jobs=2)
+
+    assert not stats.failed
+    assert set(stats.collected) == set(test_files.glob("*.c"))
+    assert tourniquet.db.query(Module).count() == len(stats.collected)
+
+
+def test_collect_project_failed_store(test_files, tmp_db, monkeypatch):
+    tourniquet = Tourniquet(tmp_db)
+    store = tourniquet._store_ast
+    broken = test_files / "patch_test.c"
+
+    def store_or_fail(ast_info, *state):
+        if ast_info["module_name"] == str(broken):
+            raise RuntimeError("store failed")
+        store(ast_info, *state)
+
+    monkeypatch.setattr(tourniquet, "_store_ast", store_or_fail)
+    stats = tourniquet.collect_project(test_files, jobs=2)
+
+    # The failure is recorded, and every other file is still collected.
+    assert set(stats.failed) == {broken}
+    assert set(stats.collected) == set(test_files.glob("*.c")) - {broken}
+    assert tourniquet.db.query(Module).count() == len(stats.collected)
+
+
+def test_collect_project_compile_commands(test_files, tmp_path, tmp_db):
+    compile_commands = tmp_path / "compile_commands.json"
+    compile_commands.write_text(
+        json.dumps(
+            [
+                {
+                    "directory": str(test_files),
+                    "file": "patch_test.c",
+                    "command": "cc -c patch_test.c",
+                },
+                {
+                    "directory": str(test_files),
+                    "file": "missing.c",
+                    "arguments": ["cc", "-c", "missing.c"],
+                },
+            ]
+        )
+    )
+
+    tourniquet = Tourniquet(tmp_db)
+    stats = tourniquet.collect_project(compile_commands, jobs=2)
+
+    assert stats.collected == [test_files / "patch_test.c"]
+    assert list(stats.failed) == [test_files / "missing.c"]
+    assert tourniquet.db.query(Function).filter_by(name="main").one()
+
+
+def test_collect_info_compile_commands(tmp_path, tmp_db):
+    (tmp_path / "include").mkdir()
+    (tmp_path / "include" / "config.h").write_text("#define GLOBAL_TYPE long\n")
+    test_file = tmp_path / "defines_test.c"
+    test_file.write_text('#include "config.h"\nGLOBAL_TYPE GLOBAL_NAME = 42;\n')
+
+    compile_commands = tmp_path / "compile_commands.json"
+    compile_commands.write_text(
+        json.dumps(
+            [
+                {
+                    "directory": str(tmp_path),
+                    "file": "defines_test.c",
+                    "command": "cc -Iinclude -DGLOBAL_NAME=answer -c defines_test.c",
+                }
+            ]
+        )
+    )
+
+    tourniquet = Tourniquet(tmp_db, compile_commands=compile_commands)
+    assert tourniquet.collect_info(test_file)
+
+    answer = tourniquet.db.query(Global).filter_by(name="answer").one()
+    assert answer.type_ == "long"
+
+    # Explicit arguments take precedence over the compilation database's.
+    other = Tourniquet(tmp_path / "other.db")
+    assert other.collect_info(test_file, args=[f"-I{tmp_path / 'include'}", "-DGLOBAL_NAME=other"])
+    assert other.db.query(Global).filter_by(name="other").one().type_ == "long"
+
+
+def test_collect_info_incremental(test_files, tmp_path, tmp_db):
+    test_file = tmp_path / "patch_test.c"
+    shutil.copyfile(test_files / "patch_test.c", test_file)
+
+    tourniquet = Tourniquet(tmp_db)
+    assert tourniquet.collect_info(test_file)
+
+    # Unchanged files are skipped, even if they've been touched.
+    assert not tourniquet.collect_info(test_file)
+    test_file.touch()
+    assert not tourniquet.collect_info(test_file)
+
+    # Changed files replace their previous contents, rather than duplicating them.
+    with test_file.open("a") as io:
+        io.write("/* a trailing comment */\n")
+    assert tourniquet.collect_info(test_file)
+
+    assert tourniquet.db.query(Module).count() == 1
+    main = tourniquet.db.query(Function).filter_by(name="main").one()
+    assert len(main.var_decls) == 6
+    assert len(main.calls) == 4
+    assert len(main.statements) == 8
+
+
+def test_collect_info_arguments_changed(tmp_path, tmp_db):
+    test_file = tmp_path / "defines_test.c"
+    test_file.write_text("GLOBAL_TYPE GLOBAL_NAME = 42;\n")
+
+    tourniquet = Tourniquet(tmp_db)
+    assert tourniquet.collect_info(test_file, args=["-DGLOBAL_TYPE=int", "-DGLOBAL_NAME=before"])
+    assert not tourniquet.collect_info(
+        test_file, args=["-DGLOBAL_TYPE=int", "-DGLOBAL_NAME=before"]
+    )
+
+    # The file is unchanged, but it parses differently under new arguments.
+    assert tourniquet.collect_info(test_file, args=["-DGLOBAL_TYPE=int", "-DGLOBAL_NAME=after"])
+    assert [global_.name for global_ in tourniquet.db.query(Global)] == ["after"]
+
+
+def test_collect_info_failed_store(test_files, tmp_path, tmp_db, monkeypatch):
+    test_file = tmp_path / "patch_test.c"
+    shutil.copyfile(test_files / "patch_test.c", test_file)
+    other_file = tmp_path / "other.c"
+    other_file.write_text("int other(void) { return 0; }\n")
+
+    tourniquet = Tourniquet(tmp_db)
+    assert tourniquet.collect_info(test_file)
+
+    def fail(*_):
+        raise RuntimeError("insert failed")
+
+    with test_file.open("a") as io:
+        io.write("/* a trailing comment */\n")
+    with monkeypatch.context() as m:
+        m.setattr(tourniquet, "_insert_ast", fail)
+        m.setattr(tourniquet, "_insert_columnar_ast", fail)
+        with pytest.raises(RuntimeError):
+            tourniquet.collect_info(test_file)
+
+    # The failed re-collection is rolled back, rather than committed with the next file.
+    assert tourniquet.collect_info(other_file)
+    main = tourniquet.db.query(Function).filter_by(name="main").one()
+    assert len(main.var_decls) == 6
+    assert tourniquet.db.function_at(L(test_file, SC(23, 3))) is not None
+
+
+def test_collect_info_relative_path(test_files, tmp_path, tmp_db, monkeypatch):
+    test_file = tmp_path / "patch_test.c"
+    shutil.copyfile(test_files / "patch_test.c", test_file)
+
+    tourniquet = Tourniquet(tmp_db)
+    assert tourniquet.collect_info(test_file)
+
+    # Every spelling of the same file refers to the same module.
+    monkeypatch.chdir(tmp_path)
+    assert not tourniquet.collect_info(Path("patch_test.c"))
+    assert not tourniquet.collect_info("patch_test.c")
+    assert tourniquet.db.query(Module).count() == 1
+    assert tourniquet.db.statement_at(L(Path("patch_test.c"), SC(32, 3))) is not None
+
+
+def test_db_migrates_old_schema(tmp_db):
+    conn = sqlite3.connect(str(tmp_db))
+    conn.execute("CREATE TABLE modules (id INTEGER NOT NULL PRIMARY KEY, name VARCHAR NOT NULL)")
+    conn.commit()
+    conn.close()
+
+    tourniquet = Tourniquet(tmp_db)
+    assert tourniquet.db.module_named("does-not-exist") is None
+
+
+def test_db_migrates_missing_indexes(tmp_db):
+    Tourniquet(tmp_db)
+
+    conn = sqlite3.connect(str(tmp_db))
+    conn.execute("DROP INDEX ix_statements_location")
+    conn.commit()
+
+    Tourniquet(tmp_db)
+    indexes = {
+        row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+    }
+    conn.close()
+    assert "ix_statements_location" in indexes
+    assert "ix_functions_span" in indexes
+
+
+def test_db_module_index(test_files, tmp_db):
+    tourniquet = Tourniquet(tmp_db, indexed=True)
+    test_file = test_files / "patch_test.c"
+    tourniquet.collect_info(test_file)
+    db = tourniquet.db
+
+    main = db.function_at(L(test_file, SC(32, 3)))
+    assert main is not None and main.name == "main"
+    assert db.function_at(L(test_file, SC(22, 1))) == main
+    assert db.function_at(L(test_file, SC(38, 1))) == main
+    assert db.function_at(L(test_file, SC(20, 1))) is None
+    assert db.function_at(L(test_file, SC(38, 2))) is None
+
+    strcpy = db.statement_at(L(test_file, SC(32, 3)))
+    assert strcpy is not None and strcpy.expr == "strcpy(buff, pov)"
+    assert db.statement_at(L(test_file, SC(32, 4))) is None
+
+
+def test_db_module_index_matches_sql(test_files, tmp_db):
+    tourniquet = Tourniquet(tmp_db)
+    tourniquet.collect_project(test_files)
+    db = tourniquet.db
+
+    def lookups(location):
+        function = db.function_at(location)
+        statement = db.statement_at(location)
+        return (
+            function.id if function is not None else None,
+            statement.id if statement is not None else None,
+        )
+
+    # Every statement's start and end, and every point around each of them.
+    points = set()
+    for statement in db.query(Statement):
+        for line, column in (
+            (statement.start_line, statement.start_column),
+            (statement.end_line, statement.end_column),
+        ):
+            for dline in (-1, 0, 1):
+                for dcolumn in range(-3, 4):
+                    location = L(Path(statement.module_name), SC(line + dline, column + dcolumn))
+                    points.add(location)
+    assert points
+
+    for location in points:
+        db.indexed = False
+        expected = lookups(location)
+        db.indexed = True
+        assert lookups(location) == expected, location
+
+
 def test_tourniquet_extract_ast_invalid_file(test_files, tmp_db):
     test_extractor = Tourniquet(tmp_db)
     test_file = test_files / "does-not-exist"
@@ -129,3 +465,115 @@ def test_auto_patch(test_files, tmp_db):
         )
         is not None
     )
+
+
+def test_patch(test_files, tmp_db):
+    tourniquet = Tourniquet(tmp_db)
+    test_file = test_files / "patch_test.c"
+    tourniquet.collect_info(test_file)
+
+    original = test_file.read_bytes()
+    location = L(test_file, SC(32, 3))
+    with tourniquet.patch("first()", location) as first, tourniquet.patch(
+        "second()", location
+    ) as second:
+        # Patches never touch the original file, so several can be applied at once.
+        assert test_file.read_bytes() == original
+        assert first.contents == original.replace(b"strcpy(buff, pov)", b"first()")
+        assert second.path.read_bytes() == original.replace(b"strcpy(buff, pov)", b"second()")
+
+        # Each patch's overlay maps its patched copy over the original path.
+        assert first.compiler_args[0] == "-ivfsoverlay"
+        overlay = json.loads(Path(first.compiler_args[1]).read_text())
+        [root] = overlay["roots"]
+        assert root["name"] == str(test_file.parent)
+        assert root["contents"] == [
+            {"name": test_file.name, "type": "file", "external-contents": str(first.path)}
+        ]
+
+    assert not first.path.exists()
+    assert test_file.read_bytes() == original
+
+
+@pytest.mark.parametrize("clang_rewrite", [False, True])
+@pytest.mark.parametrize("hot_swap", [False, True])
+def test_validate_template(test_files, tmp_db, clang_rewrite, hot_swap):
+    tourniquet = Tourniquet(tmp_db)
+    test_file = test_files / "patch_test.c"
+    tourniquet.collect_info(test_file)
+
+    location = L(test_file, SC(32, 3))
+    template = PatchTemplate(
+        FixPattern(
+            IfStmt(LessThanExpr(Lit("len"), Lit("buff_len")), NodeStmt()),
+            ElseStmt(ReturnStmt(Lit("1"))),
+        ),
+    )
+    tourniquet.register_template("buffer_guard", template)
+
+    original = test_file.read_text()
+    report = tourniquet.validate_template(
+        "buffer_guard",
+        [("aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa", 1), ("password", 0)],
+        location,
+        validator=Validator(jobs=2, clang_rewrite=clang_rewrite, hot_swap=hot_swap),
+    )
+
+    # Validation happens in scratch copies, so the original file is untouched.
+    assert test_file.read_text() == original
+
+    assert len(report.results) == 1
+    assert report.results[0].verdict == Verdict.PASSED
+    assert report.patch == report.results[0].replacement
+
+
+def test_auto_patch_async(test_files, tmp_db):
+    tourniquet = Tourniquet(tmp_db)
+    test_file = test_files / "patch_test.c"
+    tourniquet.collect_info(test_file)
+
+    tourniquet.register_template(
+        "buffer_guard",
+        PatchTemplate(
+            FixPattern(
+                IfStmt(LessThanExpr(Lit("len"), Lit("buff_len")), NodeStmt()),
+                ElseStmt(ReturnStmt(Lit("1"))),
+            ),
+        ),
+    )
+
+    patch = asyncio.run(
+        tourniquet.auto_patch_async(
+            "buffer_guard",
+            [("aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa", 1), ("password", 0)],
+            L(test_file, SC(32, 3)),
+            validator=AsyncValidator(concurrency=2, limits=ResourceLimits(test_timeout=30)),
+        )
+    )
+    assert patch is not None
+
+
+def test_validate_template_target(test_files, tmp_path, tmp_db):
+    test_file = tmp_path / "patch_test.c"
+    shutil.copyfile(test_files / "patch_test.c", test_file)
+    helper = tmp_path / "helper.c"
+    helper.write_text("int helper(void) { return 0; }\n")
+
+    tourniquet = Tourniquet(tmp_db)
+    tourniquet.collect_info(test_file)
+    # The candidate only links if the target's other translation unit is linked in.
+    tourniquet.register_template(
+        "delegate", PatchTemplate(FixPattern(Lit("int helper(void); return helper()")))
+    )
+
+    tests = [("password", 0)]
+    target = Target(str(test_file), tests, [], "", sources=[str(test_file), str(helper)])
+    report = tourniquet.validate_template(
+        "delegate", tests, L(test_file, SC(32, 3)), validator=Validator(jobs=2), target=target
+    )
+    assert report.results[0].verdict == Verdict.PASSED
+
+    helper.write_text("this is not C\n")
+    broken = Target(str(test_file), tests, [], "", sources=[str(test_file), str(helper)])
+    with pytest.raises(BuildError):
+        tourniquet.validate_template("delegate", tests, L(test_file, SC(32, 3)), target=broken)
@@ -0,0 +1,128 @@
+import json
+import os
+import subprocess
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from tourniquet.limits import ResourceLimits
+from tourniquet.location import SourceCoordinate as SC
+from tourniquet.validation import Validator, Verdict
+
+
+@pytest.mark.parametrize("prioritize", [False, True])
+def test_validate_prioritized(tmp_path, prioritize):
+    source = tmp_path / "program.c"
+    source.write_text("int main(int argc, char *argv[]) {\n  return 0;\n}\n")
+
+    # Every candidate but the last fails only the last test.
+    candidates = ["return 0"] * 5 + ["return argv[1][0] == 'c' ? 7 : 0"]
+    tests = [("a", 0), ("b", 0), ("c", 7)]
+
+    report = Validator(jobs=1, prioritize=prioritize).validate(
+        source, False, SC(2, 3), SC(2, 10), candidates, tests
+    )
+
+    assert [result.verdict for result in report.results] == [Verdict.FAILED] * 5 + [Verdict.PASSED]
+    assert all(result.failed_test == 2 for result in report.results[:5])
+    assert report.results[0].executions == 3
+    assert report.results[-1].executions == 3
+
+    if prioritize:
+        # Once the last test has failed a candidate, it runs first for every later one.
+        assert [result.executions for result in report.results[2:5]] == [1, 1, 1]
+        assert report.saved_executions == 6
+        assert report.executions == 3 + 3 + 1 + 1 + 1 + 3
+    else:
+        assert report.saved_executions == 0
+        assert report.executions == 3 * 6
+
+
+def test_validate_prioritized_cost(tmp_path):
+    source = tmp_path / "program.c"
+    source.write_text("int main(int argc, char *argv[]) {\n  return 0;\n}\n")
+
+    # The first candidates fail only the last test, and the final one fails only the first.
+    fails_a = "return argv[1][0] == 'a' ? 1 : argv[1][0] == 'c' ? 7 : 0"
+    candidates = ["return 0", "return 0", fails_a]
+    tests = [("a", 0), ("b", 0), ("c", 7)]
+
+    report = Validator(jobs=1).validate(source, False, SC(2, 3), SC(2, 10), candidates, tests)
+
+    # Running the last test first costs the final candidate an execution.
+    assert [result.failed_test for result in report.results] == [2, 2, 0]
+    assert [result.executions for result in report.results] == [3, 3, 2]
+    assert report.saved_executions == -1
+
+
+@pytest.mark.parametrize("hot_swap", [False, True])
+def test_validate_hang(tmp_path, hot_swap):
+    source = tmp_path / "program.c"
+    source.write_text("int main(int argc, char *argv[]) {\n  return 0;\n}\n")
+
+    validator = Validator(jobs=1, hot_swap=hot_swap, limits=ResourceLimits(test_timeout=0.5))
+    report = validator.validate(
+        source, False, SC(2, 3), SC(2, 10), ["for (;;) {}", "return 0"], [("a", 0)]
+    )
+
+    assert [result.verdict for result in report.results] == [Verdict.HANG, Verdict.PASSED]
+    assert report.results[0].failed_test == 0
+
+
+def test_validate_earliest_patch(tmp_path):
+    source = tmp_path / "program.c"
+    source.write_text("#include <unistd.h>\nint main(int argc, char *argv[]) {\n  return 1;\n}\n")
+
+    # The later candidate passes first, but the earlier one is still the patch.
+    candidates = ["sleep(1); return 0", "return 0"]
+    report = Validator(jobs=2).validate(source, False, SC(3, 3), SC(3, 10), candidates, [("a", 0)])
+
+    assert [result.verdict for result in report.results] == [Verdict.PASSED, Verdict.PASSED]
+    assert report.patch == candidates[0]
+
+
+def test_validate_candidate_error(tmp_path):
+    source = tmp_path / "program.c"
+    source.write_text("int main(int argc, char *argv[]) {\n  return 1;\n}\n")
+
+    # A lone surrogate can't be encoded into the patched source, so that candidate
+    # raises in its worker; the candidates around it are still validated.
+    candidates = ["return 1", "\udc80", "return 0"]
+    report = Validator(jobs=1).validate(source, False, SC(2, 3), SC(2, 10), candidates, [("a", 0)])
+
+    assert [result.verdict for result in report.results] == [
+        Verdict.FAILED,
+        Verdict.ERROR,
+        Verdict.PASSED,
+    ]
+    assert "UnicodeEncodeError" in report.results[1].error
+    assert report.patch == "return 0"
+
+
+def _supports_overlay(compiler):
+    # An empty file isn't a valid overlay, so Clang would reject it even
+    # though it supports overlays; we probe with the smallest valid one instead.
+    with tempfile.TemporaryDirectory() as directory:
+        overlay = Path(directory) / "overlay.yaml"
+        overlay.write_text(json.dumps({"version": 0, "roots": []}))
+        ret = subprocess.call(
+            [compiler, "-ivfsoverlay", str(overlay), "-fsyntax-only", "-x", "c", os.devnull],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+    return ret == 0
+
+
+@pytest.mark.skipif(not _supports_overlay("clang"), reason="compiler doesn't support overlays")
+def test_validate_overlay(tmp_path):
+    source = tmp_path / "program.c"
+    source.write_text('#include "value.h"\nint main(int argc, char *argv[]) {\n  return 0;\n}\n')
+    (tmp_path / "value.h").write_text("#define VALUE 3\n")
+
+    report = Validator(jobs=1, overlay=True).validate(
+        source, False, SC(3, 3), SC(3, 10), ["return 1", "return VALUE"], [("a", 3)]
+    )
+
+    assert [result.verdict for result in report.results] == [Verdict.FAILED, Verdict.PASSED]
+    assert source.read_text().count("return 0") == 1
@@ -0,0 +1,226 @@
+import asyncio
+import itertools
+import os
+import tempfile
+import weakref
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .error import BuildError
+from .limits import ResourceLimits, call_async
+from .location import SourceCoordinate
+from .rewrite import SourceBuffer
+from .target import IncrementalBuild, Target
+from .validation import CandidateResult, ValidationReport, Verdict, _TestPriorities
+
+
+class AsyncValidator:
+    """
+    Validates candidate patches concurrently, from a single `asyncio` event loop.
+
+    This is the `asyncio` counterpart to `tourniquet.validation.Validator`: rather than
+    a pool of worker processes, every compile and test run is a child process that the
+    event loop waits on. The children aren't `asyncio` subprocesses, which are reaped as
+    soon as they exit: each child is polled without being reaped, backing off to at most
+    50ms between polls, so that its process group can be killed before its process ID can
+    be reused (see `tourniquet.limits.call_async`). The number of children running at
+    once is bounded by a semaphore, which is shared by every validation that runs
+    concurrently on the same validator.
+    """
+
+    def __init__(
+        self,
+        concurrency: Optional[int] = None,
+        compiler: str = "clang",
+        limits: Optional[ResourceLimits] = None,
+        prioritize: bool = True,
+    ):
+        """
+        Create a new `AsyncValidator`.
+
+        Args:
+            concurrency: The number of subprocesses to run at once. Defaults to the
+                number of CPUs
+            compiler: The compiler to build each candidate with
+            limits: The timeouts and resource limits to build and test each candidate
+                under (see `tourniquet.validation.Validator`)
+            prioritize: Whether to run the tests that have failed the most candidates so
+                far first (see `tourniquet.validation.Validator`)
+        """
+        self.concurrency = concurrency or os.cpu_count() or 1
+        self.compiler = compiler
+        self.limits = limits
+        self.prioritize = prioritize
+        # Semaphores belong to a single event loop, so each loop that runs
+        # validations on this validator gets its own, on first use.
+        self._semaphores: (
+            "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]"
+        ) = weakref.WeakKeyDictionary()
+
+    async def _call(
+        self, args: List[str], timeout: Optional[float], limits: ResourceLimits
+    ) -> Optional[int]:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.concurrency)
+        async with semaphore:
+            return await call_async(args, timeout, limits)
+
+    async def _validate_candidate(
+        self,
+        source: Path,
+        buffer: SourceBuffer,
+        start: SourceCoordinate,
+        end: SourceCoordinate,
+        tests: List[Tuple[str, int]],
+        build: Optional[IncrementalBuild],
+        limits: ResourceLimits,
+        index: int,
+        replacement: str,
+        order: List[int],
+    ) -> CandidateResult:
+        with tempfile.TemporaryDirectory(prefix="tourniquet-") as scratch:
+            scratch_dir = Path(scratch)
+            patched = scratch_dir / source.name
+            executable = scratch_dir / "target"
+            patched.write_bytes(buffer.replace(start, end, replacement))
+
+            # See `tourniquet.validation` for why the original directory
+            # is on the include path.
+            if build is not None:
+                commands = build.commands(patched, executable, [source.parent])
+            else:
+                commands = [
+                    [
+                        self.compiler,
+                        "-g",
+                        "-I",
+                        str(source.parent),
+                        "-o",
+                        str(executable),
+                        str(patched),
+                    ]
+                ]
+            for command in commands:
+                if await self._call(command, limits.build_timeout, limits) != 0:
+                    return CandidateResult(index, replacement, Verdict.BUILD_FAILED)
+
+            for position, test_index in enumerate(order):
+                input_, output = tests[test_index]
+                ret = await self._call([str(executable), input_], limits.test_timeout, limits)
+                if ret != output:
+                    verdict = Verdict.HANG if limits.hung(ret) else Verdict.FAILED
+                    return CandidateResult(index, replacement, verdict, test_index, position + 1)
+
+        return CandidateResult(index, replacement, Verdict.PASSED, executions=len(order))
+
+    async def validate(
+        self,
+        source: Path,
+        is_cxx: bool,
+        start: SourceCoordinate,
+        end: SourceCoordinate,
+        candidates: Iterable[str],
+        tests: List[Tuple[str, int]],
+        target: Optional[Target] = None,
+    ) -> ValidationReport:
+        """
+        Validate each candidate patch against the given tests, stopping early
+        once a candidate passes. Once a candidate passes, every in-flight candidate after
+        it is cancelled, and its subprocesses killed; those before it still run to
+        completion, so that the report's `patch` is the earliest passing candidate.
+
+        The arguments and return value are the same as
+        `tourniquet.validation.Validator.validate`. The target's unpatched sources are
+        compiled, and candidates are drawn from `candidates`, in the event loop's default
+        executor, so that neither blocks the event loop; `candidates` is only ever
+        consumed from one thread at a time.
+
+        Raises:
+            BuildError: If any of the target's other source files fail to compile.
+        """
+        source = Path(source).resolve()
+        buffer = SourceBuffer.from_file(source)
+        tests = list(tests)
+
+        loop = asyncio.get_running_loop()
+        build = None
+        limits = self.limits or (target.limits if target is not None else ResourceLimits())
+        if target is not None:
+            build = await loop.run_in_executor(None, target.incremental_build, source)
+            if build is None:
+                raise BuildError(f"failed to compile the unpatched sources of {source}")
+
+        report = ValidationReport()
+        priorities = _TestPriorities(len(tests))
+        supplied_order = list(range(len(tests)))
+        candidate_iter = enumerate(candidates)
+        pending: Dict["asyncio.Future[CandidateResult]", Tuple[int, str]] = {}
+
+        async def schedule(count: int):
+            # Drawing a candidate can mean concretizing it against the AST
+            # database, so it's done off the event loop.
+            batch = await loop.run_in_executor(
+                None, lambda: list(itertools.islice(candidate_iter, count))
+            )
+            for index, replacement in batch:
+                order = priorities.order() if self.prioritize else supplied_order
+                task = asyncio.ensure_future(
+                    self._validate_candidate(
+                        source,
+                        buffer,
+                        start,
+                        end,
+                        tests,
+                        build,
+                        limits,
+                        index,
+                        replacement,
+                        order,
+                    )
+                )
+                pending[task] = (index, replacement)
+
+        # As in `Validator`, only a bounded number of candidates are in
+        # flight at once, so that we stop drawing candidates as soon as one passes.
+        first_passed: Optional[int] = None
+        try:
+            await schedule(2 * self.concurrency)
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    index, replacement = pending.pop(task)
+                    if task.cancelled():
+                        result = CandidateResult(index, replacement, Verdict.SKIPPED)
+                    elif task.exception() is not None:
+                        # As in `Validator`, one broken candidate doesn't
+                        # throw away every other candidate's results.
+                        error = f"{type(task.exception()).__name__}: {task.exception()}"
+                        result = CandidateResult(index, replacement, Verdict.ERROR, error=error)
+                    else:
+                        result = task.result()
+                    report.results.append(result)
+                    report.saved_executions += priorities.record(result)
+
+                    if result.verdict == Verdict.PASSED and (
+                        first_passed is None or index < first_passed
+                    ):
+                        # Only later candidates are cancelled: earlier ones may still
+                        # pass, and the earliest passing candidate is the patch.
+                        first_passed = index
+                        for other, (other_index, _) in pending.items():
+                            if other_index > index:
+                                other.cancel()
+
+                if first_passed is None:
+                    await schedule(len(done))
+        finally:
+            # If we're cancelled ourselves, our candidates are too, and we
+            # wait for them so that none of their subprocesses outlive us.
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        report.results.sort(key=lambda result: result.index)
+        return report
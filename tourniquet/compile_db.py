@@ -0,0 +1,161 @@
+import json
+import shlex
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+# Flags that only matter to the compiler driver's outputs, and which
+# would either fail or do nothing in an in-memory, syntax-only parse.
+_DROPPED_FLAGS = {"-c", "-M", "-MM", "-MD", "-MMD", "-MP", "-MG"}
+_DROPPED_FLAGS_WITH_VALUE = {"-o", "-MF", "-MT", "-MQ"}
+
+# Flags that take a path, which is relative to the compilation's
+# working directory rather than ours.
+_JOINED_PATH_FLAGS = (
+    "-I",
+    "-isystem",
+    "-iquote",
+    "-idirafter",
+    "-include",
+    "-imacros",
+    "-isysroot",
+)
+# -include-pch can only be given separately from its path; it's checked before
+# the joined flags above, so it's never mistaken for -include with a path of "-pch".
+_PATH_FLAGS = {*_JOINED_PATH_FLAGS, "-include-pch"}
+
+
+@dataclass(frozen=True)
+class CompileCommand:
+    """
+    Represents a single entry in a Clang-style compilation database.
+    """
+
+    directory: Path
+    """
+    The working directory that the compilation was run in.
+    """
+
+    file: Path
+    """
+    The absolute path to the source file being compiled.
+    """
+
+    arguments: List[str]
+    """
+    The compiler invocation, including the compiler itself.
+    """
+
+    def _absolute(self, path: str) -> str:
+        return str(self.directory / path)
+
+    def _is_file(self, arg: str) -> bool:
+        # Resolving a path hits the filesystem, so we only do it for
+        # arguments that could plausibly name the file.
+        path = self.directory / arg
+        if path == self.file:
+            return True
+        return path.name == self.file.name and path.resolve() == self.file.resolve()
+
+    def extraction_arguments(self) -> List[str]:
+        """
+        Returns the compiler arguments that affect how this command's source file is parsed,
+        e.g. include paths, macro definitions, language standards, and target flags.
+
+        The compiler itself, the source file, and any output-related flags are removed, and
+        relative paths are made absolute so that the arguments can be used from any directory.
+        """
+        arguments: List[str] = []
+        args = iter(self.arguments[1:])
+        for arg in args:
+            if arg in _DROPPED_FLAGS:
+                continue
+            elif arg in _DROPPED_FLAGS_WITH_VALUE:
+                next(args, None)
+            elif arg in _PATH_FLAGS:
+                value = next(args, None)
+                if value is not None:
+                    arguments.extend([arg, self._absolute(value)])
+            elif arg.startswith("-o") or arg.startswith("-MF"):
+                continue
+            elif arg.startswith("--sysroot="):
+                arguments.append("--sysroot=" + self._absolute(arg[len("--sysroot=") :]))
+            elif arg.startswith(_JOINED_PATH_FLAGS):
+                flag = next(flag for flag in _JOINED_PATH_FLAGS if arg.startswith(flag))
+                arguments.append(flag + self._absolute(arg[len(flag) :]))
+            elif not arg.startswith("-") and self._is_file(arg):
+                continue
+            else:
+                arguments.append(arg)
+
+        return arguments
+
+
+class CompilationDatabase:
+    """
+    Represents a Clang-style compilation database, i.e. a `compile_commands.json`.
+    """
+
+    @classmethod
+    def from_file(cls, path: Path):
+        """
+        Load a compilation database from the given `compile_commands.json`.
+
+        Raises:
+            FileNotFoundError: If the supplied path doesn't exist.
+        """
+        path = Path(path)
+        with path.open() as db_file:
+            entries = json.load(db_file)
+
+        commands = []
+        for entry in entries:
+            directory = Path(entry["directory"])
+            file = directory / entry["file"]
+            # Entries can contain either a pre-split "arguments" list
+            # or a single shell-quoted "command" string.
+            if "arguments" in entry:
+                arguments = list(entry["arguments"])
+            else:
+                arguments = shlex.split(entry["command"])
+            commands.append(CompileCommand(directory, file.resolve(), arguments))
+
+        return cls(commands)
+
+    def __init__(self, commands: List[CompileCommand]):
+        self.commands = commands
+        # Files can appear more than once, e.g. when a project builds them
+        # with several configurations. The first entry for each file wins.
+        self._by_file: Dict[Path, CompileCommand] = {}
+        for command in commands:
+            self._by_file.setdefault(command.file, command)
+
+    def __iter__(self) -> Iterator[CompileCommand]:
+        return iter(self.commands)
+
+    def __len__(self) -> int:
+        return len(self.commands)
+
+    @property
+    def files(self) -> List[Path]:
+        """
+        Returns every unique source file in this database, in database order.
+        """
+        return list(self._by_file)
+
+    def command_for(self, file: Path) -> Optional[CompileCommand]:
+        """
+        Returns the command that compiles the given source file, or `None` if the file
+        isn't in this database.
+        """
+        return self._by_file.get(Path(file).resolve())
+
+    def arguments_for(self, file: Path) -> Optional[List[str]]:
+        """
+        Returns the extraction arguments for the given source file (see
+        `CompileCommand.extraction_arguments`), or `None` if the file isn't in this database.
+        """
+        command = self.command_for(file)
+        if command is None:
+            return None
+        return command.extraction_arguments()
@@ -6,6 +6,22 @@ class Error(Exception):
     pass
 
 
+class BuildError(Error):
+    """
+    Raised whenever a target can't be prepared for building candidate patches.
+    """
+
+    pass
+
+
+class ForkServerError(Error):
+    """
+    Raised whenever a fork server can't be started, or dies while running tests.
+    """
+
+    pass
+
+
 class TemplateError(Error):
     """
     A base error for template-related tourniquet exceptions.
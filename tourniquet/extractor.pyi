@@ -1,7 +1,27 @@
 from os import PathLike
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union, overload
 
-def extract_ast(filename: PathLike, is_cxx: bool) -> Dict[str, Any]: ...
+# (replacement, start_line, start_col, end_line, end_col)
+Edit = Tuple[str, int, int, int, int]
+Candidate = Union[Edit, Sequence[Edit]]
+
+class ParsedUnit:
+    def __init__(
+        self, filename: PathLike, is_cxx: bool, args: Optional[Sequence[str]] = None
+    ) -> None: ...
+    def extract_ast(self) -> Dict[str, Any]: ...
+    def extract_ast_columnar(self) -> Dict[str, Any]: ...
+    def rewrite(
+        self, replacement: str, start_line: int, start_col: int, end_line: int, end_col: int
+    ) -> bytes: ...
+    def rewrite_many(self, edits: Sequence[Candidate]) -> List[bytes]: ...
+
+def extract_ast(
+    filename: PathLike, is_cxx: bool, args: Optional[Sequence[str]] = None
+) -> Dict[str, Any]: ...
+def extract_ast_columnar(
+    filename: PathLike, is_cxx: bool, args: Optional[Sequence[str]] = None
+) -> Dict[str, Any]: ...
 def transform(
     filename: PathLike,
     is_cxx: bool,
@@ -10,4 +30,24 @@ def transform(
     start_col: int,
     end_line: int,
     end_col: int,
+    args: Optional[Sequence[str]] = None,
 ): ...
+@overload
+def transform_many(
+    filename: PathLike,
+    is_cxx: bool,
+    edits: Sequence[Candidate],
+    out_dir: None = None,
+    args: Optional[Sequence[str]] = None,
+) -> List[bytes]: ...
+@overload
+def transform_many(
+    filename: PathLike,
+    is_cxx: bool,
+    edits: Sequence[Candidate],
+    out_dir: PathLike,
+    args: Optional[Sequence[str]] = None,
+) -> List[str]: ...
+def set_preamble_cache(directory: Optional[PathLike]) -> None: ...
+def preamble_cache_stats() -> Dict[str, Any]: ...
+def reset_preamble_cache_stats() -> None: ...
@@ -0,0 +1,394 @@
+import os
+import select
+import struct
+import subprocess
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from .error import ForkServerError
+from .harness import _exit_code
+from .limits import ResourceLimits, _preexec, call, kill_group, wait_exited
+
+# The fork server is injected into an unmodified program with LD_PRELOAD.
+# Its constructor runs after the dynamic loader and libc are initialized, but before
+# main, and then forks a child per test; each child returns from the constructor
+# (with the test's input as argv[1]) and runs main as usual.
+#
+# The protocol is AFL's, more or less: the server writes a 4-byte hello on the
+# status pipe, then for each length-prefixed input on the control pipe, it writes
+# back the child's pid and then its raw 4-byte wait status. Each child leads its
+# own process group, so that a hung test can be killed along with its children.
+# The server kills each child's group once the child exits, and only reaps the child
+# when the next input arrives, so that the group's ID can't be reused until the client
+# is done with it.
+_FORK_SERVER_SOURCE = r"""
+#include <signal.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <sys/types.h>
+#include <sys/wait.h>
+#include <unistd.h>
+
+static int transfer(int fd, void *buf, size_t len, int writing) {
+  char *p = (char *)buf;
+  while (len > 0) {
+    ssize_t n = writing ? write(fd, p, len) : read(fd, p, len);
+    if (n <= 0) {
+      return 0;
+    }
+    p += n;
+    len -= (size_t)n;
+  }
+  return 1;
+}
+
+__attribute__((constructor)) static void
+tourniquet_fork_server(int argc, char **argv, char **envp) {
+  int ctl, st;
+  const char *fds = getenv("TOURNIQUET_FORK_SERVER");
+  (void)envp;
+  if (fds == NULL || sscanf(fds, "%d,%d", &ctl, &st) != 2 || argc < 2) {
+    return;
+  }
+  unsetenv("TOURNIQUET_FORK_SERVER");
+
+  uint32_t hello = 0;
+  if (!transfer(st, &hello, sizeof(hello), 1)) {
+    _exit(1);
+  }
+
+  pid_t previous = 0;
+  for (;;) {
+    uint32_t len;
+    int more = transfer(ctl, &len, sizeof(len), 0);
+    if (previous > 0) {
+      waitpid(previous, NULL, 0);
+    }
+    if (!more) {
+      _exit(0);
+    }
+    char *input = (char *)malloc(len + 1);
+    if (input == NULL || !transfer(ctl, input, len, 0)) {
+      _exit(1);
+    }
+    input[len] = '\0';
+
+    pid_t pid = fork();
+    if (pid < 0) {
+      _exit(1);
+    } else if (pid == 0) {
+      setpgid(0, 0);
+      close(ctl);
+      close(st);
+      argv[1] = input;
+      return;
+    }
+    free(input);
+    setpgid(pid, pid);
+
+    uint32_t child = (uint32_t)pid;
+    if (!transfer(st, &child, sizeof(child), 1)) {
+      _exit(1);
+    }
+
+    siginfo_t info;
+    if (waitid(P_PID, (id_t)pid, &info, WEXITED | WNOWAIT) < 0) {
+      _exit(1);
+    }
+    kill(-pid, SIGKILL);
+    previous = pid;
+
+    /* Rebuild the wait status that waitpid would have returned. */
+    uint32_t result;
+    if (info.si_code == CLD_EXITED) {
+      result = ((uint32_t)info.si_status & 0xff) << 8;
+    } else {
+      result = (uint32_t)info.si_status | (info.si_code == CLD_DUMPED ? 0x80 : 0);
+    }
+    if (!transfer(st, &result, sizeof(result), 1)) {
+      _exit(1);
+    }
+  }
+}
+"""
+
+_RUNTIME_DIR: Optional[tempfile.TemporaryDirectory] = None
+# Each compiler's runtime, or None if it failed to compile; either way, we
+# only try once per process, rather than once per candidate.
+_RUNTIMES: Dict[str, Optional[Path]] = {}
+
+_PT_INTERP = 3
+
+
+def _runtime(compiler: str) -> Path:
+    """
+    Returns the fork server's shared object, compiling it (once per process) if necessary.
+
+    Raises:
+        ForkServerError: If the runtime can't be compiled with the given compiler
+    """
+    global _RUNTIME_DIR
+    if compiler not in _RUNTIMES:
+        if _RUNTIME_DIR is None:
+            _RUNTIME_DIR = tempfile.TemporaryDirectory(prefix="tourniquet-forkserver-")
+        source = Path(_RUNTIME_DIR.name) / "forkserver.c"
+        source.write_text(_FORK_SERVER_SOURCE)
+        runtime: Optional[Path] = source.with_name(f"forkserver-{len(_RUNTIMES)}.so")
+        try:
+            # The runtime is C, even if the compiler is a C++ driver.
+            ret = subprocess.call(
+                [compiler, "-shared", "-fPIC", "-O2", "-o", str(runtime), "-x", "c", str(source)],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        except OSError:
+            ret = -1
+        if ret != 0:
+            runtime = None
+        _RUNTIMES[compiler] = runtime
+
+    runtime = _RUNTIMES[compiler]
+    if runtime is None:
+        raise ForkServerError(f"failed to compile the fork server with {compiler}")
+    return runtime
+
+
+def _is_dynamic(executable: Path) -> bool:
+    """
+    Returns whether the given executable is a dynamically linked ELF program, i.e. one
+    with a program interpreter (a `PT_INTERP` program header) to honor `LD_PRELOAD`.
+    """
+    try:
+        with open(executable, "rb") as io:
+            ident = io.read(16)
+            if len(ident) != 16 or ident[:4] != b"\x7fELF" or ident[4] not in (1, 2):
+                return False
+            is_64 = ident[4] == 2
+            endian = "<" if ident[5] == 1 else ">"
+
+            # e_phoff, then (after e_shoff, e_flags, and e_ehsize) e_phentsize and e_phnum.
+            header = io.read(48 if is_64 else 36)
+            fmt = endian + ("16xQ8x4x2xHH" if is_64 else "12xI4x4x2xHH")
+            if len(header) < struct.calcsize(fmt):
+                return False
+            phoff, phentsize, phnum = struct.unpack_from(fmt, header)
+
+            for index in range(phnum):
+                io.seek(phoff + index * phentsize)
+                p_type = io.read(4)
+                if len(p_type) != 4:
+                    return False
+                if struct.unpack(endian + "I", p_type)[0] == _PT_INTERP:
+                    return True
+    except OSError:
+        return False
+    return False
+
+
+def _read_exactly(fd: int, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = os.read(fd, size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+class ForkServer:
+    """
+    Runs tests against an executable without re-executing it for each test.
+
+    The executable is started once, and stops just before `main`; each test is then a
+    `fork` of that initialized process. This only works for dynamically linked programs.
+    """
+
+    def __init__(
+        self,
+        executable: Path,
+        compiler: str = "clang",
+        limits: Optional[ResourceLimits] = None,
+    ):
+        """
+        Start a fork server for the given executable.
+
+        Args:
+            executable: The program to test
+            compiler: The compiler to build the fork server's runtime with
+            limits: The timeouts and resource limits to run each test under
+
+        Raises:
+            ForkServerError: If the fork server can't be started, e.g. because the
+                program is statically linked.
+        """
+        # A program without an interpreter never loads the runtime, so we'd
+        # only find out by running it to completion.
+        if not _is_dynamic(executable):
+            raise ForkServerError(f"{executable} isn't a dynamically linked ELF program")
+
+        runtime = _runtime(compiler)
+        self._limits = limits or ResourceLimits()
+        ctl_read, self._ctl = os.pipe()
+        self._status, st_write = os.pipe()
+
+        env = dict(os.environ)
+        env["TOURNIQUET_FORK_SERVER"] = f"{ctl_read},{st_write}"
+        env["LD_PRELOAD"] = " ".join(filter(None, [str(runtime), env.get("LD_PRELOAD")]))
+        try:
+            # The placeholder argument is replaced with each test's input.
+            self._process = subprocess.Popen(
+                [str(executable), ""],
+                env=env,
+                pass_fds=(ctl_read, st_write),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                start_new_session=True,
+                preexec_fn=_preexec(self._limits),
+            )
+        except OSError as e:
+            self._close_pipes()
+            raise ForkServerError(f"failed to start {executable}: {e}")
+        finally:
+            os.close(ctl_read)
+            os.close(st_write)
+
+        # If the runtime wasn't loaded, the program just runs to completion
+        # (or times out, like any other test) and the status pipe is closed without
+        # a hello.
+        if not self._ready(self._limits.test_timeout) or len(_read_exactly(self._status, 4)) != 4:
+            self.close()
+            raise ForkServerError(f"no fork server in {executable}")
+
+    def __enter__(self) -> "ForkServer":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def _ready(self, timeout: Optional[float]) -> bool:
+        readable, _, _ = select.select([self._status], [], [], timeout)
+        return bool(readable)
+
+    def _close_pipes(self):
+        for fd in (self._ctl, self._status):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def close(self):
+        """
+        Stop the fork server.
+        """
+        self._close_pipes()
+        # Closing the control pipe is the server's signal to exit.
+        wait_exited(self._process.pid, 5)
+        kill_group(self._process.pid)
+        self._process.wait()
+
+    def run(self, input_: str) -> Optional[int]:
+        """
+        Run the program with the given input as its only argument.
+
+        Returns:
+            The program's return code, the negated signal number if it was killed
+            by a signal, or `None` if it timed out.
+
+        Raises:
+            ForkServerError: If the fork server has died.
+        """
+        data = os.fsencode(input_)
+        try:
+            os.write(self._ctl, struct.pack("=I", len(data)) + data)
+        except OSError as e:
+            raise ForkServerError(f"fork server died: {e}")
+
+        pid = _read_exactly(self._status, 4)
+        if len(pid) != 4:
+            raise ForkServerError("fork server died")
+        child = struct.unpack("=I", pid)[0]
+
+        timed_out = not self._ready(self._limits.test_timeout)
+        if timed_out:
+            # The server still reports (and then kills the rest of the group of)
+            # a test that we kill.
+            kill_group(child)
+        status = _read_exactly(self._status, 4)
+        if len(status) != 4:
+            raise ForkServerError("fork server died")
+        if timed_out:
+            return None
+        return _exit_code(struct.unpack("=I", status)[0])
+
+    def first_failure(self, tests: List[Tuple[str, int]]) -> Optional[int]:
+        """
+        Run the given tests, stopping at the first failure.
+
+        Args:
+            tests: The test suite, as a list of `(input, expected_return_code)` tuples
+
+        Returns:
+            The index of the first failing test, or `None` if every test passes.
+        """
+        for index, (input_, output) in enumerate(tests):
+            if self.run(input_) != output:
+                return index
+        return None
+
+
+@contextmanager
+def runner(
+    executable: Path, compiler: str = "clang", limits: Optional[ResourceLimits] = None
+) -> Iterator[Callable[[str], Optional[int]]]:
+    """
+    Prepares to run tests against the given executable, with a `ForkServer` when
+    possible, and otherwise by executing the program once per test.
+
+    Args:
+        executable: The program to test
+        compiler: The compiler to build the fork server's runtime with
+        limits: The timeouts and resource limits to run each test under
+
+    Returns:
+        A context manager for a function that runs a single test, with the same return
+        value as `ForkServer.run`.
+    """
+    limits = limits or ResourceLimits()
+    try:
+        server = ForkServer(executable, compiler, limits)
+    except ForkServerError:
+        yield lambda input_: call([str(executable), input_], limits.test_timeout, limits)
+        return
+
+    with server:
+        yield server.run
+
+
+def first_failure(
+    executable: Path,
+    tests: List[Tuple[str, int]],
+    compiler: str = "clang",
+    limits: Optional[ResourceLimits] = None,
+) -> Optional[int]:
+    """
+    Run the given tests against the given executable, stopping at the first failure.
+    Tests that time out fail.
+
+    Args:
+        executable: The program to test
+        tests: The test suite, as a list of `(input, expected_return_code)` tuples
+        compiler: The compiler to build the fork server's runtime with
+        limits: The timeouts and resource limits to run each test under
+
+    Returns:
+        The index of the first failing test, or `None` if every test passes.
+    """
+    with runner(executable, compiler, limits) as run:
+        for index, (input_, output) in enumerate(tests):
+            if run(input_) != output:
+                return index
+    return None
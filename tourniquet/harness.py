@@ -0,0 +1,145 @@
+import _ctypes
+import ctypes
+import faulthandler
+import os
+import signal
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from .limits import ResourceLimits, kill_group, wait_exited
+
+# The signals whose dispositions the interpreter (or faulthandler) changes,
+# and which the program under test expects to have their default actions.
+_DEFAULT_SIGNALS = (
+    signal.SIGPIPE,
+    signal.SIGINT,
+    signal.SIGTERM,
+    signal.SIGSEGV,
+    signal.SIGBUS,
+    signal.SIGFPE,
+    signal.SIGABRT,
+    signal.SIGILL,
+    signal.SIGXFSZ,
+)
+
+
+def _reset_signals():
+    # A forked child inherits the interpreter's signal handling, e.g. an
+    # ignored SIGPIPE, which a freshly executed program wouldn't.
+    faulthandler.disable()
+    for signum in _DEFAULT_SIGNALS:
+        signal.signal(signum, signal.SIG_DFL)
+    signal.pthread_sigmask(signal.SIG_SETMASK, [])
+
+
+def _exit_code(status: int) -> int:
+    # This matches subprocess's convention: processes killed by a signal
+    # have a negative return code.
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+class SharedObjectHarness:
+    """
+    Runs tests against a program that has been compiled as a shared object, rather than
+    linked into an executable.
+
+    The shared object is loaded into the current process once, and each test then runs
+    the program's entry point in a forked child. This skips the link step, and the
+    cost of executing and dynamically loading a new program for every test.
+
+    Since each test starts out as a copy of the current process, a memory limit is
+    applied on top of the address space that the test inherits.
+    """
+
+    def __init__(self, library: Path, entry: str = "main", limits: Optional[ResourceLimits] = None):
+        """
+        Load the given shared object.
+
+        Args:
+            library: The shared object to load
+            entry: The program's entry point, which must have the signature of `main`
+            limits: The timeouts and resource limits to run each test under
+
+        Raises:
+            OSError: If the shared object can't be loaded.
+            AttributeError: If the shared object doesn't define the entry point.
+        """
+        self._library: Optional[ctypes.CDLL] = ctypes.CDLL(str(library))
+        self._entry = getattr(self._library, entry)
+        self._entry.argtypes = [ctypes.c_int, ctypes.POINTER(ctypes.c_char_p)]
+        self._entry.restype = ctypes.c_int
+        self._limits = limits or ResourceLimits()
+
+    def __enter__(self) -> "SharedObjectHarness":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        """
+        Unload the shared object. No more tests can be run afterwards.
+        """
+        if self._library is not None:
+            _ctypes.dlclose(self._library._handle)
+            self._library = None
+
+    def run(self, input_: str) -> Optional[int]:
+        """
+        Run the program with the given input as its only argument.
+
+        Returns:
+            The program's return code, the negated signal number if it was killed
+            by a signal, or `None` if it timed out.
+        """
+        assert self._library is not None, "harness used after close"
+
+        argv = (ctypes.c_char_p * 3)(b"target", os.fsencode(input_), None)
+        pid = os.fork()
+        if pid == 0:
+            # Nothing in the child may return into the interpreter, since
+            # it's a copy of the parent: every path out of here is an _exit.
+            try:
+                os.setpgid(0, 0)
+                _reset_signals()
+                self._limits.apply(relative=True)
+                devnull = os.open(os.devnull, os.O_WRONLY)
+                os.dup2(devnull, 1)
+                os.dup2(devnull, 2)
+                os._exit(self._entry(len(argv) - 1, argv) & 0xFF)
+            finally:
+                os._exit(127)
+
+        # Both sides set the child's process group, so that it's in place
+        # before either of them relies on it.
+        try:
+            os.setpgid(pid, pid)
+        except OSError:
+            pass
+
+        exited = wait_exited(pid, self._limits.test_timeout)
+        # The group is killed even if the test exited, in case it left any
+        # children behind, and before the test is reaped, so that its group
+        # ID can't have been reused.
+        kill_group(pid)
+        _, status = os.waitpid(pid, 0)
+        if not exited:
+            return None
+        return _exit_code(status)
+
+    def first_failure(self, tests: List[Tuple[str, int]]) -> Optional[int]:
+        """
+        Run the given tests, stopping at the first failure.
+
+        Args:
+            tests: The test suite, as a list of `(input, expected_return_code)` tuples
+
+        Returns:
+            The index of the first failing test, or `None` if every test passes.
+        """
+        for index, (input_, output) in enumerate(tests):
+            if self.run(input_) != output:
+                return index
+        return None
@@ -0,0 +1,224 @@
+import asyncio
+import os
+import resource
+import signal
+import subprocess
+import time
+from dataclasses import dataclass
+from typing import Iterator, List, Optional
+
+
+@dataclass(frozen=True)
+class ResourceLimits:
+    """
+    Limits on the builds and test runs of candidate patches, so that a candidate that
+    loops forever or allocates without bound can't stall or take down the repair.
+
+    The memory and CPU limits are applied (with `setrlimit`) to every build and test
+    process. Some programs, e.g. those built with AddressSanitizer, reserve far more
+    address space than they use, and need a generous (or no) memory limit.
+
+    Every build and test has a timeout by default, so that a candidate that loops forever
+    can't stall the repair; pass `None` to disable either timeout.
+    """
+
+    build_timeout: Optional[float] = 600.0
+    """
+    The number of wall-clock seconds that each build command may run for.
+    """
+
+    test_timeout: Optional[float] = 60.0
+    """
+    The number of wall-clock seconds that each test may run for.
+    """
+
+    memory: Optional[int] = None
+    """
+    The maximum size, in bytes, of each process's address space (`RLIMIT_AS`).
+
+    Tests that run in a fork of an already-running process (see
+    `tourniquet.harness.SharedObjectHarness`) may instead grow their address space
+    by this much beyond what they inherited.
+    """
+
+    cpu: Optional[int] = None
+    """
+    The number of CPU seconds that each process may use (`RLIMIT_CPU`).
+    """
+
+    def apply(self, relative: bool = False):
+        """
+        Applies the memory and CPU limits to the current process. This is meant to be
+        called in a child process, just before it runs a build or test.
+
+        Args:
+            relative: Whether the memory limit is in addition to the process's current
+                address space, e.g. in a forked child that runs a test in place, rather
+                than executing a new program
+        """
+        if self.memory is not None:
+            memory = self.memory
+            if relative:
+                memory += _address_space_size()
+            resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+        if self.cpu is not None:
+            # The kernel sends SIGXCPU at the soft limit, and SIGKILL at the
+            # hard limit; the extra second lets us tell CPU exhaustion apart from
+            # other reasons for being killed.
+            resource.setrlimit(resource.RLIMIT_CPU, (self.cpu, self.cpu + 1))
+
+    def hung(self, returncode: Optional[int]) -> bool:
+        """
+        Returns whether the given return code (as returned by `call`) means that the
+        process timed out or ran out of CPU time.
+        """
+        return returncode is None or (self.cpu is not None and returncode == -signal.SIGXCPU)
+
+
+def _address_space_size() -> int:
+    # The first field of statm is the total program size (i.e. VmSize), in pages.
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[0]) * resource.getpagesize()
+    except OSError:
+        return 0
+
+
+def kill_group(pid: int):
+    """
+    Kills every process in the given process group, if there are any left.
+    """
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _preexec(limits: Optional[ResourceLimits]):
+    # Any preexec_fn rules out CPython's vfork (or posix_spawn) fast path, and
+    # isn't safe while other threads are running, so we only pass one when there
+    # are rlimits to apply.
+    if limits is None or (limits.memory is None and limits.cpu is None):
+        return None
+    return limits.apply
+
+
+def call(
+    args: List[str],
+    timeout: Optional[float] = None,
+    limits: Optional[ResourceLimits] = None,
+    quiet: bool = True,
+) -> Optional[int]:
+    """
+    Runs the given command in its own process group, under the given limits.
+
+    The whole process group is killed once the command exits or times out, so that
+    nothing the command started outlives it. The command itself is only reaped
+    afterwards, so that its process group ID can't have been reused by then.
+
+    Args:
+        args: The command to run
+        timeout: The number of seconds to let the command run for, if limited
+        limits: The memory and CPU limits to run the command under, if any
+        quiet: Whether to discard the command's output
+
+    Returns:
+        The command's return code, or `None` if it timed out.
+    """
+    output = subprocess.DEVNULL if quiet else None
+    process = subprocess.Popen(
+        args,
+        stdin=subprocess.DEVNULL,
+        stdout=output,
+        stderr=output,
+        start_new_session=True,
+        preexec_fn=_preexec(limits),
+    )
+    exited = False
+    try:
+        exited = wait_exited(process.pid, timeout)
+    finally:
+        kill_group(process.pid)
+        returncode = process.wait()
+    return returncode if exited else None
+
+
+async def call_async(
+    args: List[str],
+    timeout: Optional[float] = None,
+    limits: Optional[ResourceLimits] = None,
+    quiet: bool = True,
+) -> Optional[int]:
+    """
+    Like `call`, but waits for the command from `asyncio`. The process group is also
+    killed if the calling task is cancelled.
+    """
+    # This isn't an asyncio subprocess, since asyncio reaps its subprocesses
+    # as soon as they exit, before we can kill the rest of their group.
+    output = subprocess.DEVNULL if quiet else None
+    process = subprocess.Popen(
+        args,
+        stdin=subprocess.DEVNULL,
+        stdout=output,
+        stderr=output,
+        start_new_session=True,
+        preexec_fn=_preexec(limits),
+    )
+    exited = False
+    try:
+        exited = await wait_exited_async(process.pid, timeout)
+    finally:
+        kill_group(process.pid)
+        # The whole group has exited or been killed, so this doesn't block for long.
+        returncode = process.wait()
+    return returncode if exited else None
+
+
+def _exited(pid: int) -> bool:
+    # WNOWAIT leaves the child unreaped, so its pid (and process group ID)
+    # stays reserved until we reap it.
+    return os.waitid(os.P_PID, pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is not None
+
+
+def _poll_delays(timeout: float) -> Iterator[float]:
+    # There's no portable way to wait on a child with a timeout, so we poll,
+    # backing off so that quick tests are still noticed quickly.
+    deadline = time.monotonic() + timeout
+    delay = 0.0005
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        yield min(delay, remaining)
+        delay = min(delay * 2, 0.05)
+
+
+def wait_exited(pid: int, timeout: Optional[float] = None) -> bool:
+    """
+    Waits for the given child process to exit, for at most the given number of seconds,
+    without reaping it. The caller can then kill the rest of the child's process group
+    before reaping it, with no risk of the group's ID having been reused.
+
+    Returns:
+        Whether the child exited before the timeout.
+    """
+    if timeout is None:
+        os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT)
+        return True
+
+    for delay in _poll_delays(timeout):
+        if _exited(pid):
+            return True
+        time.sleep(delay)
+    return _exited(pid)
+
+
+async def wait_exited_async(pid: int, timeout: Optional[float] = None) -> bool:
+    """
+    Like `wait_exited`, but waits from `asyncio`.
+    """
+    for delay in _poll_delays(float("inf") if timeout is None else timeout):
+        if _exited(pid):
+            return True
+        await asyncio.sleep(delay)
+    return _exited(pid)
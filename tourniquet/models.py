@@ -1,7 +1,21 @@
+from bisect import bisect_left, bisect_right
 from pathlib import Path
-from typing import Optional
-
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, create_engine
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from sqlalchemy import (
+    Boolean,
+    Column,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    create_engine,
+    func,
+    inspect,
+    select,
+    text,
+)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
 
@@ -27,6 +41,21 @@ class Module(Base):
     The name (i.e. source file) of this module.
     """
 
+    content_hash = Column(String, nullable=True)
+    """
+    The SHA-256 digest of this module's source file, as of its last collection.
+    """
+
+    mtime = Column(Float, nullable=True)
+    """
+    The modification time of this module's source file, as of its last collection.
+    """
+
+    arguments_hash = Column(String, nullable=True)
+    """
+    The SHA-256 digest of the compiler arguments that this module was last collected with.
+    """
+
     functions = relationship("Function", uselist=True)
     """
     The `Function`s present in this module.
@@ -59,6 +88,7 @@ class Function(Base):
     """
 
     __tablename__ = "functions"
+    __table_args__ = (Index("ix_functions_span", "module_name", "start_line", "end_line"),)
 
     id = Column(Integer, primary_key=True)
     """
@@ -155,7 +185,7 @@ class Global(Base):
     This global's database ID.
     """
 
-    module_name = Column(String, ForeignKey("modules.name"))
+    module_name = Column(String, ForeignKey("modules.name"), index=True)
     """
     The name of the `Module` that this global belongs to.
     """
@@ -221,7 +251,7 @@ class VarDecl(Base):
     This declaration's database ID.
     """
 
-    function_id = Column(Integer, ForeignKey("functions.id"))
+    function_id = Column(Integer, ForeignKey("functions.id"), index=True)
     """
     The ID of the `Function` that this declaration is present in.
     """
@@ -287,7 +317,7 @@ class Call(Base):
     This call's database ID.
     """
 
-    module_name = Column(String, ForeignKey("modules.name"))
+    module_name = Column(String, ForeignKey("modules.name"), index=True)
     """
     The name of the `Module` that this statement is in.
     """
@@ -297,7 +327,7 @@ class Call(Base):
     The `Module` that this statement is in.
     """
 
-    function_id = Column(Integer, ForeignKey("functions.id"))
+    function_id = Column(Integer, ForeignKey("functions.id"), index=True)
     """
     The ID of the `Function` that this call is present in.
     """
@@ -382,7 +412,7 @@ class Argument(Base):
     This argument's database ID.
     """
 
-    call_id = Column(Integer, ForeignKey("calls.id"))
+    call_id = Column(Integer, ForeignKey("calls.id"), index=True)
     """
     The ID of the `Call` that this argument is in.
     """
@@ -412,6 +442,7 @@ class Statement(Base):
     """
 
     __tablename__ = "statements"
+    __table_args__ = (Index("ix_statements_location", "module_name", "start_line", "start_column"),)
 
     id = Column(Integer, primary_key=True)
     """
@@ -428,7 +459,7 @@ class Statement(Base):
     The `Module` that this statement is in.
     """
 
-    function_id = Column(Integer, ForeignKey("functions.id"))
+    function_id = Column(Integer, ForeignKey("functions.id"), index=True)
     """
     The ID of the `Function` that this statement is in.
     """
@@ -491,27 +522,235 @@ class Statement(Base):
         return f"<Statement {self.expr}>"
 
 
+class BulkInserter:
+    """
+    Buffers rows for Core-level `INSERT`s, flushing each table's rows as
+    executemany-style batches.
+
+    Primary keys are assigned up front, so that child rows can refer to their
+    parents without a round trip through the ORM.
+    """
+
+    # Tables are always flushed in this order, so that parent rows
+    # are inserted before the children that refer to them.
+    _FLUSH_ORDER = [Module, Global, Function, VarDecl, Call, Argument, Statement]
+
+    def __init__(self, session, batch_size: int = 1000):
+        """
+        Create a new `BulkInserter`.
+
+        Args:
+            session: The SQLAlchemy session to insert with
+            batch_size: The number of buffered rows that triggers a flush
+        """
+        self.session = session
+        self.batch_size = batch_size
+        self._rows: Dict[Any, List[Dict[str, Any]]] = {model: [] for model in self._FLUSH_ORDER}
+        self._next_ids: Dict[Any, int] = {}
+        self._buffered = 0
+
+    def _next_id(self, model) -> int:
+        if model not in self._next_ids:
+            max_id = self.session.query(func.max(model.id)).scalar()
+            self._next_ids[model] = (max_id or 0) + 1
+
+        id_ = self._next_ids[model]
+        self._next_ids[model] += 1
+        return id_
+
+    def add(self, model, **values) -> int:
+        """
+        Buffer a new row for the given model, flushing if the batch is full.
+
+        Returns:
+            The primary key assigned to the new row
+        """
+        id_ = self._next_id(model)
+        values["id"] = id_
+        self._buffer(model, values)
+        return id_
+
+    def add_rows(self, model, columns: Sequence[str], rows: Iterable[Sequence[Any]]) -> List[int]:
+        """
+        Buffer new rows for the given model, flushing whenever the batch is full.
+
+        Args:
+            model: The model to insert rows of
+            columns: The names of the columns that each row has values for
+            rows: Each row's values, in the same order as `columns`
+
+        Returns:
+            The primary keys assigned to the new rows, in order
+        """
+        ids = []
+        for row in rows:
+            id_ = self._next_id(model)
+            values = dict(zip(columns, row))
+            values["id"] = id_
+            self._buffer(model, values)
+            ids.append(id_)
+        return ids
+
+    def _buffer(self, model, values: Dict[str, Any]):
+        self._rows[model].append(values)
+        self._buffered += 1
+        if self._buffered >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Insert every buffered row.
+        """
+        for model in self._FLUSH_ORDER:
+            rows = self._rows[model]
+            if rows:
+                self.session.execute(model.__table__.insert(), rows)
+                self._rows[model] = []
+        self._buffered = 0
+
+
+def _function_contains(function: Function, line: int, column: int) -> bool:
+    # This mirrors the SQL in DB.function_at; see ModuleIndex.function_at.
+    return (
+        line >= function.start_line
+        and column >= function.start_column
+        and (
+            line < function.end_line
+            or (line == function.end_line and column <= function.end_column)
+        )
+    )
+
+
+class ModuleIndex:
+    """
+    An in-memory index of a single module's functions and statements, ordered by
+    source span.
+
+    Lookups are binary searches over the sorted spans, rather than round trips
+    to the database.
+    """
+
+    def __init__(self, functions: List[Function], statements: List[Statement]):
+        """
+        Create a new `ModuleIndex` from the given functions and statements, which
+        should all belong to the same module.
+        """
+        self._functions = sorted(functions, key=lambda f: (f.start_line, f.start_column))
+        self._function_start_lines = [f.start_line for f in self._functions]
+
+        # Functions can (rarely) nest, e.g. via local classes in C++. We
+        # keep a running maximum of the end lines so that a containment lookup
+        # can stop walking backwards as soon as no earlier span can contain the point.
+        self._function_max_end_lines: List[int] = []
+        for function in self._functions:
+            end_line = function.end_line
+            if self._function_max_end_lines:
+                end_line = max(end_line, self._function_max_end_lines[-1])
+            self._function_max_end_lines.append(end_line)
+
+        self._statements = sorted(statements, key=lambda s: (s.start_line, s.start_column))
+        self._statement_starts = [(s.start_line, s.start_column) for s in self._statements]
+
+    @classmethod
+    def build(cls, session, module_name: str):
+        """
+        Build a `ModuleIndex` for the given module from the database.
+        """
+        functions = session.query(Function).filter(Function.module_name == module_name).all()
+        statements = session.query(Statement).filter(Statement.module_name == module_name).all()
+        return cls(functions, statements)
+
+    def function_at(self, coordinates: SourceCoordinate) -> Optional[Function]:
+        """
+        Returns the innermost `Function` whose span contains the given coordinates, if any.
+
+        Containment is exactly that of the SQL query in `DB.function_at`, including its
+        requirement that the column is at or after the function's start column on every
+        line. Where functions nest, the SQL query fails, and the innermost one is returned.
+        """
+        line, column = coordinates.line, coordinates.column
+        index = bisect_right(self._function_start_lines, line) - 1
+        while index >= 0 and self._function_max_end_lines[index] >= line:
+            if _function_contains(self._functions[index], line, column):
+                return self._functions[index]
+            index -= 1
+        return None
+
+    def statement_at(self, coordinates: SourceCoordinate) -> Optional[Statement]:
+        """
+        Returns the `Statement` that begins at exactly the given coordinates, if any.
+        """
+        point = (coordinates.line, coordinates.column)
+        index = bisect_left(self._statement_starts, point)
+        if index < len(self._statement_starts) and self._statement_starts[index] == point:
+            return self._statements[index]
+        return None
+
+
+def _module_name(location: Location) -> str:
+    # Modules are named by the absolute paths of their source files.
+    return str(Path(location.filename).resolve())
+
+
 class DB:
     """
     A convenience class for querying the database.
     """
 
     @classmethod
-    def create(cls, db_path, echo=False):
+    def create(cls, db_path, echo=False, indexed=False):
         """
         Creates a new database at the given path.
+
+        If `indexed` is `True`, `function_at` and `statement_at` are answered from
+        an in-memory `ModuleIndex` for each module, built on first use.
         """
 
-        engine = create_engine(f"sqlite:///{db_path}", echo=echo)
+        # The async APIs query the database from executor threads, though
+        # never from more than one thread at a time.
+        engine = create_engine(
+            f"sqlite:///{db_path}", echo=echo, connect_args={"check_same_thread": False}
+        )
 
         session = sessionmaker(bind=engine)()
         Base.metadata.create_all(engine)
+        cls._migrate(engine)
 
-        return cls(session, db_path)
+        return cls(session, db_path, indexed=indexed)
 
-    def __init__(self, session, db_path):
+    # `create_all` only creates missing tables, so columns added to
+    # existing tables after their creation need to be added by hand.
+    _ADDED_COLUMNS = {
+        "modules": [("content_hash", "VARCHAR"), ("mtime", "FLOAT"), ("arguments_hash", "VARCHAR")]
+    }
+
+    @classmethod
+    def _migrate(cls, engine):
+        """
+        Brings a database created by an older version of tourniquet up to date.
+        """
+        inspector = inspect(engine)
+        with engine.begin() as conn:
+            for table, columns in cls._ADDED_COLUMNS.items():
+                existing = {column["name"] for column in inspector.get_columns(table)}
+                for name, type_ in columns:
+                    if name not in existing:
+                        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {type_}"))
+
+            # Likewise, `create_all` only creates indexes alongside the
+            # tables that they belong to.
+            for table in Base.metadata.sorted_tables:
+                existing = {index["name"] for index in inspector.get_indexes(table.name)}
+                for index in table.indexes:
+                    if index.name not in existing:
+                        index.create(conn)
+
+    def __init__(self, session, db_path, indexed=False):
         self.session = session
         self.db_path = db_path
+        self.indexed = indexed
+        self._indexes: Dict[str, ModuleIndex] = {}
+        self.generation = 0
 
     def query(self, *args, **kwargs):
         """
@@ -520,11 +759,72 @@ class DB:
 
         return self.session.query(*args, **kwargs)
 
+    def module_named(self, module_name: str) -> Optional[Module]:
+        """
+        Returns the `Module` with the given name, if one has been collected.
+        """
+        return self.query(Module).filter_by(name=module_name).one_or_none()
+
+    def delete_module(self, module_name: str):
+        """
+        Deletes the given module and everything in it from the database.
+
+        The deletion isn't committed, so that callers can replace the module's
+        contents within a single transaction.
+        """
+        self.invalidate(module_name)
+
+        function_ids = select([Function.id]).where(Function.module_name == module_name)
+        call_ids = select([Call.id]).where(Call.module_name == module_name)
+
+        self.query(Argument).filter(Argument.call_id.in_(call_ids)).delete(
+            synchronize_session=False
+        )
+        self.query(VarDecl).filter(VarDecl.function_id.in_(function_ids)).delete(
+            synchronize_session=False
+        )
+        for model in (Statement, Call, Function, Global):
+            self.query(model).filter(model.module_name == module_name).delete(
+                synchronize_session=False
+            )
+        self.query(Module).filter(Module.name == module_name).delete(synchronize_session=False)
+
+    def invalidate(self, module_name: Optional[str] = None):
+        """
+        Discards the in-memory index for the given module, or for every module if
+        no module is given.
+
+        Indexes are invalidated automatically when a module is re-collected through
+        this `DB`; modifications made through other connections require an explicit call.
+
+        Every invalidation also bumps `generation`, which other in-memory caches of
+        database state use to detect changes.
+        """
+        self.generation += 1
+        if module_name is None:
+            self._indexes.clear()
+        else:
+            self._indexes.pop(module_name, None)
+
+    def module_index(self, module_name: str) -> ModuleIndex:
+        """
+        Returns the in-memory `ModuleIndex` for the given module, building it if necessary.
+        """
+        index = self._indexes.get(module_name)
+        if index is None:
+            index = ModuleIndex.build(self.session, module_name)
+            self._indexes[module_name] = index
+        return index
+
     def function_at(self, location: Location) -> Optional[Function]:
+        module_name = _module_name(location)
+        if self.indexed:
+            return self.module_index(module_name).function_at(location.coordinates)
+
         return (
             self.query(Function)
             .filter(
-                (str(location.filename) == Function.module_name)
+                (module_name == Function.module_name)
                 & (location.line >= Function.start_line)
                 & (location.column >= Function.start_column)
                 & (
@@ -539,10 +839,14 @@ class DB:
         )
 
     def statement_at(self, location: Location) -> Optional[Statement]:
+        module_name = _module_name(location)
+        if self.indexed:
+            return self.module_index(module_name).statement_at(location.coordinates)
+
         statement = (
             self.query(Statement)
             .filter(
-                (Statement.module_name == str(location.filename))
+                (Statement.module_name == module_name)
                 & (Statement.start_line == location.line)
                 & (Statement.start_column == location.column)
             )
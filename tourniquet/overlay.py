@@ -0,0 +1,53 @@
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Mapping
+
+
+def overlay_mapping(files: Mapping[Path, Path]) -> Dict[str, Any]:
+    """
+    Returns a Clang virtual file system overlay that makes each replacement file appear
+    at its original path.
+
+    Args:
+        files: A mapping of original (absolute) paths to the files that replace them
+
+    Returns:
+        The overlay, suitable for serializing to JSON (a subset of YAML, which Clang reads).
+    """
+    roots: Dict[str, List[Dict[str, str]]] = {}
+    for original, replacement in files.items():
+        original = Path(original).resolve()
+        roots.setdefault(str(original.parent), []).append(
+            {
+                "name": original.name,
+                "type": "file",
+                "external-contents": str(Path(replacement).resolve()),
+            }
+        )
+
+    return {
+        "version": 0,
+        "case-sensitive": "true",
+        # Every other file, e.g. headers next to the original source, is
+        # still read from the real file system.
+        "fallthrough": "true",
+        # Clang reports (and resolves quoted includes relative to) the
+        # original paths, rather than those of the replacement files.
+        "use-external-names": "false",
+        "roots": [
+            {"name": directory, "type": "directory", "contents": contents}
+            for directory, contents in roots.items()
+        ],
+    }
+
+
+def write_overlay(path: Path, files: Mapping[Path, Path]) -> List[str]:
+    """
+    Writes a Clang virtual file system overlay (see `overlay_mapping`) to the given path.
+
+    Returns:
+        The compiler arguments that apply the overlay.
+    """
+    path = Path(path)
+    path.write_text(json.dumps(overlay_mapping(files), indent=2))
+    return ["-ivfsoverlay", str(path.resolve())]
@@ -1,12 +1,254 @@
 import itertools
+import random
+import weakref
 from abc import ABC, abstractmethod
-from typing import Callable, Iterator, List, Optional
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple
 
 from . import models
 from .error import PatchConcretizationError
 from .location import Location
 
 
+class _DBCacheEntries:
+    # The cached functions and candidates for a single `models.DB`, as of one of its generations.
+    def __init__(self, generation: int):
+        self.generation = generation
+        self.functions: "OrderedDict[Tuple[Path, int, int], Optional[models.Function]]" = (
+            OrderedDict()
+        )
+        self.candidates: "OrderedDict[Tuple[Any, int], Tuple[str, ...]]" = OrderedDict()
+
+
+class ConcretizationCache:
+    """
+    A bounded, least-recently-used cache of concretized candidates, keyed on
+    expression node and enclosing function. The lookup of each location's enclosing
+    function is cached too.
+
+    Each `models.DB` has its own entries, which are discarded after its contents
+    change, or once it's garbage collected.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        """
+        Create a new `ConcretizationCache`.
+
+        Args:
+            maxsize: The maximum number of candidate (and function) entries to keep
+                for each database
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._dbs: "weakref.WeakKeyDictionary[models.DB, _DBCacheEntries]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def clear(self):
+        """
+        Discard every cached entry.
+        """
+        self._dbs.clear()
+
+    def _entries(self, db: models.DB) -> _DBCacheEntries:
+        entries = self._dbs.get(db)
+        if entries is None or entries.generation != db.generation:
+            entries = _DBCacheEntries(db.generation)
+            self._dbs[db] = entries
+        return entries
+
+    def _function_at(self, db: models.DB, entries: _DBCacheEntries, location: Location):
+        key = (location.filename, location.line, location.column)
+        if key in entries.functions:
+            entries.functions.move_to_end(key)
+            return entries.functions[key]
+
+        function = db.function_at(location)
+        entries.functions[key] = function
+        if len(entries.functions) > self.maxsize:
+            entries.functions.popitem(last=False)
+        return function
+
+    def get_or_compute(
+        self,
+        db: models.DB,
+        expr: "Expression",
+        location: Location,
+        compute: Callable[[models.Function], Iterable[str]],
+    ) -> Tuple[str, ...]:
+        """
+        Returns the cached candidates for `expr` within the function enclosing
+        `location`, calling `compute` with that function to produce them on a miss.
+
+        Raises:
+            PatchConcretizationError: If no function encloses `location`
+        """
+        entries = self._entries(db)
+        function = self._function_at(db, entries, location)
+        if function is None:
+            raise PatchConcretizationError(
+                f"no function contains ({location.line}, {location.column})"
+            )
+
+        key = (expr, function.id)
+        candidates = entries.candidates.get(key)
+        if candidates is not None:
+            self.hits += 1
+            entries.candidates.move_to_end(key)
+            return candidates
+
+        self.misses += 1
+        candidates = tuple(compute(function))
+        entries.candidates[key] = candidates
+        if len(entries.candidates) > self.maxsize:
+            entries.candidates.popitem(last=False)
+        return candidates
+
+
+concretization_cache = ConcretizationCache()
+"""
+The `ConcretizationCache` shared by every `Expression` whose concretization queries the database.
+"""
+
+
+class _Replay:
+    # Records the items of an iterator as they're first consumed, so that it can
+    # be iterated again (even while partially consumed) without being recomputed.
+    def __init__(self, items: Iterator[str]):
+        self._items = items
+        self._seen: List[str] = []
+        self._exhausted = False
+
+    def __iter__(self) -> Iterator[str]:
+        index = 0
+        while True:
+            if index == len(self._seen):
+                if self._exhausted:
+                    return
+                try:
+                    self._seen.append(next(self._items))
+                except StopIteration:
+                    self._exhausted = True
+                    return
+            yield self._seen[index]
+            index += 1
+
+
+def _product(iterables) -> Iterator[Tuple[str, ...]]:
+    if not iterables:
+        yield ()
+        return
+
+    head, tail = iterables[0], iterables[1:]
+    for item in head:
+        for rest in _product(tail):
+            yield (item, *rest)
+
+
+def _concretize_product(db: models.DB, location: Location, nodes) -> Iterator[Tuple[str, ...]]:
+    """
+    Lazily yields the cartesian product of each node's concretizations, in the same
+    order as `itertools.product`.
+
+    Each node is concretized exactly once. Unlike `itertools.product`, no node's
+    concretizations are enumerated up front: every node after the first records its
+    candidates as they're first needed, and replays them for each later prefix of the
+    product. The first item is therefore produced without enumerating any node in
+    full, at the cost of holding every node but the first's candidates in memory.
+    """
+    if not nodes:
+        yield ()
+        return
+
+    head = nodes[0].concretize(db, location)
+    tail = [_Replay(node.concretize(db, location)) for node in nodes[1:]]
+    yield from _product([head, *tail])
+
+
+def _product_count(db: models.DB, location: Location, nodes) -> int:
+    """
+    Returns the size of the cartesian product of each node's concretizations.
+    """
+    count = 1
+    for node in nodes:
+        count *= node.count(db, location)
+    return count
+
+
+def _product_nth(db: models.DB, location: Location, nodes, index: int) -> Tuple[str, ...]:
+    """
+    Returns the item at the given index of the product yielded by `_concretize_product`,
+    without enumerating the product.
+
+    Raises:
+        IndexError: If the index is out of range
+    """
+    counts = [node.count(db, location) for node in nodes]
+    total = 1
+    for count in counts:
+        total *= count
+    if not 0 <= index < total:
+        raise IndexError(f"candidate index {index} out of range ({total} candidates)")
+
+    # The product's last node varies fastest, so we decode the index
+    # as a mixed-radix number from the right.
+    items = []
+    for node, count in zip(reversed(nodes), reversed(counts)):
+        index, digit = divmod(index, count)
+        items.append(node.nth(db, location, digit))
+    return tuple(reversed(items))
+
+
+_FEISTEL_ROUNDS = 6
+_MASK_64 = (1 << 64) - 1
+
+
+def _feistel_round(value: int, key: int) -> int:
+    # A cheap 64-bit mix (splitmix64's finalizer), keyed by XOR.
+    value = (value ^ key) & _MASK_64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _MASK_64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _MASK_64
+    return value ^ (value >> 31)
+
+
+def _random_indices(rng: random.Random, count: int) -> Iterator[int]:
+    """
+    Lazily yields every index below `count`, in a pseudorandom order, in constant memory.
+    """
+    if count <= 0:
+        return
+
+    # A Feistel network with random round keys is a random-looking permutation
+    # of the smallest even-width bit range that covers `count`. Indices that land
+    # outside of `count` are walked along their cycle until they land inside it
+    # again, which keeps the permutation a bijection, and takes fewer than four steps
+    # on average since the bit range is less than four times `count`.
+    half_bits = max(1, ((count - 1).bit_length() + 1) // 2)
+    mask = (1 << half_bits) - 1
+    keys = [rng.getrandbits(64) for _ in range(_FEISTEL_ROUNDS)]
+
+    def permute(index: int) -> int:
+        left, right = index >> half_bits, index & mask
+        for key in keys:
+            left, right = right, left ^ (_feistel_round(right, key) & mask)
+        return (left << half_bits) | right
+
+    for index in range(count):
+        index = permute(index)
+        while index >= count:
+            index = permute(index)
+        yield index
+
+
+def _nth_by_enumeration(candidates: Iterator[str], index: int) -> str:
+    if index >= 0:
+        for candidate in itertools.islice(candidates, index, None):
+            return candidate
+    raise IndexError(f"candidate index {index} out of range")
+
+
 class Expression(ABC):
     """
     Represents an abstract source "expression".
@@ -19,6 +261,27 @@ class Expression(ABC):
     def concretize(self, db: models.DB, location: Location) -> Iterator[str]:
         yield from ()
 
+    def count(self, db: models.DB, location: Location) -> int:
+        """
+        Returns the number of candidates that this expression concretizes into.
+
+        The default implementation enumerates every candidate; derived classes
+        override it wherever the count can be computed directly.
+        """
+        return sum(1 for _ in self.concretize(db, location))
+
+    def nth(self, db: models.DB, location: Location, index: int) -> str:
+        """
+        Returns the candidate at the given index, in concretization order.
+
+        The default implementation enumerates every candidate up to the index;
+        derived classes override it wherever the candidate can be computed directly.
+
+        Raises:
+            IndexError: If the index is out of range
+        """
+        return _nth_by_enumeration(self.concretize(db, location), index)
+
     def view(self, db: models.DB, location: Location) -> str:
         return "Expression()"
 
@@ -46,6 +309,9 @@ class Lit(Expression):
         """
         yield self.expr
 
+    def count(self, _db, _location) -> int:
+        return 1
+
     def view(self, _db, _location):
         return f"Lit({self.expr})"
 
@@ -74,14 +340,12 @@ class Variable(Expression):
         """
 
         # TODO(ww): We should also concretize with the available globals.
-        function = db.function_at(location)
-        if function is None:
-            raise PatchConcretizationError(
-                f"no function contains ({location.line}, {location.column})"
-            )
-
-        for var_decl in function.var_decls:
-            yield var_decl.name
+        yield from concretization_cache.get_or_compute(
+            db,
+            self,
+            location,
+            lambda function: (var_decl.name for var_decl in function.var_decls),
+        )
 
     def view(self, _db, _location) -> str:
         return "Variable()"
@@ -109,17 +373,13 @@ class StaticBufferSize(Expression):
         """
 
         # TODO(ww): We should also concretize with available globals.
-        function = db.function_at(location)
+        def sizes(function):
+            for var_decl in function.var_decls:
+                if not var_decl.is_array:
+                    continue
+                yield f"sizeof({var_decl.name})"
 
-        if function is None:
-            raise PatchConcretizationError(
-                f"no function contains ({location.line}, {location.column})"
-            )
-
-        for var_decl in function.var_decls:
-            if not var_decl.is_array:
-                continue
-            yield f"sizeof({var_decl.name})"
+        yield from concretization_cache.get_or_compute(db, self, location, sizes)
 
     def view(self, _db, _location) -> str:
         return "StaticBufferSize()"
@@ -130,6 +390,9 @@ class BinaryMathOperator(Expression):
     Represents the possible binary math operators, along with their lhs and rhs expressions.
     """
 
+    # TODO(ww): Missing for unknown reasons: >>, &, |, ^, %
+    _OPERATORS = ("+", "-", "/", "*", "<<")
+
     def __init__(self, lhs: Expression, rhs: Expression):
         """
         Create a new `BinaryMathOperator` with the given `lhs` and `rhs`.
@@ -152,15 +415,19 @@ class BinaryMathOperator(Expression):
         Returns:
             A generator of strings, each of which is a concrete binary math expression
         """
-        lhs_exprs = self.lhs.concretize(db, location)
-        rhs_exprs = self.rhs.concretize(db, location)
-        for (lhs, rhs) in itertools.product(lhs_exprs, rhs_exprs):
-            yield f"{lhs} + {rhs}"
-            yield f"{lhs} - {rhs}"
-            yield f"{lhs} / {rhs}"
-            yield f"{lhs} * {rhs}"
-            yield f"{lhs} << {rhs}"
-            # TODO(ww): Missing for unknown reasons: >>, &, |, ^, %
+        for (lhs, rhs) in _concretize_product(db, location, (self.lhs, self.rhs)):
+            for op in self._OPERATORS:
+                yield f"{lhs} {op} {rhs}"
+
+    def count(self, db: models.DB, location: Location) -> int:
+        return _product_count(db, location, (self.lhs, self.rhs)) * len(self._OPERATORS)
+
+    def nth(self, db: models.DB, location: Location, index: int) -> str:
+        if index < 0:
+            raise IndexError(f"candidate index {index} out of range")
+        operands, op = divmod(index, len(self._OPERATORS))
+        lhs, rhs = _product_nth(db, location, (self.lhs, self.rhs), operands)
+        return f"{lhs} {self._OPERATORS[op]} {rhs}"
 
     def view(self, db: models.DB, location: Location) -> str:
         return f"BinaryMathOperator({self.lhs.view(db, location)}, {self.lhs.view(db, location)})"
@@ -171,6 +438,9 @@ class BinaryBoolOperator(Expression):
     Represents the possible binary boolean operators, along with their lhs and rhs expressions.
     """
 
+    # TODO(ww): If location is in a C++ source file, maybe add <=>
+    _OPERATORS = ("==", "!=", "<=", "<", ">=", ">")
+
     def __init__(self, lhs: Expression, rhs: Expression):
         """
         Create a new `BinaryBoolOperator` with the given `lhs` and `rhs`.
@@ -193,16 +463,19 @@ class BinaryBoolOperator(Expression):
         Returns:
             A generator of strings, each of which is a concrete binary boolean expression
         """
-        lhs_exprs = self.lhs.concretize(db, location)
-        rhs_exprs = self.rhs.concretize(db, location)
-        for (lhs, rhs) in itertools.product(lhs_exprs, rhs_exprs):
-            yield f"{lhs} == {rhs}"
-            yield f"{lhs} != {rhs}"
-            yield f"{lhs} <= {rhs}"
-            yield f"{lhs} < {rhs}"
-            yield f"{lhs} >= {rhs}"
-            yield f"{lhs} > {rhs}"
-            # TODO(ww): If location is in a C++ source file, maybe add <=>
+        for (lhs, rhs) in _concretize_product(db, location, (self.lhs, self.rhs)):
+            for op in self._OPERATORS:
+                yield f"{lhs} {op} {rhs}"
+
+    def count(self, db: models.DB, location: Location) -> int:
+        return _product_count(db, location, (self.lhs, self.rhs)) * len(self._OPERATORS)
+
+    def nth(self, db: models.DB, location: Location, index: int) -> str:
+        if index < 0:
+            raise IndexError(f"candidate index {index} out of range")
+        operands, op = divmod(index, len(self._OPERATORS))
+        lhs, rhs = _product_nth(db, location, (self.lhs, self.rhs), operands)
+        return f"{lhs} {self._OPERATORS[op]} {rhs}"
 
     def view(self, db: models.DB, location: Location) -> str:
         return f"BinaryBoolOperator({self.lhs.view(db, location)}, {self.rhs.view(db, location)})"
@@ -236,11 +509,16 @@ class LessThanExpr(Expression):
             A generator of strings, each of which is a concrete less-than boolean expression
         """
 
-        lhs_exprs = self.lhs.concretize(db, location)
-        rhs_exprs = self.rhs.concretize(db, location)
-        for (lhs, rhs) in itertools.product(lhs_exprs, rhs_exprs):
+        for (lhs, rhs) in _concretize_product(db, location, (self.lhs, self.rhs)):
             yield f"{lhs} < {rhs}"
 
+    def count(self, db: models.DB, location: Location) -> int:
+        return _product_count(db, location, (self.lhs, self.rhs))
+
+    def nth(self, db: models.DB, location: Location, index: int) -> str:
+        lhs, rhs = _product_nth(db, location, (self.lhs, self.rhs), index)
+        return f"{lhs} < {rhs}"
+
     def view(self, db: models.DB, location: Location):
         self.lhs.view(db, location) + " < " + self.rhs.view(db, location)
 
@@ -261,6 +539,35 @@ class Statement(ABC):
     def view(self, db: models.DB, location: Location):
         pass
 
+    def count(self, db: models.DB, location: Location) -> int:
+        """
+        Returns the number of candidates that this statement concretizes into.
+
+        The default implementation enumerates every candidate; derived classes
+        override it wherever the count can be computed directly.
+
+        Statements with a `StatementList` body (`IfStmt` and `ElseStmt`) count the full
+        product of the body's candidates, like `StatementList.count`, so their count can
+        exceed the number of (deduplicated) candidates that `concretize` yields.
+        """
+        return sum(1 for _ in self.concretize(db, location))
+
+    def nth(self, db: models.DB, location: Location, index: int) -> str:
+        """
+        Returns the candidate at the given index, in concretization order.
+
+        The default implementation enumerates every candidate up to the index;
+        derived classes override it wherever the candidate can be computed directly.
+
+        Statements with a `StatementList` body (`IfStmt` and `ElseStmt`) index the full
+        product of the body's candidates instead, so that `nth(i)` is the `i`th item of
+        `concretize` only if the body has no duplicate candidates.
+
+        Raises:
+            IndexError: If the index is out of range
+        """
+        return _nth_by_enumeration(self.concretize(db, location), index)
+
 
 class StatementList:
     """
@@ -285,9 +592,34 @@ class StatementList:
         Returns:
             A generator of strings, each of which is a concreqte sequence of statements
         """
-        concretized = [stmt.concretize(db, location) for stmt in self.statements]
-        for items in set(itertools.product(*concretized)):
-            yield "\n".join(items)
+        # We deduplicate on the fly, so memory use is proportional to the
+        # number of candidates produced rather than to the size of the product.
+        seen = set()
+        for items in _concretize_product(db, location, self.statements):
+            candidate = "\n".join(items)
+            if candidate in seen:
+                continue
+            seen.add(candidate)
+            yield candidate
+
+    def count(self, db: models.DB, location: Location) -> int:
+        """
+        Returns the size of this `StatementList`'s candidate space.
+
+        Unlike `concretize`, this doesn't deduplicate: the count is the size of the full
+        product of each statement's candidates, computed without enumerating them.
+        """
+        return _product_count(db, location, self.statements)
+
+    def nth(self, db: models.DB, location: Location, index: int) -> str:
+        """
+        Returns the candidate at the given index of this `StatementList`'s candidate space,
+        without enumerating the candidates before it.
+
+        Raises:
+            IndexError: If the index is out of range
+        """
+        return "\n".join(_product_nth(db, location, self.statements, index))
 
     def view(self, db: models.DB, location: Location) -> str:
         final_str = ""
@@ -323,12 +655,19 @@ class IfStmt(Statement):
         Returns:
             A generator of strings, each of which is an `if` statement
         """
-        cond_list = self.cond_expr.concretize(db, location)
-        stmt_list = self.statement_list.concretize(db, location)
-        for (cond, stmt) in itertools.product(cond_list, stmt_list):
+        for cond, stmt in _concretize_product(db, location, (self.cond_expr, self.statement_list)):
             cand_str = "if (" + cond + ") {\n" + stmt + "\n}\n"
             yield cand_str
 
+    def count(self, db: models.DB, location: Location) -> int:
+        # Like the body's own count, this includes the duplicates that the
+        # body's concretize skips.
+        return _product_count(db, location, (self.cond_expr, self.statement_list))
+
+    def nth(self, db: models.DB, location: Location, index: int) -> str:
+        cond, stmt = _product_nth(db, location, (self.cond_expr, self.statement_list), index)
+        return "if (" + cond + ") {\n" + stmt + "\n}\n"
+
     def view(self, db: models.DB, location: Location) -> str:
         if_str = "if (" + self.cond_expr.view(db, location) + ") {\n"
         if_str += self.statement_list.view(db, location)
@@ -367,6 +706,14 @@ class ElseStmt(Statement):
             cand_str = "else {\n" + stmt + "\n}\n"
             yield cand_str
 
+    def count(self, db: models.DB, location: Location) -> int:
+        # Like the body's own count, this includes the duplicates that the
+        # body's concretize skips.
+        return self.statement_list.count(db, location)
+
+    def nth(self, db: models.DB, location: Location, index: int) -> str:
+        return "else {\n" + self.statement_list.nth(db, location, index) + "\n}\n"
+
     def view(self, db: models.DB, location: Location) -> str:
         return "else {\n" + self.statement_list.view(db, location) + "\n}\n"
 
@@ -401,6 +748,12 @@ class ReturnStmt(Statement):
             candidate_str = f"return {exp};"
             yield candidate_str
 
+    def count(self, db: models.DB, location: Location) -> int:
+        return self.expr.count(db, location)
+
+    def nth(self, db: models.DB, location: Location, index: int) -> str:
+        return f"return {self.expr.nth(db, location, index)};"
+
     def view(self, db: models.DB, location: Location):
         return f"return {self.expr.view(db, location)};"
 
@@ -482,6 +835,12 @@ class FixPattern:
         """
         yield from self.statement_list.concretize(db, location)
 
+    def count(self, db: models.DB, location: Location) -> int:
+        return self.statement_list.count(db, location)
+
+    def nth(self, db: models.DB, location: Location, index: int) -> str:
+        return self.statement_list.nth(db, location, index)
+
     def view(self, db: models.DB, location: Location) -> str:
         return self.statement_list.view(db, location)
 
@@ -535,5 +894,91 @@ class PatchTemplate:
 
         yield from self.fix_pattern.concretize(db, location)
 
+    def count(self, db: models.DB, location: Location) -> int:
+        """
+        Returns the size of this template's candidate space at the given location,
+        computed from the sizes of its sub-expressions' candidate spaces.
+
+        The candidate space is the full product of every sub-expression's candidates,
+        so it can include duplicates that `concretize` would skip.
+
+        Args:
+            db: The AST database to concretize against
+            location: The location to concretize at
+
+        Returns:
+            The number of candidates in the candidate space
+        """
+        return self.fix_pattern.count(db, location)
+
+    def nth(self, db: models.DB, location: Location, index: int) -> str:
+        """
+        Returns the candidate at the given index of this template's candidate space,
+        without enumerating the candidates before it.
+
+        Args:
+            db: The AST database to concretize against
+            location: The location to concretize at
+            index: The candidate's index, from `0` up to (but not including) `count`
+
+        Returns:
+            The candidate patch
+
+        Raises:
+            IndexError: If the index is out of range
+        """
+        return self.fix_pattern.nth(db, location, index)
+
+    def shuffled(
+        self, db: models.DB, location: Location, seed: Optional[int] = None
+    ) -> Iterator[str]:
+        """
+        Lazily yields this template's distinct candidates, in a random order: the
+        candidate space is walked in a seeded pseudorandom permutation, with duplicates
+        skipped, so that no more than the candidates drawn so far are ever kept in memory.
+
+        Args:
+            db: The AST database to concretize against
+            location: The location to concretize at
+            seed: The seed for the random number generator, if any
+
+        Returns:
+            A generator of strings, each of which is a candidate patch
+        """
+        rng = random.Random(seed)
+        seen = set()
+        for index in _random_indices(rng, self.count(db, location)):
+            candidate = self.nth(db, location, index)
+            if candidate not in seen:
+                seen.add(candidate)
+                yield candidate
+
+    def sample(
+        self, db: models.DB, location: Location, k: int, seed: Optional[int] = None
+    ) -> List[str]:
+        """
+        Returns `k` distinct candidates, drawn at random from this template's candidate
+        space (see `shuffled`). Duplicate draws are discarded, and drawing continues until
+        `k` distinct candidates have been found.
+
+        Args:
+            db: The AST database to concretize against
+            location: The location to concretize at
+            k: The number of candidates to draw
+            seed: The seed for the random number generator, if any
+
+        Returns:
+            A list of candidate patches
+
+        Raises:
+            ValueError: If `k` is larger than the number of distinct candidates
+        """
+        if k < 0:
+            raise ValueError(f"can't sample a negative number ({k}) of candidates")
+        candidates = list(itertools.islice(self.shuffled(db, location, seed), k))
+        if len(candidates) < k:
+            raise ValueError(f"can't sample {k} candidates from {len(candidates)} distinct ones")
+        return candidates
+
     def view(self, db: models.DB, location: Location) -> str:
         return self.fix_pattern.view(db, location)
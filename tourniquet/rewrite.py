@@ -0,0 +1,201 @@
+import re
+from pathlib import Path
+from typing import List
+
+from .location import SourceCoordinate
+
+# Clang's source ranges are token ranges: the end of a range is the
+# *start* of its last token. To splice at the same range that the Clang rewriter
+# would, we need to measure that last token ourselves.
+# fmt: off
+_PUNCTUATORS = sorted(
+    [
+        b"%:%:",
+        b"<<=", b">>=", b"...", b"->*", b"<=>",
+        b"->", b"++", b"--", b"<<", b">>", b"<=", b">=", b"==", b"!=", b"&&", b"||",
+        b"*=", b"/=", b"%=", b"+=", b"-=", b"&=", b"^=", b"|=", b"##", b"::", b".*",
+        # Digraphs.
+        b"<:", b":>", b"<%", b"%>", b"%:",
+    ],
+    key=len,
+    reverse=True,
+)
+# fmt: on
+
+_LITERAL_PREFIXES = {b"L", b"u", b"U", b"u8", b"R", b"LR", b"uR", b"UR", b"u8R"}
+
+# A backslash-newline is deleted before tokenization, so it can appear in the
+# middle of any token. Like Clang, we allow whitespace between the two.
+_LINE_SPLICE = re.compile(rb"\\[ \t\v\f]*\r?\n")
+
+
+def _is_ident(byte: int) -> bool:
+    return byte == ord("_") or chr(byte).isalnum() or byte >= 0x80
+
+
+def _token_length(data: bytes, offset: int) -> int:
+    """
+    Returns the length of the C or C++ token beginning at the given offset, including
+    any line splices (backslash-newlines) within it.
+
+    Unlike Clang, this doesn't special-case C++11's `<::`, and doesn't revert line
+    splices inside raw string literals.
+    """
+    length = _unspliced_token_length(data, offset)
+    splice = _LINE_SPLICE.search(data, offset)
+    if splice is None or splice.start() > offset + length:
+        return length
+
+    # The token continues past a line splice, so we measure it again over
+    # the rest of the file with every splice removed, and map its end back.
+    logical = bytearray()
+    positions: List[int] = []
+    pos = offset
+    for splice in _LINE_SPLICE.finditer(data, offset):
+        logical += data[pos : splice.start()]
+        positions.extend(range(pos, splice.start()))
+        pos = splice.end()
+    logical += data[pos:]
+    positions.extend(range(pos, len(data)))
+
+    length = _unspliced_token_length(bytes(logical), 0)
+    if length == 0:
+        return 0
+    return positions[length - 1] + 1 - offset
+
+
+def _unspliced_token_length(data: bytes, offset: int) -> int:
+    end = len(data)
+    if offset >= end:
+        return 0
+
+    pos = offset
+    first = data[pos]
+
+    # Identifiers and keywords, which might turn out to be literal prefixes.
+    if first == ord("_") or chr(first).isalpha() or first >= 0x80:
+        while pos < end and _is_ident(data[pos]):
+            pos += 1
+        if pos < end and data[pos] in b"\"'" and data[offset:pos] in _LITERAL_PREFIXES:
+            return _literal_length(data, offset, pos)
+        return pos - offset
+
+    # Preprocessing numbers, which include things like 1.5e+10 and 0x1p-3.
+    if chr(first).isdigit() or (
+        first == ord(".") and pos + 1 < end and chr(data[pos + 1]).isdigit()
+    ):
+        pos += 1
+        while pos < end:
+            if data[pos] in b"+-" and data[pos - 1] in b"eEpP":
+                pos += 1
+            elif _is_ident(data[pos]) or data[pos] in b".'":
+                pos += 1
+            else:
+                break
+        return pos - offset
+
+    if first in b"\"'":
+        return _literal_length(data, offset, pos)
+
+    for punctuator in _PUNCTUATORS:
+        if data.startswith(punctuator, pos):
+            return len(punctuator)
+
+    return 1
+
+
+def _literal_length(data: bytes, offset: int, quote: int) -> int:
+    """
+    Returns the length of the string or character literal beginning at `offset`,
+    whose opening quote is at `quote`.
+    """
+    end = len(data)
+    delimiter = data[quote : quote + 1]
+    pos = quote + 1
+
+    if data[offset:quote].endswith(b"R") and delimiter == b'"':
+        # Raw strings: R"delim( ... )delim"
+        paren = data.find(b"(", pos)
+        if paren != -1:
+            terminator = b")" + data[pos:paren] + b'"'
+            close = data.find(terminator, paren)
+            if close != -1:
+                pos = close + len(terminator)
+                while pos < end and _is_ident(data[pos]):
+                    pos += 1
+                return pos - offset
+
+    while pos < end and data[pos : pos + 1] != delimiter and data[pos] != ord("\n"):
+        pos += 2 if data[pos] == ord("\\") else 1
+    pos = min(pos + 1, end)
+
+    # C++ user-defined literal suffixes.
+    while pos < end and _is_ident(data[pos]):
+        pos += 1
+    return pos - offset
+
+
+class SourceBuffer:
+    """
+    An in-memory copy of a source file, with a precomputed line table for mapping
+    (line, column) coordinates to byte offsets.
+
+    Columns are byte columns, as reported by Clang.
+    """
+
+    @classmethod
+    def from_file(cls, path: Path):
+        """
+        Create a new `SourceBuffer` from the contents of the given file.
+        """
+        return cls(Path(path).read_bytes())
+
+    def __init__(self, data: bytes):
+        """
+        Create a new `SourceBuffer` from the given source bytes.
+        """
+        self.data = data
+        self._line_starts = [0]
+        newline = data.find(b"\n")
+        while newline != -1:
+            self._line_starts.append(newline + 1)
+            newline = data.find(b"\n", newline + 1)
+
+    def offset(self, coordinate: SourceCoordinate) -> int:
+        """
+        Returns the byte offset of the given coordinate.
+
+        Raises:
+            IndexError: If the coordinate's line is out of range
+        """
+        if not 1 <= coordinate.line <= len(self._line_starts):
+            raise IndexError(f"line {coordinate.line} out of range")
+        return self._line_starts[coordinate.line - 1] + coordinate.column - 1
+
+    def token_end(self, coordinate: SourceCoordinate) -> int:
+        """
+        Returns the byte offset just past the token that begins at the given coordinate.
+        """
+        offset = self.offset(coordinate)
+        return offset + _token_length(self.data, offset)
+
+    def replace(self, start: SourceCoordinate, end: SourceCoordinate, replacement: str) -> bytes:
+        """
+        Returns a copy of this buffer with the token range `[start, end]` replaced.
+
+        As with Clang's rewriter, `end` is the start of the range's last token, and
+        that entire token is replaced.
+
+        Args:
+            start: The coordinate of the range's first token
+            end: The coordinate of the range's last token
+            replacement: The text to replace the range with
+
+        Returns:
+            The patched source
+        """
+        return (
+            self.data[: self.offset(start)]
+            + replacement.encode()
+            + self.data[self.token_end(end) :]
+        )
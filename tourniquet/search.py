@@ -0,0 +1,209 @@
+import heapq
+import itertools
+import re
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from . import models
+from .error import PatchConcretizationError
+from .location import Location
+from .patch_lang import PatchTemplate
+
+_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+class SearchStrategy(ABC):
+    """
+    Decides which of a template's candidate patches are validated, and in what order.
+
+    `SearchStrategy` is an abstract base class; `tourniquet.Tourniquet.auto_patch` and
+    friends accept any of its subclasses.
+    """
+
+    @abstractmethod
+    def candidates(
+        self, template: PatchTemplate, db: models.DB, location: Location
+    ) -> Iterator[str]:
+        """
+        Yields the given template's candidate patches at the given location, in the order
+        they should be validated. Strategies may prune candidates by never yielding them.
+
+        Args:
+            template: The template to draw candidates from
+            db: The AST database to concretize against
+            location: The location to concretize at
+
+        Returns:
+            A generator of strings, each of which is a candidate patch
+        """
+        ...
+
+
+def _distinct(candidates: Iterable[str]) -> Iterator[str]:
+    seen: Set[str] = set()
+    for candidate in candidates:
+        if candidate not in seen:
+            seen.add(candidate)
+            yield candidate
+
+
+def _bit_reversed(count: int) -> Iterator[int]:
+    """
+    Yields every index below `count`, in bit-reversed order: 0, then 1/2, 1/4, 3/4, 1/8,
+    and so on, of the way through the range.
+    """
+    # This is exactly a breadth-first traversal of the range's binary
+    # subdivision, without having to keep a queue of intervals.
+    bits = max(count - 1, 0).bit_length()
+    for i in range(1 << bits):
+        index = int(f"{i:0{bits}b}"[::-1], 2) if bits else 0
+        if index < count:
+            yield index
+
+
+class EnumerationSearch(SearchStrategy):
+    """
+    Yields every candidate in the template's own enumeration order, i.e. the order of
+    `PatchTemplate.concretize`. This is the default strategy.
+    """
+
+    def candidates(
+        self, template: PatchTemplate, db: models.DB, location: Location
+    ) -> Iterator[str]:
+        yield from template.concretize(db, location)
+
+
+class BreadthFirstSearch(SearchStrategy):
+    """
+    Yields every candidate, breadth-first over a binary subdivision of the candidate
+    space: first the candidates at the start and in the middle of the enumeration, then
+    those in the middle of each half, then of each quarter, and so on.
+
+    Every region of the enumeration is therefore sampled early, rather than exhausting
+    one sub-expression's choices before moving on to the next's.
+    """
+
+    def candidates(
+        self, template: PatchTemplate, db: models.DB, location: Location
+    ) -> Iterator[str]:
+        indices = _bit_reversed(template.count(db, location))
+        yield from _distinct(template.nth(db, location, index) for index in indices)
+
+
+class RandomSearch(SearchStrategy):
+    """
+    Yields distinct candidates in a random order, as drawn by `PatchTemplate.shuffled`.
+    """
+
+    def __init__(self, seed: Optional[int] = None, limit: Optional[int] = None):
+        """
+        Create a new `RandomSearch`.
+
+        Args:
+            seed: The seed for the random number generator, if any
+            limit: The number of distinct candidates to yield, if not every candidate
+        """
+        self.seed = seed
+        self.limit = limit
+
+    def candidates(
+        self, template: PatchTemplate, db: models.DB, location: Location
+    ) -> Iterator[str]:
+        yield from itertools.islice(template.shuffled(db, location, self.seed), self.limit)
+
+
+class ContextScorer:
+    """
+    Scores candidate patches by how well the variables they use fit the patch location.
+
+    Each use of a variable that the patched statement already references scores `2`, each
+    use of another variable of the same type as one of those scores `1`, and each use of
+    any other variable in the enclosing function scores `-1`. Other identifiers (keywords,
+    functions, macros) don't affect the score.
+    """
+
+    def __init__(self, db: models.DB, location: Location):
+        """
+        Create a new `ContextScorer` for the given location.
+
+        Args:
+            db: The AST database to query
+            location: The location being patched
+
+        Raises:
+            PatchConcretizationError: If there's no function or statement at the location
+        """
+        function = db.function_at(location)
+        if function is None:
+            raise PatchConcretizationError(
+                f"no function contains ({location.line}, {location.column})"
+            )
+        statement = db.statement_at(location)
+        if statement is None:
+            raise PatchConcretizationError(f"no statement at ({location.line}, {location.column})")
+
+        types = {var_decl.name: var_decl.type_ for var_decl in function.var_decls}
+        referenced = {name for name in _IDENTIFIER.findall(statement.expr) if name in types}
+        referenced_types = {types[name] for name in referenced}
+
+        self.weights: Dict[str, int] = {}
+        for name, type_ in types.items():
+            if name in referenced:
+                self.weights[name] = 2
+            elif type_ in referenced_types:
+                self.weights[name] = 1
+            else:
+                self.weights[name] = -1
+
+    def __call__(self, candidate: str) -> int:
+        return sum(self.weights.get(name, 0) for name in _IDENTIFIER.findall(candidate))
+
+
+class HeuristicSearch(SearchStrategy):
+    """
+    Yields the highest-scoring candidates first, by feeding the template's enumeration
+    through a bounded priority queue.
+
+    Only `window` candidates are held at once, so the ordering is best-first within a
+    sliding window of the enumeration rather than across all of it; in exchange, the first
+    candidate is yielded without enumerating (or holding) the whole candidate space.
+    """
+
+    def __init__(
+        self,
+        window: int = 1024,
+        min_score: Optional[int] = None,
+        scorer: Optional[Callable[[models.DB, Location], Callable[[str], int]]] = None,
+    ):
+        """
+        Create a new `HeuristicSearch`.
+
+        Args:
+            window: The maximum number of candidates to hold in the priority queue
+            min_score: The score below which candidates are pruned, if any
+            scorer: Returns the scoring function for a location. Defaults to `ContextScorer`
+        """
+        if window < 1:
+            raise ValueError(f"window must be positive, not {window}")
+        self.window = window
+        self.min_score = min_score
+        self.scorer = scorer or ContextScorer
+
+    def candidates(
+        self, template: PatchTemplate, db: models.DB, location: Location
+    ) -> Iterator[str]:
+        score = self.scorer(db, location)
+        # Scores are negated since heapq is a min-heap, and the sequence
+        # number keeps equally scored candidates in their enumeration order.
+        queue: List[Tuple[int, int, str]] = []
+        for sequence, candidate in zip(itertools.count(), template.concretize(db, location)):
+            candidate_score = score(candidate)
+            if self.min_score is not None and candidate_score < self.min_score:
+                continue
+            if len(queue) < self.window:
+                heapq.heappush(queue, (-candidate_score, sequence, candidate))
+            else:
+                yield heapq.heappushpop(queue, (-candidate_score, sequence, candidate))[2]
+
+        while queue:
+            yield heapq.heappop(queue)[2]
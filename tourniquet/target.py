@@ -1,6 +1,108 @@
 import os
-import subprocess
-from typing import List, Tuple
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from . import forkserver
+from .limits import ResourceLimits, call, call_async
+
+
+@dataclass(frozen=True)
+class IncrementalBuild:
+    """
+    Builds a `Target` from a single patched translation unit, by compiling that unit
+    and linking it against cached objects for every other unit in the target.
+
+    Unlike `Target`, this is cheap to copy and can be sent to worker processes.
+    """
+
+    compiler: str
+    """
+    The compiler (and linker driver) to build with.
+    """
+
+    compile_args: List[str]
+    """
+    The arguments to compile the patched translation unit with.
+    """
+
+    link_args: List[str]
+    """
+    The arguments to link the executable with, e.g. libraries.
+    """
+
+    objects: List[Path]
+    """
+    The cached objects for every other translation unit in the target.
+    """
+
+    limits: ResourceLimits = ResourceLimits()
+    """
+    The limits to run each build command under.
+    """
+
+    def build(
+        self,
+        source: Path,
+        executable: Path,
+        include_dirs: Sequence[Path] = (),
+        shared: bool = False,
+        extra_args: Sequence[str] = (),
+    ) -> bool:
+        """
+        Compile the given (patched) source file and link it into the given executable.
+
+        Args:
+            source: The patched source file
+            executable: The path to write the executable to
+            include_dirs: Any extra include directories to compile the source file with
+            shared: Whether to link a shared object (for a `SharedObjectHarness`) rather
+                than an executable
+            extra_args: Any extra arguments to compile the source file with
+
+        Returns:
+            `True` if the executable was built successfully, or `False` if it failed to
+            build or timed out.
+        """
+        return all(
+            call(command, self.limits.build_timeout, self.limits) == 0
+            for command in self.commands(source, executable, include_dirs, shared, extra_args)
+        )
+
+    def commands(
+        self,
+        source: Path,
+        executable: Path,
+        include_dirs: Sequence[Path] = (),
+        shared: bool = False,
+        extra_args: Sequence[str] = (),
+    ) -> List[List[str]]:
+        """
+        Returns the commands that `build` runs, in order: a compile, then a link.
+        """
+        obj = executable.with_suffix(".o")
+        includes = [arg for path in include_dirs for arg in ("-I", str(path))]
+        compile_cmd = [
+            self.compiler,
+            *self.compile_args,
+            *includes,
+            *extra_args,
+            "-c",
+            "-o",
+            str(obj),
+            str(source),
+        ]
+        link_cmd = [
+            self.compiler,
+            *(["-shared"] if shared else []),
+            "-o",
+            str(executable),
+            str(obj),
+            *(str(other) for other in self.objects),
+            *self.link_args,
+        ]
+        return [compile_cmd, link_cmd]
 
 
 class Target:
@@ -18,18 +120,153 @@ class Target:
         tests: List[Tuple[str, int]],
         build_cmd: List[str],
         executable_path: str,
+        sources: Optional[List[str]] = None,
+        compiler: str = "clang",
+        compile_args: Optional[List[str]] = None,
+        link_args: Optional[List[str]] = None,
+        debug: bool = False,
+        limits: Optional[ResourceLimits] = None,
     ):
+        """
+        Create a new `Target`.
+
+        Args:
+            filepath: The source file to repair
+            tests: The test suite, as a list of `(input, expected_return_code)` tuples
+            build_cmd: The command that builds the whole program
+            executable_path: The program built by `build_cmd`
+            sources: Every translation unit in the program, for incremental builds.
+                Defaults to just `filepath`
+            compiler: The compiler to use for incremental builds
+            compile_args: Extra arguments (e.g. `-I` and `-D` flags) for compiling each
+                translation unit in incremental builds
+            link_args: Extra arguments (e.g. `-l` flags) for linking incremental builds
+            debug: Whether to compile incremental builds with debug information, rather
+                than unoptimized and without it
+            limits: The timeouts and resource limits to build and test under. Defaults
+                to no limits
+        """
         self.file_path = filepath
         if not os.path.exists(self.file_path):
             raise FileNotFoundError
         self.tests = tests
         self.build_cmd = build_cmd
         self.bin_path = executable_path
+        self.sources = [Path(source) for source in (sources or [filepath])]
+        self.compiler = compiler
+        self.compile_args = list(compile_args or [])
+        self.link_args = list(link_args or [])
+        self.debug = debug
+        self.limits = limits or ResourceLimits()
+        # Objects are cached for the lifetime of the target, and keyed on the
+        # state of their source files so that edits outside of tourniquet are noticed.
+        self._object_dir: Optional[tempfile.TemporaryDirectory] = None
+        self._objects: Dict[Path, Tuple[Tuple[int, int], Path]] = {}
+
+    @property
+    def _build_args(self) -> List[str]:
+        # Objects are always position-independent, so that the same cached
+        # objects can be linked into either executables or shared objects.
+        return [*self.compile_args, "-fPIC", "-g" if self.debug else "-O0"]
 
     def build(self) -> bool:
-        ret_code = subprocess.call(self.build_cmd)
+        ret_code = call(self.build_cmd, self.limits.build_timeout, self.limits, quiet=False)
         return ret_code == 0
 
-    # This runs the bin specified by bin path with the tests as arguments
+    async def build_async(self, timeout: Optional[float] = None) -> bool:
+        """
+        Like `build`, but runs the build command with `asyncio`.
+
+        Args:
+            timeout: The number of seconds to let the build run for, if limited. Defaults
+                to the build timeout in this target's `limits`
+
+        Returns:
+            `True` if the build succeeded, or `False` if it failed or timed out.
+        """
+        if timeout is None:
+            timeout = self.limits.build_timeout
+        return await call_async(self.build_cmd, timeout, self.limits, quiet=False) == 0
+
+    def object_for(self, source: Path) -> Optional[Path]:
+        """
+        Returns a compiled object for the given translation unit, compiling it only if it
+        hasn't been compiled yet or has changed since it was last compiled.
+
+        Args:
+            source: One of this target's `sources`
+
+        Returns:
+            The path to the object, or `None` if the translation unit fails to compile.
+        """
+        source = Path(source).resolve()
+        stat = source.stat()
+        state = (stat.st_mtime_ns, stat.st_size)
+
+        cached = self._objects.get(source)
+        if cached is not None and cached[0] == state:
+            return cached[1]
+
+        if cached is not None:
+            obj = cached[1]
+        else:
+            if self._object_dir is None:
+                self._object_dir = tempfile.TemporaryDirectory(prefix="tourniquet-objects-")
+            obj = Path(self._object_dir.name) / f"{len(self._objects)}-{source.stem}.o"
+
+        ret = call(
+            [self.compiler, *self._build_args, "-c", "-o", str(obj), str(source)],
+            self.limits.build_timeout,
+            self.limits,
+        )
+        if ret != 0:
+            return None
+
+        self._objects[source] = (state, obj)
+        return obj
+
+    def incremental_build(
+        self, patched_source: Optional[Path] = None
+    ) -> Optional[IncrementalBuild]:
+        """
+        Prepares incremental builds of this target, in which only the given translation
+        unit is recompiled. Every other translation unit is compiled at most once, and its
+        object reused by every subsequent build.
+
+        Args:
+            patched_source: The translation unit that will be patched. Defaults to this
+                target's `file_path`
+
+        Returns:
+            An `IncrementalBuild`, or `None` if any other translation unit fails to compile.
+        """
+        patched = Path(patched_source or self.file_path).resolve()
+
+        objects = []
+        for source in self.sources:
+            if source.resolve() == patched:
+                continue
+            obj = self.object_for(source)
+            if obj is None:
+                return None
+            objects.append(obj)
+
+        return IncrementalBuild(
+            self.compiler, self._build_args, self.link_args, objects, self.limits
+        )
+
     def run_tests(self) -> bool:
-        return False
+        """
+        Runs the executable at `bin_path` against this target's tests, with each test's
+        input as its only argument.
+
+        Tests are run with a `tourniquet.forkserver.ForkServer` when possible, so that the
+        executable is only started once. Tests that time out fail.
+
+        Returns:
+            `True` if every test passes.
+        """
+        failed = forkserver.first_failure(
+            Path(self.bin_path), self.tests, self.compiler, self.limits
+        )
+        return failed is None
@@ -1,37 +1,262 @@
-import shutil
-import subprocess
+import asyncio
+import hashlib
+import itertools
+import json
 import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from contextlib import contextmanager
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Dict, Iterator, Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 from . import extractor, models
+from .async_validation import AsyncValidator
+from .compile_db import CompilationDatabase
 from .error import PatchSituationError, TemplateNameError
 from .location import Location, SourceCoordinate
+from .overlay import write_overlay
 from .patch_lang import PatchTemplate
+from .rewrite import SourceBuffer
+from .search import SearchStrategy
+from .target import Target
+from .validation import ValidationReport, Validator
+
+_SOURCE_SUFFIXES = {".c", ".cpp", ".cc", ".cxx"}
+
+# The columnar extraction format's columns are native-order bytes.
+# Most are uint32; these are the exceptions.
+_COLUMN_FORMATS: Dict[str, Any] = {"is_array": "B", "size": "Q"}
+
+
+def _extract_ast_worker(
+    source_path: Path, is_cxx: bool, columnar: bool = False, args: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    # This needs to be a module-level function so that it can be sent
+    # to worker processes; the extension's own functions can't be pickled.
+    if not source_path.is_file():
+        raise FileNotFoundError(f"{source_path} is not a file")
+
+    if columnar:
+        return extractor.extract_ast_columnar(source_path, is_cxx, args)
+    return extractor.extract_ast(source_path, is_cxx, args)
+
+
+def _columns(table: Dict[str, bytes]) -> Dict[str, memoryview]:
+    """
+    Returns typed views of each column in a table from the columnar extraction format.
+    """
+    return {
+        name: memoryview(column).cast(_COLUMN_FORMATS.get(name, "I"))
+        for name, column in table.items()
+    }
+
+
+_COORDINATES = ("start_line", "start_column", "end_line", "end_column")
+
+
+def _coordinate_columns(coords: memoryview) -> List[memoryview]:
+    """
+    Splits a "coords" column into its start line, start column, end line and end column
+    columns, in the order of `_COORDINATES`.
+    """
+    return [coords[i::4] for i in range(4)]
+
+
+def _hash_file(source_path: Path) -> str:
+    digest = hashlib.sha256()
+    with source_path.open("rb") as source_file:
+        for chunk in iter(lambda: source_file.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _hash_arguments(args: Optional[List[str]]) -> str:
+    return hashlib.sha256(json.dumps(args).encode()).hexdigest()
+
+
+@dataclass(frozen=True)
+class PatchedFile:
+    """
+    A patched copy of a source file, as produced by `Tourniquet.patch`.
+    """
+
+    original: Path
+    """
+    The original source file, which is never modified.
+    """
+
+    path: Path
+    """
+    The scratch file containing the patched source.
+    """
+
+    contents: bytes
+    """
+    The patched source itself.
+    """
+
+    compiler_args: List[str]
+    """
+    The compiler arguments (`-ivfsoverlay`) that make Clang read the patched source
+    whenever it reads the original file. Compiling the original path with these
+    arguments compiles the patch.
+    """
+
+
+@dataclass
+class CollectionStats:
+    """
+    Summarizes a project-wide AST collection, as performed by `Tourniquet.collect_project`.
+    """
+
+    collected: List[Path] = field(default_factory=list)
+    """
+    The source files that were successfully collected.
+    """
+
+    failed: Dict[Path, str] = field(default_factory=dict)
+    """
+    The source files that failed to parse, mapped to their error messages.
+    """
+
+    skipped: List[Path] = field(default_factory=list)
+    """
+    The source files that were skipped, because they haven't changed since they
+    were last collected.
+    """
+
+    elapsed: float = 0.0
+    """
+    The wall-clock time taken by the collection, in seconds.
+    """
+
+    @property
+    def files_per_second(self) -> float:
+        """
+        Returns the collection's throughput, in collected files per second.
+        """
+        if self.elapsed <= 0:
+            return 0.0
+        return len(self.collected) / self.elapsed
 
 
 class Tourniquet:
-    def __init__(self, database_name):
+    def __init__(
+        self,
+        database_name,
+        batch_size: int = 1000,
+        indexed: bool = False,
+        columnar: bool = False,
+        compile_commands: Optional[Path] = None,
+    ):
         self.db_name = database_name
-        self.db = models.DB.create(database_name)
+        self.db = models.DB.create(database_name, indexed=indexed)
+        self.batch_size = batch_size
+        # The columnar extraction format produces the same database
+        # contents, but uses far less memory on large translation units.
+        self.columnar = columnar
         self.patch_templates: Dict[str, PatchTemplate] = {}
+        # When given, the compilation database supplies each source file's
+        # include paths, macro definitions, etc. to the extractor.
+        self.compilation_database: Optional[CompilationDatabase] = None
+        if compile_commands is not None:
+            self.compilation_database = CompilationDatabase.from_file(compile_commands)
 
     def _path_looks_like_cxx(self, source_path: Path):
         return source_path.suffix in [".cpp", ".cc", ".cxx"]
 
-    def _extract_ast(self, source_path: Path, is_cxx: bool = True) -> Dict[str, Any]:
-        if not source_path.is_file():
-            raise FileNotFoundError(f"{source_path} is not a file")
+    def _extract_ast(
+        self, source_path: Path, is_cxx: bool = True, args: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        return _extract_ast_worker(source_path, is_cxx, self.columnar, args)
+
+    def _compiler_args(self, source_path: Path) -> Optional[List[str]]:
+        if self.compilation_database is None:
+            return None
+        return self.compilation_database.arguments_for(source_path)
+
+    def _source_state(
+        self, source_path: Path, args: Optional[List[str]]
+    ) -> Optional[Tuple[str, float, str]]:
+        """
+        Returns the content hash, modification time and arguments hash of the given
+        (resolved) source file, or `None` if neither the file nor the arguments that it's
+        parsed with have changed since it was last collected.
+        """
+        mtime = source_path.stat().st_mtime
+        arguments_hash = _hash_arguments(args)
+        module = self.db.module_named(str(source_path))
+        if module is not None and module.arguments_hash != arguments_hash:
+            # The same file can have a different AST under different
+            # arguments, e.g. with another -D flag.
+            module = None
+        if module is not None and module.mtime == mtime:
+            return None
+
+        content_hash = _hash_file(source_path)
+        if module is not None and module.content_hash == content_hash:
+            # The file was touched, but its contents are the same.
+            # Remember the new mtime so that we can skip hashing next time.
+            module.mtime = mtime
+            self.db.session.commit()
+            return None
 
-        return extractor.extract_ast(source_path, is_cxx)
+        return content_hash, mtime, arguments_hash
 
-    def _store_ast(self, ast_info: Dict[str, Any]):
-        module = models.Module(name=ast_info["module_name"])
+    def _store_ast(
+        self,
+        ast_info: Dict[str, Any],
+        content_hash: Optional[str] = None,
+        mtime: Optional[float] = None,
+        arguments_hash: Optional[str] = None,
+    ):
+        module_name = ast_info["module_name"]
+
+        # Re-collecting a module replaces all of its contents. The deletion
+        # and the subsequent inserts are committed together, and rolled back together
+        # on failure, so a failed re-collection leaves the previous contents in place.
+        try:
+            self.db.delete_module(module_name)
+
+            # We bypass the ORM's unit of work here and insert rows in
+            # executemany-style batches instead: on large translation units, the ORM's
+            # per-object bookkeeping is slower than the parse itself.
+            inserter = models.BulkInserter(self.db.session, batch_size=self.batch_size)
+            inserter.add(
+                models.Module,
+                name=module_name,
+                content_hash=content_hash,
+                mtime=mtime,
+                arguments_hash=arguments_hash,
+            )
+
+            # Only the columnar format has a string table.
+            if "strings" in ast_info:
+                self._insert_columnar_ast(inserter, module_name, ast_info)
+            else:
+                self._insert_ast(inserter, module_name, ast_info)
+
+            inserter.flush()
+            self.db.session.commit()
+        except BaseException:
+            self.db.session.rollback()
+            # The rollback may have discarded rows that the in-memory index
+            # was built from, so rebuild it on next use.
+            self.db.invalidate(module_name)
+            raise
+        # The inserts above bypass the ORM, so anything it has already
+        # loaded may be stale.
+        self.db.session.expire_all()
+
+    def _insert_ast(
+        self, inserter: models.BulkInserter, module_name: str, ast_info: Dict[str, Any]
+    ):
         for global_ in ast_info["globals"]:
             assert global_[0] == "var_type", f"{global_[0]} != var_type"
-            global_ = models.Global(
-                module=module,
+            inserter.add(
+                models.Global,
+                module_name=module_name,
                 name=global_[5],
                 type_=global_[6],
                 start_line=global_[1],
@@ -41,7 +266,6 @@ class Tourniquet:
                 is_array=bool(global_[7]),
                 size=global_[8],
             )
-            self.db.session.add(global_)
 
         # Every subsequent member
         for func_name, exprs in ast_info["functions"].items():
@@ -56,24 +280,25 @@ class Tourniquet:
             if func_decl[0] != "func_decl":
                 continue
 
-            function = models.Function(
-                module=module,
+            function_id = inserter.add(
+                models.Function,
+                module_name=module_name,
                 name=func_name,
                 start_line=func_decl[1],
                 start_column=func_decl[2],
                 end_line=func_decl[3],
                 end_column=func_decl[4],
             )
-            self.db.session.add(function)
 
             for expr in exprs:
                 # From here, the exprs we know are "var_type" (models.VarDecl),
                 # "call_type" (models.Call), and "stmt_type" (models.Statement).
                 # "call_type" lists contain, in turn, a list of arguments,
-                # which we promote to models.Argument objects.
+                # which we promote to models.Argument rows.
                 if expr[0] == "var_type":
-                    var_decl = models.VarDecl(
-                        function=function,
+                    inserter.add(
+                        models.VarDecl,
+                        function_id=function_id,
                         name=expr[5],
                         type_=expr[6],
                         start_line=expr[1],
@@ -83,11 +308,11 @@ class Tourniquet:
                         is_array=bool(expr[7]),
                         size=expr[8],
                     )
-                    self.db.session.add(var_decl)
                 elif expr[0] == "call_type":
-                    call = models.Call(
-                        module=module,
-                        function=function,
+                    call_id = inserter.add(
+                        models.Call,
+                        module_name=module_name,
+                        function_id=function_id,
                         expr=expr[5],
                         name=expr[6],
                         start_line=expr[1],
@@ -95,34 +320,227 @@ class Tourniquet:
                         end_line=expr[3],
                         end_column=expr[4],
                     )
-                    self.db.session.add(call)
 
                     for name, type_ in expr[7:]:
-                        argument = models.Argument(call=call, name=name, type_=type_)
-                        self.db.session.add(argument)
+                        inserter.add(models.Argument, call_id=call_id, name=name, type_=type_)
                 elif expr[0] == "stmt_type":
-                    stmt = models.Statement(
-                        module=module,
-                        function=function,
+                    inserter.add(
+                        models.Statement,
+                        module_name=module_name,
+                        function_id=function_id,
                         expr=expr[5],
                         start_line=expr[1],
                         start_column=expr[2],
                         end_line=expr[3],
                         end_column=expr[4],
                     )
-                    self.db.session.add(stmt)
+                elif expr[0] == "func_decl":
+                    # A redeclaration of a function we've already seen; as in the
+                    # columnar format, the first declaration wins.
+                    continue
                 else:
                     assert False, expr[0]
 
-        self.db.session.commit()
+    def _insert_columnar_ast(
+        self, inserter: models.BulkInserter, module_name: str, ast_info: Dict[str, Any]
+    ):
+        # See extract_ast_columnar in the extractor for the layout of
+        # each table. Strings are indices into the string table, and local
+        # declarations refer to their function by its index in the functions table.
+        strings = ast_info["strings"]
+
+        globals_ = _columns(ast_info["globals"])
+        inserter.add_rows(
+            models.Global,
+            ("module_name", "name", "type_", "is_array", "size", *_COORDINATES),
+            zip(
+                itertools.repeat(module_name),
+                (strings[name] for name in globals_["name"]),
+                (strings[type_] for type_ in globals_["type"]),
+                map(bool, globals_["is_array"]),
+                globals_["size"],
+                *_coordinate_columns(globals_["coords"]),
+            ),
+        )
+
+        functions = _columns(ast_info["functions"])
+        function_ids = inserter.add_rows(
+            models.Function,
+            ("module_name", "name", *_COORDINATES),
+            zip(
+                itertools.repeat(module_name),
+                (strings[name] for name in functions["name"]),
+                *_coordinate_columns(functions["coords"]),
+            ),
+        )
+
+        var_decls = _columns(ast_info["var_decls"])
+        inserter.add_rows(
+            models.VarDecl,
+            ("function_id", "name", "type_", "is_array", "size", *_COORDINATES),
+            zip(
+                (function_ids[function] for function in var_decls["function"]),
+                (strings[name] for name in var_decls["name"]),
+                (strings[type_] for type_ in var_decls["type"]),
+                map(bool, var_decls["is_array"]),
+                var_decls["size"],
+                *_coordinate_columns(var_decls["coords"]),
+            ),
+        )
+
+        calls = _columns(ast_info["calls"])
+        call_ids = inserter.add_rows(
+            models.Call,
+            ("module_name", "function_id", "expr", "name", *_COORDINATES),
+            zip(
+                itertools.repeat(module_name),
+                (function_ids[function] for function in calls["function"]),
+                (strings[expr] for expr in calls["expr"]),
+                (strings[name] for name in calls["name"]),
+                *_coordinate_columns(calls["coords"]),
+            ),
+        )
+
+        # Each call's arguments immediately follow the previous call's.
+        arguments = _columns(ast_info["arguments"])
+        inserter.add_rows(
+            models.Argument,
+            ("call_id", "name", "type_"),
+            zip(
+                itertools.chain.from_iterable(
+                    itertools.repeat(call_id, arg_count)
+                    for call_id, arg_count in zip(call_ids, calls["arg_count"])
+                ),
+                (strings[name] for name in arguments["name"]),
+                (strings[type_] for type_ in arguments["type"]),
+            ),
+        )
+
+        statements = _columns(ast_info["statements"])
+        inserter.add_rows(
+            models.Statement,
+            ("module_name", "function_id", "expr", *_COORDINATES),
+            zip(
+                itertools.repeat(module_name),
+                (function_ids[function] for function in statements["function"]),
+                (strings[expr] for expr in statements["expr"]),
+                *_coordinate_columns(statements["coords"]),
+            ),
+        )
 
     # TODO Should take a target
-    def collect_info(self, source_path: Path):
+    def collect_info(self, source_path: Path, args: Optional[List[str]] = None) -> bool:
         """
         Collect information about the given source file and add it to the backing database.
+
+        Files that haven't changed since they were last collected (with the same
+        arguments) are skipped. Files that have changed have their previous contents in the
+        database replaced.
+
+        Args:
+            source_path: The source file to collect
+            args: Compiler arguments (e.g. `-I` and `-D` flags) to parse the file with.
+                Defaults to the file's arguments in this instance's compilation database,
+                if it has one
+
+        Returns:
+            `True` if the file was collected, or `False` if it was unchanged and skipped.
+        """
+        # Modules are named by absolute path, so that every spelling of the same
+        # file refers to the same module.
+        source_path = Path(source_path).resolve()
+        if not source_path.is_file():
+            raise FileNotFoundError(f"{source_path} is not a file")
+
+        if args is None:
+            args = self._compiler_args(source_path)
+
+        state = self._source_state(source_path, args)
+        if state is None:
+            return False
+
+        ast_info = self._extract_ast(
+            source_path, is_cxx=self._path_looks_like_cxx(source_path), args=args
+        )
+        self._store_ast(ast_info, *state)
+        return True
+
+    def collect_project(
+        self, project: Path, pattern: Optional[str] = None, jobs: Optional[int] = None
+    ) -> CollectionStats:
+        """
+        Collect information about every source file in a project and add it to the
+        backing database.
+
+        ASTs are extracted in parallel, with each worker process running its own Clang
+        frontend. Extracted ASTs are streamed back to this process, which is the only
+        writer to the database.
+
+        Each file is parsed with its arguments from the compilation database: either
+        `project` itself, or this instance's own database for directory projects.
+
+        Args:
+            project: Either a `compile_commands.json`, or a directory to search for
+                source files
+            pattern: A glob pattern to select source files with, if `project` is a directory.
+                Defaults to every C and C++ source file beneath the directory
+            jobs: The number of worker processes to use. Defaults to the number of CPUs
+
+        Returns:
+            A `CollectionStats` describing the collected and failed files.
         """
-        ast_info = self._extract_ast(source_path, is_cxx=self._path_looks_like_cxx(source_path))
-        self._store_ast(ast_info)
+        project = Path(project)
+        database = self.compilation_database
+        if project.is_dir():
+            if pattern is None:
+                sources = [path for path in project.glob("**/*") if path.suffix in _SOURCE_SUFFIXES]
+            else:
+                sources = list(project.glob(pattern))
+            sources = sorted(path.resolve() for path in sources if path.is_file())
+        else:
+            database = CompilationDatabase.from_file(project)
+            sources = database.files
+
+        stats = CollectionStats()
+        start = time.monotonic()
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {}
+            for source in sources:
+                args = database.arguments_for(source) if database is not None else None
+                try:
+                    state = self._source_state(source, args)
+                except OSError as e:
+                    stats.failed[source] = str(e)
+                    continue
+
+                if state is None:
+                    stats.skipped.append(source)
+                    continue
+
+                future = pool.submit(
+                    _extract_ast_worker,
+                    source,
+                    self._path_looks_like_cxx(source),
+                    self.columnar,
+                    args,
+                )
+                futures[future] = (source, state)
+
+            for future in as_completed(futures):
+                source, state = futures[future]
+                try:
+                    ast_info = future.result()
+                    # A file that fails to store (e.g. on an integrity error) is rolled
+                    # back by _store_ast, and doesn't stop the rest of the project.
+                    self._store_ast(ast_info, *state)
+                except Exception as e:
+                    stats.failed[source] = str(e)
+                    continue
+
+                stats.collected.append(source)
+        stats.elapsed = time.monotonic() - start
+
+        return stats
 
     def register_template(self, name: str, template: PatchTemplate):
         """
@@ -150,7 +568,9 @@ class Tourniquet:
         return view_str
 
     # TODO Should take a target
-    def concretize_template(self, template_name: str, location: Location) -> Iterator[str]:
+    def concretize_template(
+        self, template_name: str, location: Location, strategy: Optional[SearchStrategy] = None
+    ) -> Iterator[str]:
         """
         Concretize the given registered template to the given
         module and source location, yielding each candidate patch.
@@ -159,6 +579,8 @@ class Tourniquet:
             template_name: The name of the template to concretize. This name
                 must have been previously registered with `register_template`.
             location: The `Location` to concretize the template at.
+            strategy: The `tourniquet.search.SearchStrategy` that orders (and prunes)
+                the candidates. Defaults to the template's own enumeration order.
 
         Returns:
             A generator of strings, each one representing a concrete patch suitable
@@ -171,87 +593,229 @@ class Tourniquet:
         if template is None:
             raise TemplateNameError(f"no template registed with name {template_name}")
 
-        yield from template.concretize(self.db, location)
+        if strategy is None:
+            yield from template.concretize(self.db, location)
+        else:
+            yield from strategy.candidates(template, self.db, location)
 
     # TODO Should take a target
     # TODO(ww): This should take a span instead of a location, so that it doesn't have
     # to depend on the patch location being a statement.
     @contextmanager
-    def patch(self, replacement: str, location: Location) -> Iterator[bool]:
+    def patch(self, replacement: str, location: Location) -> Iterator[PatchedFile]:
         """
-        Applies the given replacement to the given location.
+        Applies the given replacement to the given location, without modifying the
+        source file itself.
 
-        Rolls back the replacement after context closure.
+        The patched source is written to a scratch file, along with a Clang virtual file
+        system overlay that maps it over the original path. Both are removed after
+        context closure. Any number of patches can be applied to the same file at once.
 
         Args:
             replacement: The patch to insert.
             location: The `Location` to insert at, including the source file.
 
         Returns:
-            A generator whose single yield is the status of the replacement operation.
+            A generator whose single yield is the `PatchedFile`.
 
         Raises:
             PatchSituationError: If the supplied location can't be used for a patch.
         """
-        try:
-            temp_file = tempfile.NamedTemporaryFile()
-            shutil.copyfile(location.filename, temp_file.name)
-
-            statement = self.db.statement_at(location)
-            if statement is None:
-                raise PatchSituationError(f"no statement at ({location.line}, {location.column})")
-
-            yield self.transform(
-                location.filename,
-                replacement,
-                statement.start_coordinate,
-                statement.end_coordinate,
-            )
-        finally:
-            shutil.copyfile(temp_file.name, location.filename)
-            temp_file.close()
+        statement = self.db.statement_at(location)
+        if statement is None:
+            raise PatchSituationError(f"no statement at ({location.line}, {location.column})")
 
-    # TODO Should take a target
-    def auto_patch(self, template_name, tests, location: Location) -> Optional[str]:
-        # TODO(ww): This should be a NamedTempFile, at the absolute minimum.
-        EXEC_FILE = Path("/tmp/target")
-
-        # Collect replacements
-        replacements = self.concretize_template(template_name, location)
-
-        # Patch
-        for replacement in replacements:
-            with self.patch(replacement, location):
-                # Just compile with clang for now
-                ret = subprocess.call(["clang", "-g", "-o", EXEC_FILE, location.filename])
-                if ret != 0:
-                    print("Error, build failed?")
-                    continue
+        original = Path(location.filename).resolve()
+        contents = self.rewrite(
+            original, replacement, statement.start_coordinate, statement.end_coordinate
+        )
+        with tempfile.TemporaryDirectory(prefix="tourniquet-") as scratch:
+            path = Path(scratch) / original.name
+            path.write_bytes(contents)
+            compiler_args = write_overlay(Path(scratch) / "overlay.yaml", {original: path})
+            yield PatchedFile(original, path, contents, compiler_args)
+
+    def auto_patch(
+        self,
+        template_name,
+        tests,
+        location: Location,
+        jobs: Optional[int] = None,
+        validator: Optional[Validator] = None,
+        target: Optional[Target] = None,
+        strategy: Optional[SearchStrategy] = None,
+    ) -> Optional[str]:
+        """
+        Concretize the given registered template at the given location and
+        validate each candidate patch against the given tests.
+
+        Args:
+            template_name: The name of the template to concretize
+            tests: The test suite, as a list of `(input, expected_return_code)` tuples
+            location: The `Location` to patch at
+            jobs: The number of candidates to validate in parallel. Defaults to the number
+                of CPUs
+            validator: The `Validator` to validate candidates with, if not the default
+                one. `jobs` is ignored if this is supplied
+            target: The `Target` that the location belongs to, if any. Candidates are
+                then built incrementally, against the target's other source files
+            strategy: The `tourniquet.search.SearchStrategy` that orders (and prunes)
+                the candidates. Defaults to the template's own enumeration order
+
+        Returns:
+            The first (in the strategy's order) candidate patch that passes every test,
+            or `None` if no candidate passes.
+
+        Raises:
+            TemplateNameError: If the supplied template name isn't registered.
+            PatchSituationError: If the supplied location can't be used for a patch.
+            BuildError: If the target's other source files fail to compile.
+        """
+        return self.validate_template(
+            template_name,
+            tests,
+            location,
+            jobs=jobs,
+            validator=validator,
+            target=target,
+            strategy=strategy,
+        ).patch
+
+    def validate_template(
+        self,
+        template_name,
+        tests,
+        location: Location,
+        jobs: Optional[int] = None,
+        validator: Optional[Validator] = None,
+        target: Optional[Target] = None,
+        strategy: Optional[SearchStrategy] = None,
+    ) -> ValidationReport:
+        """
+        Like `auto_patch`, but returns a `ValidationReport` containing the verdict
+        for every candidate that was scheduled for validation.
+        """
+        statement = self.db.statement_at(location)
+        if statement is None:
+            raise PatchSituationError(f"no statement at ({location.line}, {location.column})")
+
+        replacements = self.concretize_template(template_name, location, strategy)
+
+        if validator is None:
+            validator = Validator(jobs=jobs)
+        return validator.validate(
+            location.filename,
+            self._path_looks_like_cxx(location.filename),
+            statement.start_coordinate,
+            statement.end_coordinate,
+            replacements,
+            tests,
+            target=target,
+        )
+
+    async def auto_patch_async(
+        self,
+        template_name,
+        tests,
+        location: Location,
+        validator: Optional[AsyncValidator] = None,
+        target: Optional[Target] = None,
+        strategy: Optional[SearchStrategy] = None,
+    ) -> Optional[str]:
+        """
+        Like `auto_patch`, but validates candidates with an `AsyncValidator`, from the
+        running event loop.
+        """
+        report = await self.validate_template_async(
+            template_name, tests, location, validator=validator, target=target, strategy=strategy
+        )
+        return report.patch
+
+    async def validate_template_async(
+        self,
+        template_name,
+        tests,
+        location: Location,
+        validator: Optional[AsyncValidator] = None,
+        target: Optional[Target] = None,
+        strategy: Optional[SearchStrategy] = None,
+    ) -> ValidationReport:
+        """
+        Like `validate_template`, but validates candidates with an `AsyncValidator`,
+        from the running event loop.
+
+        The database is queried from the event loop's default executor, so this
+        `Tourniquet` mustn't be used from anywhere else until validation completes.
+        """
+        loop = asyncio.get_running_loop()
+        statement = await loop.run_in_executor(None, self.db.statement_at, location)
+        if statement is None:
+            raise PatchSituationError(f"no statement at ({location.line}, {location.column})")
+
+        replacements = self.concretize_template(template_name, location, strategy)
+
+        if validator is None:
+            validator = AsyncValidator()
+        return await validator.validate(
+            location.filename,
+            self._path_looks_like_cxx(location.filename),
+            statement.start_coordinate,
+            statement.end_coordinate,
+            replacements,
+            tests,
+            target=target,
+        )
+
+    def rewrite(
+        self,
+        filename: Path,
+        replacement: str,
+        start: SourceCoordinate,
+        end: SourceCoordinate,
+        clang_rewrite: bool = False,
+    ) -> bytes:
+        """
+        Returns the contents of the given file, with the given token range replaced.
+        The file itself is not modified.
 
-                # Run the test suite
-                failed_test = False
-                for test_case in tests:
-                    (input_, output) = test_case
-                    ret = subprocess.call([EXEC_FILE, input_])
-                    if output != ret:
-                        failed_test = True
-                        break
-                if not failed_test:
-                    # This means that its fixed :)
-                    return replacement
+        By default, the replacement is spliced directly into the file's contents.
+        With `clang_rewrite`, the file is instead parsed and rewritten with Clang,
+        which is much slower but validates the range against the file's AST.
 
-        return None
+        Args:
+            filename: The file to rewrite
+            replacement: The text to insert
+            start: The coordinate of the range's first token
+            end: The coordinate of the range's last token
+            clang_rewrite: Whether to rewrite the file with Clang
+
+        Returns:
+            The rewritten file contents.
+
+        Raises:
+            ValueError: If Clang can't rewrite the range.
+        """
+        if clang_rewrite:
+            unit = extractor.ParsedUnit(filename, self._path_looks_like_cxx(filename))
+            return unit.rewrite(replacement, start.line, start.column, end.line, end.column)
+
+        return SourceBuffer.from_file(filename).replace(start, end, replacement)
 
     def transform(
-        self, filename: Path, replacement: str, start: SourceCoordinate, end: SourceCoordinate
+        self,
+        filename: Path,
+        replacement: str,
+        start: SourceCoordinate,
+        end: SourceCoordinate,
+        clang_rewrite: bool = False,
     ):
-        res = extractor.transform(
-            filename,
-            self._path_looks_like_cxx(filename),
-            replacement,
-            start.line,
-            start.column,
-            end.line,
-            end.column,
-        )
-        return res
+        """
+        Replaces the given token range of the given file, in place.
+
+        See `rewrite` for the arguments.
+
+        Returns:
+            `True` on success.
+        """
+        Path(filename).write_bytes(self.rewrite(filename, replacement, start, end, clang_rewrite))
+        return True
@@ -0,0 +1,465 @@
+import dataclasses
+import enum
+import itertools
+import os
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from . import extractor, forkserver
+from .error import BuildError
+from .harness import SharedObjectHarness
+from .limits import ResourceLimits, call
+from .location import SourceCoordinate
+from .overlay import write_overlay
+from .rewrite import SourceBuffer
+from .target import IncrementalBuild, Target
+
+
+class Verdict(enum.Enum):
+    """
+    The outcome of validating a single candidate patch.
+    """
+
+    PASSED = "passed"
+    """
+    The candidate built and passed every test.
+    """
+
+    FAILED = "failed"
+    """
+    The candidate built, but failed at least one test.
+    """
+
+    BUILD_FAILED = "build-failed"
+    """
+    The candidate could not be built, or its build timed out.
+    """
+
+    HANG = "hang"
+    """
+    The candidate built, but a test timed out or ran out of CPU time.
+    """
+
+    SKIPPED = "skipped"
+    """
+    The candidate was never run, because another candidate passed first.
+    """
+
+    ERROR = "error"
+    """
+    Validating the candidate raised an unexpected error, e.g. because it couldn't be
+    spliced into the source, or its fork server died.
+    """
+
+
+@dataclass(frozen=True)
+class CandidateResult:
+    """
+    Records the verdict for a single candidate patch.
+    """
+
+    index: int
+    """
+    The candidate's position in the order that candidates were supplied in.
+    """
+
+    replacement: str
+    """
+    The candidate patch itself.
+    """
+
+    verdict: Verdict
+    """
+    The `Verdict` reached for this candidate.
+    """
+
+    failed_test: Optional[int] = None
+    """
+    The index of the first failing test, if the candidate failed (or hung on) a test.
+    """
+
+    executions: int = 0
+    """
+    The number of tests that were run against the candidate.
+    """
+
+    error: Optional[str] = None
+    """
+    A description of the error, if the candidate's verdict is `Verdict.ERROR`.
+    """
+
+
+@dataclass
+class ValidationReport:
+    """
+    Collects the verdicts of every candidate seen by a `Validator`.
+    """
+
+    results: List[CandidateResult] = field(default_factory=list)
+    """
+    Every `CandidateResult`, ordered by candidate index.
+    """
+
+    saved_executions: int = 0
+    """
+    An estimate of the test executions saved by running the most discriminating tests
+    first, relative to running each candidate's tests in their supplied order.
+
+    This can be negative, when prioritizing the tests cost more executions than it saved.
+    """
+
+    @property
+    def executions(self) -> int:
+        """
+        Returns the total number of test executions across every candidate.
+        """
+        return sum(result.executions for result in self.results)
+
+    @property
+    def passed(self) -> List[CandidateResult]:
+        """
+        Returns every `CandidateResult` whose verdict is `Verdict.PASSED`.
+        """
+        return [result for result in self.results if result.verdict == Verdict.PASSED]
+
+    @property
+    def patch(self) -> Optional[str]:
+        """
+        Returns the earliest (by candidate index) passing patch, if any.
+        """
+        passed = self.passed
+        if not passed:
+            return None
+        return passed[0].replacement
+
+
+@dataclass(frozen=True)
+class _ValidationContext:
+    source: Path
+    is_cxx: bool
+    start: SourceCoordinate
+    end: SourceCoordinate
+    tests: List[Tuple[str, int]]
+    compiler: str
+    buffer: Optional[SourceBuffer]
+    build: Optional[IncrementalBuild]
+    hot_swap: bool
+    overlay: bool
+    limits: ResourceLimits
+
+
+# Each worker process receives the validation context once, via the
+# pool initializer, rather than once per candidate.
+_CONTEXT: Optional[_ValidationContext] = None
+
+# When validating with Clang's rewriter, each worker process parses the
+# source once, on its first candidate, and rewrites every subsequent candidate
+# against that same parse.
+_UNIT: Optional[extractor.ParsedUnit] = None
+
+
+def _init_worker(context: _ValidationContext):
+    global _CONTEXT, _UNIT
+    _CONTEXT = context
+    _UNIT = None
+
+
+def _parsed_unit(context: _ValidationContext) -> extractor.ParsedUnit:
+    global _UNIT
+    if _UNIT is None:
+        _UNIT = extractor.ParsedUnit(context.source, context.is_cxx)
+    return _UNIT
+
+
+def _build_candidate(context: _ValidationContext, patched: Path, output: Path) -> bool:
+    if context.overlay:
+        # The overlay makes the patched copy appear at the original path,
+        # so the compiler sees the original file (and resolves its includes) as usual.
+        source = context.source
+        include_dirs: List[Path] = []
+        extra_args = write_overlay(output.with_name("overlay.yaml"), {context.source: patched})
+    else:
+        # The scratch copy lives outside of the original source tree,
+        # so we add the original directory to the include path to keep relative
+        # includes working.
+        source = patched
+        include_dirs = [context.source.parent]
+        extra_args = []
+
+    if context.build is not None:
+        return context.build.build(
+            source, output, include_dirs, shared=context.hot_swap, extra_args=extra_args
+        )
+
+    ret = call(
+        [
+            context.compiler,
+            "-g",
+            *(["-shared", "-fPIC"] if context.hot_swap else []),
+            *(arg for path in include_dirs for arg in ("-I", str(path))),
+            *extra_args,
+            "-o",
+            str(output),
+            str(source),
+        ],
+        context.limits.build_timeout,
+        context.limits,
+    )
+    return ret == 0
+
+
+def _first_failure(
+    run: Callable[[str], Optional[int]], tests: List[Tuple[str, int]], limits: ResourceLimits
+) -> Optional[Tuple[int, Verdict]]:
+    for position, (input_, output) in enumerate(tests):
+        ret = run(input_)
+        if ret != output:
+            return position, Verdict.HANG if limits.hung(ret) else Verdict.FAILED
+    return None
+
+
+def _validate_candidate(index: int, replacement: str, order: List[int]) -> CandidateResult:
+    context = _CONTEXT
+    assert context is not None, "validation worker was not initialized"
+
+    with tempfile.TemporaryDirectory(prefix="tourniquet-") as scratch:
+        scratch_dir = Path(scratch)
+        patched = scratch_dir / context.source.name
+        executable = scratch_dir / ("target.so" if context.hot_swap else "target")
+
+        if context.buffer is not None:
+            patched.write_bytes(context.buffer.replace(context.start, context.end, replacement))
+        else:
+            patched.write_bytes(
+                _parsed_unit(context).rewrite(
+                    replacement,
+                    context.start.line,
+                    context.start.column,
+                    context.end.line,
+                    context.end.column,
+                )
+            )
+
+        if not _build_candidate(context, patched, executable):
+            return CandidateResult(index, replacement, Verdict.BUILD_FAILED)
+
+        tests = [context.tests[test_index] for test_index in order]
+        if context.hot_swap:
+            # Shared objects can be linked with undefined symbols, which
+            # only surface when they're loaded; those are build failures too.
+            try:
+                harness = SharedObjectHarness(executable, limits=context.limits)
+            except (OSError, AttributeError):
+                return CandidateResult(index, replacement, Verdict.BUILD_FAILED)
+            with harness:
+                failure = _first_failure(harness.run, tests, context.limits)
+        else:
+            with forkserver.runner(executable, context.compiler, context.limits) as run:
+                failure = _first_failure(run, tests, context.limits)
+
+        if failure is not None:
+            failed, verdict = failure
+            return CandidateResult(index, replacement, verdict, order[failed], failed + 1)
+
+    return CandidateResult(index, replacement, Verdict.PASSED, executions=len(tests))
+
+
+class _TestPriorities:
+    """
+    Orders a test suite so that the tests that have failed the most candidates so far
+    run first.
+    """
+
+    def __init__(self, count: int):
+        self.kills = [0] * count
+
+    def order(self) -> List[int]:
+        # Ties keep their supplied order, so the order is stable until a
+        # test actually starts failing candidates.
+        return sorted(range(len(self.kills)), key=lambda test_index: -self.kills[test_index])
+
+    def record(self, result: CandidateResult) -> int:
+        """
+        Records the given result, and returns the number of test executions it saved,
+        which is negative if reordering the tests cost executions instead.
+        """
+        if result.failed_test is None:
+            return 0
+
+        self.kills[result.failed_test] += 1
+        # This assumes that the test that failed the candidate would also
+        # have been its first failure in the supplied order, so it's an estimate.
+        return result.failed_test + 1 - result.executions
+
+
+class Validator:
+    """
+    Validates candidate patches in parallel.
+
+    Every candidate is applied to its own scratch copy of the source file, so the
+    original source is never modified and any number of candidates can be built
+    and tested at once.
+    """
+
+    def __init__(
+        self,
+        jobs: Optional[int] = None,
+        compiler: str = "clang",
+        clang_rewrite: bool = False,
+        hot_swap: bool = False,
+        prioritize: bool = True,
+        overlay: bool = False,
+        limits: Optional[ResourceLimits] = None,
+    ):
+        """
+        Create a new `Validator`.
+
+        Args:
+            jobs: The number of worker processes to use. Defaults to the number of CPUs
+            compiler: The compiler to build each candidate with
+            clang_rewrite: Whether to apply each candidate with Clang's rewriter, rather
+                than by splicing it into an in-memory copy of the source
+            hot_swap: Whether to build each candidate as a shared object, and run its
+                tests with a `tourniquet.harness.SharedObjectHarness` in the worker
+                process, rather than linking and executing a new program per test
+            prioritize: Whether to run the tests that have failed the most candidates so
+                far first, rather than always running tests in their supplied order
+            overlay: Whether to compile each candidate at the original source's path,
+                through a virtual file system overlay (`-ivfsoverlay`), rather than
+                compiling the scratch copy directly. Requires Clang
+            limits: The timeouts and resource limits to build and test each candidate
+                under. Defaults to the target's limits, if validating against a target,
+                and otherwise to no limits
+        """
+        self.jobs = jobs or os.cpu_count() or 1
+        self.compiler = compiler
+        self.clang_rewrite = clang_rewrite
+        self.hot_swap = hot_swap
+        self.prioritize = prioritize
+        self.overlay = overlay
+        self.limits = limits
+
+    def validate(
+        self,
+        source: Path,
+        is_cxx: bool,
+        start: SourceCoordinate,
+        end: SourceCoordinate,
+        candidates: Iterable[str],
+        tests: List[Tuple[str, int]],
+        target: Optional[Target] = None,
+    ) -> ValidationReport:
+        """
+        Validate each candidate patch against the given tests, stopping early
+        once a candidate passes. Candidates after a passing one are cancelled, but
+        those before it still run to completion, so that the report's `patch` is always
+        the earliest (by candidate index) passing candidate.
+
+        By default, each candidate is built as a standalone program. With a `target`,
+        each candidate is instead built incrementally: only the patched source file is
+        recompiled, and then linked against the target's cached objects for every
+        other source file.
+
+        Each candidate stops at its first failing test; a test that exceeds the time or
+        CPU limit is killed, along with any processes it started, and its candidate gets
+        `Verdict.HANG`. When prioritizing, the tests that have failed the most candidates
+        so far run first. This is fail-fast ordering only, with no separate sampling stage:
+        a failing candidate usually stops within its first few tests, but a candidate that
+        passes still runs the whole suite, exactly once.
+
+        Args:
+            source: The source file to patch
+            is_cxx: Whether the source file is C++
+            start: The start of the source range to replace with each candidate
+            end: The end of the source range to replace with each candidate
+            candidates: The candidate patches, in the order they should be tried
+            tests: The test suite, as a list of `(input, expected_return_code)` tuples
+            target: The `Target` that the source file belongs to, if any
+
+        Returns:
+            A `ValidationReport` containing the verdict of every candidate that was scheduled
+
+        Raises:
+            BuildError: If any of the target's other source files fail to compile.
+        """
+        source = Path(source).resolve()
+        # The source is read (and its line table built) once, here, and
+        # shared with every worker; each candidate is then a single splice.
+        buffer = None if self.clang_rewrite else SourceBuffer.from_file(source)
+        # The target's unpatched objects are all compiled here, once, before
+        # any worker starts; workers only ever compile the patched source.
+        build = None
+        limits = self.limits or (target.limits if target is not None else ResourceLimits())
+        if target is not None:
+            build = target.incremental_build(source)
+            if build is None:
+                raise BuildError(f"failed to compile the unpatched sources of {source}")
+            build = dataclasses.replace(build, limits=limits)
+        context = _ValidationContext(
+            source,
+            is_cxx,
+            start,
+            end,
+            list(tests),
+            self.compiler,
+            buffer,
+            build,
+            self.hot_swap,
+            self.overlay,
+            limits,
+        )
+        report = ValidationReport()
+        priorities = _TestPriorities(len(context.tests))
+        supplied_order = list(range(len(context.tests)))
+        candidate_iter = enumerate(candidates)
+        pending: Dict[Future, Tuple[int, str]] = {}
+
+        with ProcessPoolExecutor(
+            max_workers=self.jobs, initializer=_init_worker, initargs=(context,)
+        ) as pool:
+
+            def schedule(count: int):
+                for index, replacement in itertools.islice(candidate_iter, count):
+                    order = priorities.order() if self.prioritize else supplied_order
+                    future = pool.submit(_validate_candidate, index, replacement, order)
+                    pending[future] = (index, replacement)
+
+            # We keep a bounded number of candidates in flight, rather than
+            # submitting everything up front: the candidate stream can be enormous,
+            # and we want to stop drawing from it as soon as something passes.
+            schedule(2 * self.jobs)
+            first_passed: Optional[int] = None
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, replacement = pending.pop(future)
+                    if future.cancelled():
+                        result = CandidateResult(index, replacement, Verdict.SKIPPED)
+                    elif future.exception() is not None:
+                        # One broken candidate shouldn't throw away every other
+                        # candidate's results.
+                        error = f"{type(future.exception()).__name__}: {future.exception()}"
+                        result = CandidateResult(index, replacement, Verdict.ERROR, error=error)
+                    else:
+                        result = future.result()
+                    report.results.append(result)
+                    report.saved_executions += priorities.record(result)
+
+                    if result.verdict == Verdict.PASSED and (
+                        first_passed is None or index < first_passed
+                    ):
+                        # Only later candidates are cancelled: earlier ones may still
+                        # pass, and the earliest passing candidate is the patch.
+                        first_passed = index
+                        for other, (other_index, _) in pending.items():
+                            if other_index > index:
+                                other.cancel()
+
+                if first_passed is None:
+                    schedule(len(done))
+
+        report.results.sort(key=lambda result: result.index)
+        return report
@@ -1,61 +1,53 @@
 #include "ASTExporter.h"
 
-ASTExporterVisitor::ASTExporterVisitor(ASTContext *Context, PyObject *info)
-    : Context(Context), tree_info(info), current_func(nullptr) {}
-
-void ASTExporterVisitor::PyDictUpdateEntry(PyObject *dict, const char *key,
-                                           PyObject *new_item) {
-  if (auto old_item = PyDict_GetItemString(dict, key)) {
-    PyList_Append(old_item, new_item);
-  } else {
-    // Always init to be [item]
-    PyObject *arr = PyList_New(0);
-    PyList_Append(arr, new_item);
-    PyDict_SetItemString(dict, key, arr);
-  }
+ASTExporterVisitor::ASTExporterVisitor(ASTContext *Context, ExtractedAST *info)
+    : Context(Context), tree_info(info), current_func(nullptr),
+      current_func_index(std::nullopt) {}
+
+void ASTExporterVisitor::FillRange(ASTEntry &entry, SourceLocation begin,
+                                   SourceLocation end) {
+  auto &srcMgr = Context->getSourceManager();
+  entry.start_line = srcMgr.getExpansionLineNumber(begin);
+  entry.start_col = srcMgr.getExpansionColumnNumber(begin);
+  entry.end_line = srcMgr.getExpansionLineNumber(end);
+  entry.end_col = srcMgr.getExpansionColumnNumber(end);
 }
 
-PyObject *ASTExporterVisitor::BuildStmtEntry(Stmt *stmt) {
-  const auto expr = getText(*stmt, *Context).str();
-
-  unsigned int start_line =
-      Context->getSourceManager().getExpansionLineNumber(stmt->getBeginLoc());
-  unsigned int start_col =
-      Context->getSourceManager().getExpansionColumnNumber(stmt->getBeginLoc());
-  unsigned int end_line =
-      Context->getSourceManager().getExpansionLineNumber(stmt->getEndLoc());
-  unsigned int end_col =
-      Context->getSourceManager().getExpansionColumnNumber(stmt->getEndLoc());
-
-  PyObject *new_arr = PyList_New(0);
-  PyList_Append(new_arr, PyUnicode_FromString("stmt_type"));
-  PyList_Append(new_arr, PyLong_FromUnsignedLong(start_line));
-  PyList_Append(new_arr, PyLong_FromUnsignedLong(start_col));
-  PyList_Append(new_arr, PyLong_FromUnsignedLong(end_line));
-  PyList_Append(new_arr, PyLong_FromUnsignedLong(end_col));
-  PyList_Append(new_arr, PyUnicode_FromString(expr.c_str()));
-
-  return new_arr;
+ASTEntry ASTExporterVisitor::BuildStmtEntry(Stmt *stmt) {
+  ASTEntry entry;
+  entry.kind = EntryKind::Stmt;
+  FillRange(entry, stmt->getBeginLoc(), stmt->getEndLoc());
+  entry.expr = getText(*stmt, *Context).str();
+
+  return entry;
 }
 
-void ASTExporterVisitor::AddGlobalEntry(PyObject *entry) {
-  PyDictUpdateEntry(tree_info, "globals", entry);
+void ASTExporterVisitor::AddGlobalEntry(ASTEntry entry) {
+  tree_info->globals.push_back(std::move(entry));
 }
 
-void ASTExporterVisitor::AddFunctionEntry(const char *func_name,
-                                          PyObject *entry) {
-  if (auto functions = PyDict_GetItemString(tree_info, "functions")) {
-    PyDictUpdateEntry(functions, func_name, entry);
-  } else {
-    functions = PyDict_New();
-    PyDict_SetItemString(tree_info, "functions", functions);
-    PyDictUpdateEntry(functions, func_name, entry);
+size_t ASTExporterVisitor::FunctionIndex(const std::string &func_name) {
+  auto it = tree_info->function_indices.find(func_name);
+  if (it == tree_info->function_indices.end()) {
+    it = tree_info->function_indices
+             .emplace(func_name, tree_info->functions.size())
+             .first;
+    tree_info->functions.emplace_back(func_name, std::vector<ASTEntry>());
   }
+
+  return it->second;
+}
+
+void ASTExporterVisitor::AddFunctionEntry(size_t func_index, ASTEntry entry) {
+  tree_info->functions[func_index].second.push_back(std::move(entry));
 }
 
 bool ASTExporterVisitor::VisitDeclStmt(Stmt *stmt) {
-  AddFunctionEntry(current_func->getNameAsString().c_str(),
-                   BuildStmtEntry(stmt));
+  if (!current_func_index) {
+    return true;
+  }
+
+  AddFunctionEntry(*current_func_index, BuildStmtEntry(stmt));
   return true;
 }
 
@@ -68,56 +60,40 @@ bool ASTExporterVisitor::VisitVarDecl(VarDecl *vdecl) {
     return true;
   }
 
-  unsigned int start_line =
-      Context->getSourceManager().getExpansionLineNumber(vdecl->getBeginLoc());
-  unsigned int start_col = Context->getSourceManager().getExpansionColumnNumber(
-      vdecl->getBeginLoc());
-  unsigned int end_line =
-      Context->getSourceManager().getExpansionLineNumber(vdecl->getEndLoc());
-  unsigned int end_col =
-      Context->getSourceManager().getExpansionColumnNumber(vdecl->getEndLoc());
-
-  // This Python list object contains our variable declaration state,
-  // with the following layout:
-  // [
-  //   "var_type", start_line, start_col, end_line, end_col,
-  //   var_name, var_type, is_array, size
-  // ]
-  // The variable declaration is either added to the list under the "globals"
-  // key or to its enclosing function, depending on whether it's in a function.
-
-  PyObject *new_arr = PyList_New(0);
-  PyList_Append(new_arr, PyUnicode_FromString("var_type"));
-  PyList_Append(new_arr, PyLong_FromUnsignedLong(start_line));
-  PyList_Append(new_arr, PyLong_FromUnsignedLong(start_col));
-  PyList_Append(new_arr, PyLong_FromUnsignedLong(end_line));
-  PyList_Append(new_arr, PyLong_FromUnsignedLong(end_col));
-  PyList_Append(new_arr,
-                PyUnicode_FromString(vdecl->getNameAsString().c_str()));
+  // The variable declaration is either added to the globals or to its
+  // enclosing function, depending on whether it's in a function.
+  ASTEntry entry;
+  entry.kind = EntryKind::VarDecl;
+  FillRange(entry, vdecl->getBeginLoc(), vdecl->getEndLoc());
+  entry.name = vdecl->getNameAsString();
 
   auto qt = vdecl->getType();
   if (auto arr_type = llvm::dyn_cast<ConstantArrayType>(qt.getTypePtr())) {
-    auto size = arr_type->getSize().getZExtValue();
-    std::string type = arr_type->getElementType().getAsString();
-    PyList_Append(new_arr, PyUnicode_FromString(type.c_str()));
-    PyList_Append(new_arr, PyLong_FromUnsignedLong(1));
-    PyList_Append(new_arr, PyLong_FromUnsignedLong(size));
+    entry.type = arr_type->getElementType().getAsString();
+    entry.is_array = true;
+    entry.size = arr_type->getSize().getZExtValue();
   } else {
-    PyList_Append(new_arr, PyUnicode_FromString(qt.getAsString().c_str()));
-    PyList_Append(new_arr, PyLong_FromUnsignedLong(0));
+    entry.type = qt.getAsString();
+    entry.is_array = false;
     auto type_info = Context->getTypeInfo(qt);
-    PyList_Append(new_arr, PyLong_FromUnsignedLong(type_info.Width / 8));
+    entry.size = type_info.Width / 8;
   }
 
   auto parent_func = vdecl->getParentFunctionOrMethod();
   if (parent_func == nullptr) {
-    AddGlobalEntry(new_arr);
+    AddGlobalEntry(std::move(entry));
   } else {
     FunctionDecl *fdecl = llvm::dyn_cast<FunctionDecl>(parent_func);
     if (fdecl->isFileContext()) {
       return true;
     }
-    AddFunctionEntry(fdecl->getNameAsString().c_str(), new_arr);
+    // Most local declarations belong to the function that we're
+    // currently visiting, but parameters of (skipped) external declarations
+    // don't, so we fall back on a lookup by name for those.
+    size_t func_index = fdecl == current_func
+                            ? *current_func_index
+                            : FunctionIndex(fdecl->getNameAsString());
+    AddFunctionEntry(func_index, std::move(entry));
   }
 
   return true;
@@ -144,38 +120,26 @@ bool ASTExporterVisitor::VisitCallExpr(CallExpr *call_expr) {
     return true;
   }
 
-  auto func_name = current_func->getNameAsString();
+  // Calls outside of any function (e.g. in a global initializer) have
+  // nowhere to be recorded, so we skip them.
+  if (!current_func_index) {
+    return true;
+  }
+
   // Every CallExpr is a Stmt, so also record it as a Stmt.
-  AddFunctionEntry(func_name.c_str(), BuildStmtEntry(call_expr));
-
-  std::string callee = decl_name.getAsString();
-  unsigned int start_line = Context->getSourceManager().getExpansionLineNumber(
-      call_expr->getBeginLoc());
-  unsigned int start_col = Context->getSourceManager().getExpansionColumnNumber(
-      call_expr->getBeginLoc());
-  unsigned int end_line = Context->getSourceManager().getExpansionLineNumber(
-      call_expr->getEndLoc());
-  unsigned int end_col = Context->getSourceManager().getExpansionColumnNumber(
-      call_expr->getEndLoc());
-
-  PyObject *new_arr = PyList_New(0);
-  PyList_Append(new_arr, PyUnicode_FromString("call_type"));
-  PyList_Append(new_arr, PyLong_FromUnsignedLong(start_line));
-  PyList_Append(new_arr, PyLong_FromUnsignedLong(start_col));
-  PyList_Append(new_arr, PyLong_FromUnsignedLong(end_line));
-  PyList_Append(new_arr, PyLong_FromUnsignedLong(end_col));
-  PyList_Append(new_arr, PyUnicode_FromString(expr.c_str()));
-  PyList_Append(new_arr, PyUnicode_FromString(callee.c_str()));
+  AddFunctionEntry(*current_func_index, BuildStmtEntry(call_expr));
+
+  ASTEntry entry;
+  entry.kind = EntryKind::Call;
+  FillRange(entry, call_expr->getBeginLoc(), call_expr->getEndLoc());
+  entry.expr = expr;
+  entry.name = decl_name.getAsString();
 
   for (auto arg : call_expr->arguments()) {
-    auto arg_arr = PyList_New(0);
-    PyList_Append(arg_arr,
-                  PyUnicode_FromString(getText(*arg, *Context).str().c_str()));
-    PyList_Append(arg_arr,
-                  PyUnicode_FromString(arg->getType().getAsString().c_str()));
-    PyList_Append(new_arr, arg_arr);
+    entry.arguments.emplace_back(getText(*arg, *Context).str(),
+                                 arg->getType().getAsString());
   }
-  AddFunctionEntry(func_name.c_str(), new_arr);
+  AddFunctionEntry(*current_func_index, std::move(entry));
   return true;
 }
 
@@ -185,27 +149,17 @@ bool ASTExporterVisitor::VisitFunctionDecl(FunctionDecl *func_decl) {
     return true;
   }
 
-  unsigned int start_line = Context->getSourceManager().getExpansionLineNumber(
-      func_decl->getBeginLoc());
-  unsigned int start_col = Context->getSourceManager().getExpansionColumnNumber(
-      func_decl->getBeginLoc());
-  unsigned int end_line = Context->getSourceManager().getExpansionLineNumber(
-      func_decl->getEndLoc());
-  unsigned int end_col = Context->getSourceManager().getExpansionColumnNumber(
-      func_decl->getEndLoc());
-
-  PyObject *new_arr = PyList_New(0);
-  PyList_Append(new_arr, PyUnicode_FromString("func_decl"));
-  PyList_Append(new_arr, PyLong_FromUnsignedLong(start_line));
-  PyList_Append(new_arr, PyLong_FromUnsignedLong(start_col));
-  PyList_Append(new_arr, PyLong_FromUnsignedLong(end_line));
-  PyList_Append(new_arr, PyLong_FromUnsignedLong(end_col));
-
-  AddFunctionEntry(func_decl->getNameAsString().c_str(), new_arr);
-
-  // NOTE(ww) Subsequent visitor methods use this member to determine which
+  ASTEntry entry;
+  entry.kind = EntryKind::FuncDecl;
+  FillRange(entry, func_decl->getBeginLoc(), func_decl->getEndLoc());
+
+  size_t func_index = FunctionIndex(func_decl->getNameAsString());
+  AddFunctionEntry(func_index, std::move(entry));
+
+  // NOTE(ww) Subsequent visitor methods use these members to determine which
   // function they're in.
   current_func = func_decl;
+  current_func_index = func_index;
 
   return true;
 }
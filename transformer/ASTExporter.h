@@ -28,12 +28,52 @@
 #include <llvm/Support/CommandLine.h>
 #include <llvm/Support/FileSystem.h>
 #include <llvm/Support/raw_ostream.h>
-
-#include <Python.h>
+#include <optional>
+#include <string>
+#include <unordered_map>
+#include <utility>
+#include <vector>
 
 using namespace clang::tooling;
 using namespace clang;
 
+/*
+ * The kinds of AST facts that the exporter records. These correspond to the
+ * "func_decl", "var_type", "call_type", and "stmt_type" lists seen by Python.
+ */
+enum class EntryKind { FuncDecl, VarDecl, Call, Stmt };
+
+/*
+ * A single AST fact. Which fields are meaningful depends on the kind:
+ *   FuncDecl: the source range only
+ *   VarDecl:  name, type, is_array, size
+ *   Call:     expr, name (the callee), arguments
+ *   Stmt:     expr
+ */
+struct ASTEntry {
+  EntryKind kind;
+  unsigned int start_line, start_col, end_line, end_col;
+  std::string name;
+  std::string type;
+  std::string expr;
+  bool is_array = false;
+  unsigned long long size = 0;
+  // (argument text, argument type) pairs
+  std::vector<std::pair<std::string, std::string>> arguments;
+};
+
+/*
+ * Everything extracted from a single translation unit. This is plain C++
+ * state, so it can be built up without holding the GIL; it's converted to
+ * Python objects only once extraction is complete.
+ */
+struct ExtractedAST {
+  std::vector<ASTEntry> globals;
+  // Each function's entries, in the order that functions were first seen.
+  std::vector<std::pair<std::string, std::vector<ASTEntry>>> functions;
+  std::unordered_map<std::string, size_t> function_indices;
+};
+
 /*
  * This is a simpler AST visitor that collects some information from nodes it
  * vists and records some information about the nodes. For search based repair,
@@ -45,24 +85,29 @@ using namespace clang;
 class ASTExporterVisitor
     : public clang::RecursiveASTVisitor<ASTExporterVisitor> {
 public:
-  ASTExporterVisitor(ASTContext *Context, PyObject *info);
+  ASTExporterVisitor(ASTContext *Context, ExtractedAST *info);
   bool VisitDeclStmt(Stmt *stmt);
   bool VisitVarDecl(VarDecl *vdecl);
   bool VisitCallExpr(CallExpr *call_expr);
   bool VisitFunctionDecl(FunctionDecl *func_decl);
 
 private:
-  void PyDictUpdateEntry(PyObject *dict, const char *key, PyObject *new_item);
-  PyObject *BuildStmtEntry(Stmt *stmt);
-  void AddGlobalEntry(PyObject *entry);
-  void AddFunctionEntry(const char *func_name, PyObject *entry);
+  void FillRange(ASTEntry &entry, SourceLocation begin, SourceLocation end);
+  ASTEntry BuildStmtEntry(Stmt *stmt);
+  void AddGlobalEntry(ASTEntry entry);
+  size_t FunctionIndex(const std::string &func_name);
+  void AddFunctionEntry(size_t func_index, ASTEntry entry);
 
   ASTContext *Context;
-  PyObject *tree_info;
+  ExtractedAST *tree_info;
   // Clang doesn't store parental relationships for statements (it does for
   // decls) Meaning from a CallExpr you cant find the Caller Function with any
   // get method etc. Just keep track of our current function as we traverse
   FunctionDecl *current_func;
+  // The index of current_func's entries in tree_info->functions, so that
+  // we don't have to look them up by name for every node. Empty until we've
+  // visited a function, e.g. in a global initializer.
+  std::optional<size_t> current_func_index;
 };
 
 /*
@@ -73,7 +118,7 @@ private:
 
 class ASTExporterConsumer : public clang::ASTConsumer {
 public:
-  explicit ASTExporterConsumer(clang::ASTContext *Context, PyObject *info)
+  explicit ASTExporterConsumer(clang::ASTContext *Context, ExtractedAST *info)
       : Visitor(Context, info) {}
 
   virtual void HandleTranslationUnit(clang::ASTContext &Context) {
@@ -92,7 +137,7 @@ public:
         new ASTExporterConsumer(&Compiler.getASTContext(), extract_results_));
   }
 
-  explicit ASTExporterFrontendAction(PyObject *extract_results)
+  explicit ASTExporterFrontendAction(ExtractedAST *extract_results)
       : extract_results_{extract_results} {}
 
   ASTExporterFrontendAction(const ASTExporterFrontendAction &) = delete;
@@ -100,5 +145,5 @@ public:
   operator=(const ASTExporterFrontendAction &) = delete;
 
 private:
-  PyObject *extract_results_;
+  ExtractedAST *extract_results_;
 };
@@ -32,8 +32,6 @@
 #include <llvm/Support/FileSystem.h>
 #include <llvm/Support/raw_ostream.h>
 
-#include <Python.h>
-
 using namespace clang;
 using namespace llvm;
 
@@ -58,16 +56,18 @@ class ASTPatchAction : public ASTFrontendAction {
 public:
   explicit ASTPatchAction(int start_line, int start_col, int end_line,
                           int end_col, std::string replacement,
-                          std::string filepath)
+                          std::string filepath, std::string *error)
       : start_line(start_line), start_col(start_col), end_line(end_line),
-        end_col(end_col), replacement(replacement), filepath(filepath) {}
+        end_col(end_col), replacement(replacement), filepath(filepath),
+        error(error) {}
 
   ASTPatchAction(const ASTPatchAction &) = delete;
   ASTPatchAction &operator=(const ASTPatchAction &) = delete;
 
   // TODO There is probably a better place to do this, HandleTranslationUnit
   // maybe?
-  // TODO Best way to handle errors?
+  // This runs without the GIL held, so failures are reported
+  // through the error string rather than by setting a Python exception.
   void EndSourceFileAction() override {
     FileID id = rewriter.getSourceMgr().getMainFileID();
     const FileEntry *Entry = rewriter.getSourceMgr().getFileEntryForID(id);
@@ -78,7 +78,7 @@ public:
     if (ofs.is_open()) {
       ofs << output_stream.str();
     } else {
-      PyErr_SetString(PyExc_IOError, "Failed to open file for patching");
+      *error = "Failed to open file for patching";
     }
   }
 
@@ -95,4 +95,5 @@ private:
   int start_line, start_col, end_line, end_col;
   std::string replacement;
   std::string filepath;
+  std::string *error;
 };
@@ -0,0 +1,95 @@
+#include "ParsedUnit.h"
+
+#include <algorithm>
+#include <clang/Lex/Lexer.h>
+#include <clang/Rewrite/Core/Rewriter.h>
+#include <clang/Tooling/Tooling.h>
+
+ParsedUnit::ParsedUnit(std::string filename, std::unique_ptr<ASTUnit> unit)
+    : filename(std::move(filename)), unit(std::move(unit)) {}
+
+std::unique_ptr<ParsedUnit>
+ParsedUnit::Parse(const std::string &filename, const std::string &data,
+                  const std::vector<std::string> &args, std::string &error) {
+  auto unit = clang::tooling::buildASTFromCodeWithArgs(data, args, filename);
+  if (unit == nullptr) {
+    error = "Failed to parse " + filename;
+    return nullptr;
+  }
+
+  return std::unique_ptr<ParsedUnit>(new ParsedUnit(filename, std::move(unit)));
+}
+
+void ParsedUnit::Extract(ExtractedAST &ast) {
+  std::lock_guard<std::mutex> lock(mutex);
+
+  auto &context = unit->getASTContext();
+  ASTExporterVisitor visitor(&context, &ast);
+  visitor.TraverseDecl(context.getTranslationUnitDecl());
+}
+
+bool ParsedUnit::Rewrite(const std::string &replacement,
+                         unsigned int start_line, unsigned int start_col,
+                         unsigned int end_line, unsigned int end_col,
+                         std::string &output, std::string &error) {
+  return Rewrite({{replacement, start_line, start_col, end_line, end_col}},
+                 output, error);
+}
+
+bool ParsedUnit::Rewrite(const std::vector<SourceEdit> &edits,
+                         std::string &output, std::string &error) {
+  std::lock_guard<std::mutex> lock(mutex);
+
+  SourceManager &srcMgr = unit->getSourceManager();
+  const LangOptions &langOpts = unit->getLangOpts();
+  FileID id = srcMgr.getMainFileID();
+  const FileEntry *entry = srcMgr.getFileEntryForID(id);
+
+  // Each edit's range, as [start, end) file offsets.
+  std::vector<std::pair<unsigned int, unsigned int>> offsets;
+  std::vector<SourceRange> ranges;
+  for (const auto &edit : edits) {
+    SourceLocation start_loc =
+        srcMgr.translateFileLineCol(entry, edit.start_line, edit.start_col);
+    SourceLocation end_loc =
+        srcMgr.translateFileLineCol(entry, edit.end_line, edit.end_col);
+    if (start_loc.isInvalid() || end_loc.isInvalid()) {
+      error = "Invalid source range for rewrite";
+      return false;
+    }
+
+    offsets.emplace_back(
+        srcMgr.getFileOffset(start_loc),
+        srcMgr.getFileOffset(end_loc) +
+            Lexer::MeasureTokenLength(end_loc, srcMgr, langOpts));
+    ranges.emplace_back(start_loc, end_loc);
+  }
+
+  std::sort(offsets.begin(), offsets.end());
+  for (size_t i = 1; i < offsets.size(); ++i) {
+    if (offsets[i].first < offsets[i - 1].second) {
+      error = "Overlapping source ranges for rewrite";
+      return false;
+    }
+  }
+
+  // Each rewrite gets its own rewriter, so edits never accumulate
+  // across rewrites. The rewriter only lexes the last token of each range to
+  // find its end; the rest of the file is copied as-is.
+  Rewriter rewriter(srcMgr, langOpts);
+  for (size_t i = 0; i < edits.size(); ++i) {
+    if (rewriter.ReplaceText(ranges[i], edits[i].replacement)) {
+      error = "Failed to rewrite source range";
+      return false;
+    }
+  }
+
+  const RewriteBuffer *buffer = rewriter.getRewriteBufferFor(id);
+  if (buffer == nullptr) {
+    output = srcMgr.getBufferData(id).str();
+  } else {
+    output = std::string(buffer->begin(), buffer->end());
+  }
+
+  return true;
+}
@@ -0,0 +1,76 @@
+/*
+ * ParsedUnit.h
+ *
+ * A translation unit that is parsed once, and then queried and rewritten
+ * any number of times.
+ */
+
+#pragma once
+
+#include "ASTExporter.h"
+
+#include <clang/Frontend/ASTUnit.h>
+#include <memory>
+#include <mutex>
+#include <string>
+#include <vector>
+
+/*
+ * A replacement of one token range of a source file.
+ */
+struct SourceEdit {
+  std::string replacement;
+  unsigned int start_line;
+  unsigned int start_col;
+  unsigned int end_line;
+  unsigned int end_col;
+};
+
+class ParsedUnit {
+public:
+  /*
+   * Parses the given source, which was read from the given filename, with the
+   * given compiler arguments. Returns nullptr and fills in error on failure.
+   */
+  static std::unique_ptr<ParsedUnit> Parse(const std::string &filename,
+                                           const std::string &data,
+                                           const std::vector<std::string> &args,
+                                           std::string &error);
+
+  ParsedUnit(const ParsedUnit &) = delete;
+  ParsedUnit &operator=(const ParsedUnit &) = delete;
+
+  const std::string &Filename() const { return filename; }
+
+  /*
+   * Collects the unit's AST facts, exactly as an extract_ast run would.
+   */
+  void Extract(ExtractedAST &ast);
+
+  /*
+   * Replaces the given token range of the main file, storing the rewritten
+   * file in output. The parsed AST is never modified, so every rewrite starts
+   * from the original source. Returns false and fills in error if the range
+   * can't be rewritten.
+   */
+  bool Rewrite(const std::string &replacement, unsigned int start_line,
+               unsigned int start_col, unsigned int end_line,
+               unsigned int end_col, std::string &output, std::string &error);
+
+  /*
+   * Like Rewrite, but applies several edits together. The edits' ranges must
+   * not overlap.
+   */
+  bool Rewrite(const std::vector<SourceEdit> &edits, std::string &output,
+               std::string &error);
+
+private:
+  ParsedUnit(std::string filename, std::unique_ptr<ASTUnit> unit);
+
+  std::string filename;
+  std::unique_ptr<ASTUnit> unit;
+  // Queries can come from multiple threads once the GIL is released,
+  // and the source manager fills in some of its caches (e.g. line tables)
+  // lazily, so every query on a unit is serialized.
+  std::mutex mutex;
+};
@@ -0,0 +1,251 @@
+#include "PreambleCache.h"
+
+#include <atomic>
+#include <clang/Basic/LangOptions.h>
+#include <clang/Basic/SourceManager.h>
+#include <clang/Basic/Version.h>
+#include <clang/Frontend/CompilerInstance.h>
+#include <clang/Frontend/FrontendActions.h>
+#include <clang/Lex/Lexer.h>
+#include <clang/Lex/PreprocessorOptions.h>
+#include <clang/Tooling/Tooling.h>
+#include <fstream>
+#include <llvm/ADT/SmallString.h>
+#include <llvm/ADT/StringExtras.h>
+#include <llvm/Support/Chrono.h>
+#include <llvm/Support/FileSystem.h>
+#include <llvm/Support/Path.h>
+#include <llvm/Support/Process.h>
+#include <llvm/Support/SHA1.h>
+#include <memory>
+
+using namespace clang;
+
+PreambleCache preamble_cache;
+
+namespace {
+
+struct Dependency {
+  std::string path;
+  uint64_t size;
+  int64_t mtime;
+};
+
+/*
+ * Builds a precompiled preamble, recording every header that went into it.
+ */
+class PreambleGenerateAction : public GeneratePCHAction {
+public:
+  PreambleGenerateAction(std::string output,
+                         std::vector<Dependency> *dependencies)
+      : output(std::move(output)), dependencies(dependencies) {}
+
+protected:
+  bool BeginInvocation(CompilerInstance &CI) override {
+    CI.getFrontendOpts().OutputFile = output;
+    // This mirrors the way Clang builds its own preambles: the
+    // preprocessor records its state at the end of the preamble, so that
+    // a parse of the full file can pick up exactly where it leaves off.
+    CI.getPreprocessorOpts().GeneratePreamble = true;
+    return GeneratePCHAction::BeginInvocation(CI);
+  }
+
+  void EndSourceFileAction() override {
+    auto &srcMgr = getCompilerInstance().getSourceManager();
+    const FileEntry *main = srcMgr.getFileEntryForID(srcMgr.getMainFileID());
+    for (auto it = srcMgr.fileinfo_begin(); it != srcMgr.fileinfo_end(); ++it) {
+      const FileEntry *entry = it->first;
+      if (entry == nullptr || entry == main) {
+        continue;
+      }
+      dependencies->push_back(
+          {entry->getName().str(), static_cast<uint64_t>(entry->getSize()),
+           static_cast<int64_t>(entry->getModificationTime())});
+    }
+
+    GeneratePCHAction::EndSourceFileAction();
+  }
+
+private:
+  std::string output;
+  std::vector<Dependency> *dependencies;
+};
+
+PreambleBounds compute_preamble(const std::string &data, bool is_cxx) {
+  LangOptions lang_opts;
+  lang_opts.CPlusPlus = is_cxx;
+  lang_opts.LineComment = true;
+  return Lexer::ComputePreamble(data, lang_opts);
+}
+
+std::string cache_key(const std::string &filename, StringRef preamble,
+                      bool ends_at_start_of_line,
+                      const std::vector<std::string> &args) {
+  const StringRef separator("\0", 1);
+
+  llvm::SHA1 hasher;
+  hasher.update(StringRef(getClangFullVersion()));
+  hasher.update(separator);
+  hasher.update(StringRef(filename));
+  hasher.update(separator);
+  for (const auto &arg : args) {
+    hasher.update(StringRef(arg));
+    hasher.update(separator);
+  }
+  hasher.update(StringRef(ends_at_start_of_line ? "1" : "0"));
+  hasher.update(preamble);
+
+  return llvm::toHex(hasher.final());
+}
+
+// Returns true if every header listed in the given dependency file is
+// unchanged since the file was written.
+bool dependencies_valid(const std::string &deps_path) {
+  std::ifstream deps(deps_path);
+  if (!deps.is_open()) {
+    return false;
+  }
+
+  // Each line is "<mtime> <size> <path>".
+  int64_t mtime;
+  uint64_t size;
+  std::string path;
+  while (deps >> mtime >> size) {
+    deps.get();
+    if (!std::getline(deps, path)) {
+      return false;
+    }
+
+    llvm::sys::fs::file_status status;
+    if (llvm::sys::fs::status(path, status) || status.getSize() != size ||
+        llvm::sys::toTimeT(status.getLastModificationTime()) != mtime) {
+      return false;
+    }
+  }
+
+  return deps.eof();
+}
+
+bool build_preamble(const std::string &filename, StringRef preamble,
+                    const std::vector<std::string> &args,
+                    const std::string &pch_path, const std::string &deps_path) {
+  // Other threads and processes may be building the same preamble,
+  // so each build writes to its own temporary files, which are then renamed
+  // into place. The preamble itself is renamed last, since its presence is
+  // what marks an entry as complete.
+  static std::atomic<uint64_t> counter{0};
+  std::string suffix = "." +
+                       std::to_string(llvm::sys::Process::getProcessId()) +
+                       "." + std::to_string(counter++) + ".tmp";
+  std::string pch_tmp = pch_path + suffix;
+  std::string deps_tmp = deps_path + suffix;
+
+  std::vector<Dependency> dependencies;
+#if LLVM_VERSION_MAJOR <= 9
+  bool ok = tooling::runToolOnCodeWithArgs(
+      new PreambleGenerateAction(pch_tmp, &dependencies), preamble, args,
+      filename);
+#else
+  bool ok = tooling::runToolOnCodeWithArgs(
+      std::make_unique<PreambleGenerateAction>(pch_tmp, &dependencies),
+      preamble, args, filename);
+#endif
+
+  if (ok && llvm::sys::fs::exists(pch_tmp)) {
+    std::ofstream deps(deps_tmp, std::ofstream::trunc);
+    for (const auto &dependency : dependencies) {
+      deps << dependency.mtime << ' ' << dependency.size << ' '
+           << dependency.path << '\n';
+    }
+    deps.close();
+
+    ok = !deps.fail() && !llvm::sys::fs::rename(deps_tmp, deps_path) &&
+         !llvm::sys::fs::rename(pch_tmp, pch_path);
+  } else {
+    ok = false;
+  }
+
+  llvm::sys::fs::remove(pch_tmp);
+  llvm::sys::fs::remove(deps_tmp);
+  return ok;
+}
+
+} // namespace
+
+void PreambleCache::SetDirectory(const std::string &directory) {
+  std::lock_guard<std::mutex> lock(mutex);
+  this->directory = directory;
+}
+
+std::string PreambleCache::Directory() {
+  std::lock_guard<std::mutex> lock(mutex);
+  return directory;
+}
+
+std::vector<std::string>
+PreambleCache::ArgsFor(const std::string &filename, const std::string &data,
+                       const std::vector<std::string> &args, bool is_cxx) {
+  std::string dir = Directory();
+  if (dir.empty()) {
+    return {};
+  }
+
+  auto bounds = compute_preamble(data, is_cxx);
+  if (bounds.Size == 0) {
+    return {};
+  }
+
+  StringRef preamble(data.data(), bounds.Size);
+  std::string key =
+      cache_key(filename, preamble, bounds.PreambleEndsAtStartOfLine, args);
+
+  llvm::SmallString<256> pch_path(dir);
+  llvm::sys::path::append(pch_path, key + ".pch");
+  llvm::SmallString<256> deps_path(dir);
+  llvm::sys::path::append(deps_path, key + ".deps");
+
+  bool hit = llvm::sys::fs::exists(pch_path) &&
+             dependencies_valid(deps_path.str().str());
+  bool built = !hit && !llvm::sys::fs::create_directories(dir) &&
+               build_preamble(filename, preamble, args, pch_path.str().str(),
+                              deps_path.str().str());
+  {
+    // A preamble that fails to build isn't a miss, since the parse then
+    // proceeds without the cache at all; it's counted separately.
+    std::lock_guard<std::mutex> lock(mutex);
+    if (hit) {
+      stats.hits++;
+    } else if (built) {
+      stats.misses++;
+    } else {
+      stats.failures++;
+    }
+  }
+
+  if (!hit && !built) {
+    return {};
+  }
+
+  // -preamble-bytes tells the preprocessor to skip the preamble in
+  // the main file, since the precompiled preamble stands in for it. We do our
+  // own dependency validation above, so Clang's is disabled.
+  return {
+      "-include-pch",
+      pch_path.str().str(),
+      "-Xclang",
+      "-preamble-bytes=" + std::to_string(bounds.Size) + "," +
+          (bounds.PreambleEndsAtStartOfLine ? "1" : "0"),
+      "-Xclang",
+      "-fno-validate-pch",
+  };
+}
+
+PreambleCacheStats PreambleCache::Stats() {
+  std::lock_guard<std::mutex> lock(mutex);
+  return stats;
+}
+
+void PreambleCache::ResetStats() {
+  std::lock_guard<std::mutex> lock(mutex);
+  stats = PreambleCacheStats();
+}
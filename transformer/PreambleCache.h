@@ -0,0 +1,59 @@
+/*
+ * PreambleCache.h
+ *
+ * An on-disk cache of precompiled preambles, i.e. the leading block of
+ * #includes and other directives at the top of a source file.
+ */
+
+#pragma once
+
+#include <cstdint>
+#include <mutex>
+#include <string>
+#include <vector>
+
+struct PreambleCacheStats {
+  uint64_t hits = 0;
+  uint64_t misses = 0;
+  // Preambles that couldn't be built (or stored), and so weren't cached.
+  uint64_t failures = 0;
+};
+
+/*
+ * Each cache entry is a precompiled preamble (<key>.pch), plus a list of the
+ * headers it was built from (<key>.deps). Entries are keyed by the preamble's
+ * text, the file it belongs to, the compiler arguments, and the Clang version.
+ * An entry is only reused if none of its headers have changed since it was
+ * built; otherwise, it's rebuilt.
+ */
+class PreambleCache {
+public:
+  /*
+   * Sets the directory that preambles are stored in. An empty directory
+   * disables the cache.
+   */
+  void SetDirectory(const std::string &directory);
+  std::string Directory();
+
+  /*
+   * Returns the extra compiler arguments needed for a parse of the given
+   * source to reuse its cached preamble, building the preamble first if
+   * necessary. Returns no arguments if the cache is disabled, the source has
+   * no preamble, or the preamble can't be built.
+   */
+  std::vector<std::string> ArgsFor(const std::string &filename,
+                                   const std::string &data,
+                                   const std::vector<std::string> &args,
+                                   bool is_cxx);
+
+  PreambleCacheStats Stats();
+  void ResetStats();
+
+private:
+  std::mutex mutex;
+  std::string directory;
+  PreambleCacheStats stats;
+};
+
+// There's one cache per process, shared by every extraction.
+extern PreambleCache preamble_cache;
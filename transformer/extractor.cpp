@@ -1,8 +1,17 @@
 #define PY_SSIZE_T_CLEAN
+#include <Python.h>
+
 #include "ASTExporter.h"
 #include "ASTPatch.h"
+#include "ParsedUnit.h"
+#include "PreambleCache.h"
+#include <cstdint>
+#include <cstdlib>
 #include <fstream>
+#include <initializer_list>
 #include <iostream>
+#include <llvm/Support/FileSystem.h>
+#include <llvm/Support/Path.h>
 #include <memory>
 #include <sstream>
 #include <utility>
@@ -21,64 +30,520 @@ static bool read_file_to_string(const std::string &filename,
   return true;
 }
 
-template <class Tool, class... ToolArgs>
-static void run_clang_tool(std::string &data, int is_cxx,
-                           ToolArgs &&...tool_args) {
+// A PyArg_ParseTuple converter ("O&") for an optional sequence of compiler
+// arguments, stored into a std::vector<std::string>. None means no arguments.
+static int compiler_args_converter(PyObject *obj, void *result) {
+  auto args = static_cast<std::vector<std::string> *>(result);
+  if (obj == Py_None) {
+    return 1;
+  }
+
+  PyObject *seq = PySequence_Fast(obj, "compiler arguments must be a sequence");
+  if (seq == nullptr) {
+    return 0;
+  }
+
+  Py_ssize_t size = PySequence_Fast_GET_SIZE(seq);
+  for (Py_ssize_t i = 0; i < size; ++i) {
+    // NOTE: PySequence_Fast_GET_ITEM returns a borrowed reference.
+    PyObject *item = PySequence_Fast_GET_ITEM(seq, i);
+    Py_ssize_t length;
+    const char *arg = PyUnicode_AsUTF8AndSize(item, &length);
+    if (arg == nullptr) {
+      Py_DECREF(seq);
+      return 0;
+    }
+    args->emplace_back(arg, length);
+  }
+
+  Py_DECREF(seq);
+  return 1;
+}
+
+// Returns the compiler arguments for parsing the given source: the language,
+// any per-file arguments (e.g. from a compilation database), and those needed
+// to reuse the source's cached preamble (if any).
+static std::vector<std::string>
+clang_args(const std::string &filename, const std::string &data, int is_cxx,
+           const std::vector<std::string> &extra_args) {
   std::vector<std::string> args{"-x"};
   if (is_cxx) {
     args.push_back("c++");
   } else {
     args.push_back("c");
   }
+  args.insert(args.end(), extra_args.begin(), extra_args.end());
+
+  auto preamble_args = preamble_cache.ArgsFor(filename, data, args, is_cxx);
+  args.insert(args.end(), preamble_args.begin(), preamble_args.end());
+
+  return args;
+}
+
+// The in-memory source is given its real filename, so that Clang
+// resolves quoted #includes relative to the file's own directory.
+template <class Tool, class... ToolArgs>
+static void run_clang_tool(const std::string &filename, std::string &data,
+                           int is_cxx,
+                           const std::vector<std::string> &extra_args,
+                           ToolArgs &&...tool_args) {
+  auto args = clang_args(filename, data, is_cxx, extra_args);
 
 #if LLVM_VERSION_MAJOR <= 9
   runToolOnCodeWithArgs(new Tool(std::forward<ToolArgs>(tool_args)...), data,
-                        args);
+                        args, filename);
 #else
-  runToolOnCodeWithArgs(std::make_unique<Tool>(tool_args...), data, args);
+  runToolOnCodeWithArgs(std::make_unique<Tool>(tool_args...), data, args,
+                        filename);
 #endif
 }
 
-static PyObject *extract_ast(PyObject *self, PyObject *args) {
+// Returns a new reference to the Python list form of the given entry,
+// or nullptr with a Python exception set.
+static PyObject *entry_to_python(const ASTEntry &entry) {
+  switch (entry.kind) {
+  case EntryKind::FuncDecl:
+    return Py_BuildValue("[sIIII]", "func_decl", entry.start_line,
+                         entry.start_col, entry.end_line, entry.end_col);
+  case EntryKind::VarDecl:
+    return Py_BuildValue("[sIIIIssiK]", "var_type", entry.start_line,
+                         entry.start_col, entry.end_line, entry.end_col,
+                         entry.name.c_str(), entry.type.c_str(),
+                         static_cast<int>(entry.is_array), entry.size);
+  case EntryKind::Stmt:
+    return Py_BuildValue("[sIIIIs]", "stmt_type", entry.start_line,
+                         entry.start_col, entry.end_line, entry.end_col,
+                         entry.expr.c_str());
+  case EntryKind::Call: {
+    PyObject *call = Py_BuildValue(
+        "[sIIIIss]", "call_type", entry.start_line, entry.start_col,
+        entry.end_line, entry.end_col, entry.expr.c_str(), entry.name.c_str());
+    if (call == nullptr) {
+      return nullptr;
+    }
+
+    for (const auto &arg : entry.arguments) {
+      PyObject *arg_arr =
+          Py_BuildValue("[ss]", arg.first.c_str(), arg.second.c_str());
+      if (arg_arr == nullptr || PyList_Append(call, arg_arr) < 0) {
+        Py_XDECREF(arg_arr);
+        Py_DECREF(call);
+        return nullptr;
+      }
+      Py_DECREF(arg_arr);
+    }
+    return call;
+  }
+  }
+
+  PyErr_SetString(PyExc_SystemError, "Unknown AST entry kind");
+  return nullptr;
+}
+
+// Returns a new reference to a Python list of the given entries,
+// or nullptr with a Python exception set.
+static PyObject *entries_to_python(const std::vector<ASTEntry> &entries) {
+  PyObject *list = PyList_New(entries.size());
+  if (list == nullptr) {
+    return nullptr;
+  }
+
+  for (size_t i = 0; i < entries.size(); ++i) {
+    PyObject *entry = entry_to_python(entries[i]);
+    if (entry == nullptr) {
+      Py_DECREF(list);
+      return nullptr;
+    }
+    // NOTE: PyList_SET_ITEM steals the reference to entry.
+    PyList_SET_ITEM(list, i, entry);
+  }
+
+  return list;
+}
+
+// Sets dict[key] = value, consuming the caller's reference to value.
+static bool set_item_steal(PyObject *dict, const char *key, PyObject *value) {
+  if (value == nullptr) {
+    return false;
+  }
+
+  int ret = PyDict_SetItemString(dict, key, value);
+  Py_DECREF(value);
+  return ret == 0;
+}
+
+// Converts the natively collected AST facts into the dictionary returned by
+// extract_ast. This is the only part of extraction that needs the GIL.
+static PyObject *extracted_to_python(const std::string &filename,
+                                     const ExtractedAST &ast) {
+  PyObject *extract_results = PyDict_New();
+  if (extract_results == nullptr) {
+    return nullptr;
+  }
+
+  if (!set_item_steal(extract_results, "module_name",
+                      PyUnicode_DecodeFSDefault(filename.c_str())) ||
+      !set_item_steal(extract_results, "globals",
+                      entries_to_python(ast.globals))) {
+    Py_DECREF(extract_results);
+    return nullptr;
+  }
+
+  PyObject *functions = PyDict_New();
+  if (!set_item_steal(extract_results, "functions", functions)) {
+    Py_DECREF(extract_results);
+    return nullptr;
+  }
+
+  // NOTE: functions is still alive here, since extract_results owns it.
+  for (const auto &function : ast.functions) {
+    if (!set_item_steal(functions, function.first.c_str(),
+                        entries_to_python(function.second))) {
+      Py_DECREF(extract_results);
+      return nullptr;
+    }
+  }
+
+  return extract_results;
+}
+
+static PyObject *extract_ast(PyObject *self, PyObject *args, PyObject *kwds) {
+  static const char *kwlist[] = {"filename", "is_cxx", "args", nullptr};
   PyObject *filename_bytes;
   int is_cxx;
-  if (!PyArg_ParseTuple(args, "O&p", PyUnicode_FSConverter, &filename_bytes,
-                        &is_cxx)) {
+  std::vector<std::string> compiler_args;
+  if (!PyArg_ParseTupleAndKeywords(
+          args, kwds, "O&p|O&", const_cast<char **>(kwlist),
+          PyUnicode_FSConverter, &filename_bytes, &is_cxx,
+          compiler_args_converter, &compiler_args)) {
     return nullptr;
   }
 
   std::string filename = PyBytes_AsString(filename_bytes);
   Py_DECREF(filename_bytes);
 
+  // NOTE: Everything between reading the file and converting the results
+  // back into Python objects happens without the GIL, so that other Python
+  // threads (including other extract_ast calls) can run in the meantime.
   std::string data;
-  if (!read_file_to_string(filename, data)) {
+  ExtractedAST ast;
+  bool read_ok;
+  Py_BEGIN_ALLOW_THREADS;
+  read_ok = read_file_to_string(filename, data);
+  if (read_ok) {
+    run_clang_tool<ASTExporterFrontendAction>(filename, data, is_cxx,
+                                              compiler_args, &ast);
+  }
+  Py_END_ALLOW_THREADS;
+
+  if (!read_ok) {
     PyErr_SetString(PyExc_IOError, "Failed to open file for extraction");
     return nullptr;
   }
 
-  // Allocate dictionary to return to Python
+  return extracted_to_python(filename, ast);
+}
+
+/*
+ * The columnar format returned by extract_ast_columnar. Rather than a list per
+ * AST node, each kind of node gets a table of fixed-width columns, and every
+ * string is replaced by its index into a single interned string table.
+ *
+ * Columns are returned to Python as bytes objects in native byte order:
+ * coordinate, index, and count columns are uint32 ("I"), is_array is uint8
+ * ("B"), and size is uint64 ("Q"). Each "coords" column holds four values
+ * (start line, start column, end line, end column) per row.
+ */
+class StringTable {
+public:
+  uint32_t intern(const std::string &str) {
+    auto it = indices.find(str);
+    if (it != indices.end()) {
+      return it->second;
+    }
+
+    uint32_t index = strings.size();
+    indices.emplace(str, index);
+    strings.push_back(str);
+    return index;
+  }
+
+  std::vector<std::string> strings;
+
+private:
+  std::unordered_map<std::string, uint32_t> indices;
+};
+
+static void push_coords(std::vector<uint32_t> &coords, const ASTEntry &entry) {
+  coords.push_back(entry.start_line);
+  coords.push_back(entry.start_col);
+  coords.push_back(entry.end_line);
+  coords.push_back(entry.end_col);
+}
+
+struct VarDeclColumns {
+  // Only populated for local variables; an index into the functions table.
+  std::vector<uint32_t> function;
+  std::vector<uint32_t> coords;
+  std::vector<uint32_t> name;
+  std::vector<uint32_t> type;
+  std::vector<uint8_t> is_array;
+  std::vector<uint64_t> size;
+
+  void add(StringTable &strings, const ASTEntry &entry) {
+    push_coords(coords, entry);
+    name.push_back(strings.intern(entry.name));
+    type.push_back(strings.intern(entry.type));
+    is_array.push_back(entry.is_array);
+    size.push_back(entry.size);
+  }
+};
+
+struct ColumnarAST {
+  StringTable strings;
+
+  std::vector<uint32_t> function_name;
+  std::vector<uint32_t> function_coords;
+
+  VarDeclColumns globals;
+  VarDeclColumns var_decls;
+
+  std::vector<uint32_t> call_function;
+  std::vector<uint32_t> call_coords;
+  std::vector<uint32_t> call_expr;
+  std::vector<uint32_t> call_name;
+  // The number of arguments belonging to each call. Arguments are stored
+  // in call order, so each call's arguments follow the previous call's.
+  std::vector<uint32_t> call_arg_count;
+
+  std::vector<uint32_t> argument_name;
+  std::vector<uint32_t> argument_type;
+
+  std::vector<uint32_t> stmt_function;
+  std::vector<uint32_t> stmt_coords;
+  std::vector<uint32_t> stmt_expr;
+};
+
+static void build_columnar(const ExtractedAST &ast, ColumnarAST &columnar) {
+  for (const auto &entry : ast.globals) {
+    columnar.globals.add(columnar.strings, entry);
+  }
+
+  for (const auto &function : ast.functions) {
+    const auto &entries = function.second;
+
+    // NOTE: As with the dictionary format, a function whose entries don't
+    // begin with its own declaration was external, so we skip it.
+    if (entries.empty() || entries.front().kind != EntryKind::FuncDecl) {
+      continue;
+    }
+
+    uint32_t function_index = columnar.function_name.size();
+    columnar.function_name.push_back(columnar.strings.intern(function.first));
+    push_coords(columnar.function_coords, entries.front());
+
+    for (auto it = entries.begin() + 1; it != entries.end(); ++it) {
+      const auto &entry = *it;
+      switch (entry.kind) {
+      case EntryKind::VarDecl:
+        columnar.var_decls.function.push_back(function_index);
+        columnar.var_decls.add(columnar.strings, entry);
+        break;
+      case EntryKind::Call:
+        columnar.call_function.push_back(function_index);
+        push_coords(columnar.call_coords, entry);
+        columnar.call_expr.push_back(columnar.strings.intern(entry.expr));
+        columnar.call_name.push_back(columnar.strings.intern(entry.name));
+        columnar.call_arg_count.push_back(entry.arguments.size());
+        for (const auto &arg : entry.arguments) {
+          columnar.argument_name.push_back(columnar.strings.intern(arg.first));
+          columnar.argument_type.push_back(columnar.strings.intern(arg.second));
+        }
+        break;
+      case EntryKind::Stmt:
+        columnar.stmt_function.push_back(function_index);
+        push_coords(columnar.stmt_coords, entry);
+        columnar.stmt_expr.push_back(columnar.strings.intern(entry.expr));
+        break;
+      case EntryKind::FuncDecl:
+        // A redeclaration of a function we've already seen; the first
+        // declaration wins.
+        break;
+      }
+    }
+  }
+}
+
+// Returns a new reference to a bytes object containing the given column.
+template <class T>
+static PyObject *column_to_python(const std::vector<T> &column) {
+  return PyBytes_FromStringAndSize(
+      reinterpret_cast<const char *>(column.data()), column.size() * sizeof(T));
+}
+
+// Returns a new reference to a dict of the given columns, consuming the
+// caller's references to each column.
+static PyObject *table_to_python(
+    std::initializer_list<std::pair<const char *, PyObject *>> columns) {
+  PyObject *table = PyDict_New();
+  bool ok = table != nullptr;
+  for (const auto &column : columns) {
+    if (ok) {
+      ok = set_item_steal(table, column.first, column.second);
+    } else {
+      Py_XDECREF(column.second);
+    }
+  }
+
+  if (!ok) {
+    Py_XDECREF(table);
+    return nullptr;
+  }
+  return table;
+}
+
+static PyObject *var_decls_to_python(const VarDeclColumns &columns,
+                                     bool with_function) {
+  if (!with_function) {
+    return table_to_python({
+        {"coords", column_to_python(columns.coords)},
+        {"name", column_to_python(columns.name)},
+        {"type", column_to_python(columns.type)},
+        {"is_array", column_to_python(columns.is_array)},
+        {"size", column_to_python(columns.size)},
+    });
+  }
+
+  return table_to_python({
+      {"function", column_to_python(columns.function)},
+      {"coords", column_to_python(columns.coords)},
+      {"name", column_to_python(columns.name)},
+      {"type", column_to_python(columns.type)},
+      {"is_array", column_to_python(columns.is_array)},
+      {"size", column_to_python(columns.size)},
+  });
+}
+
+static PyObject *strings_to_python(const StringTable &strings) {
+  PyObject *list = PyList_New(strings.strings.size());
+  if (list == nullptr) {
+    return nullptr;
+  }
+
+  for (size_t i = 0; i < strings.strings.size(); ++i) {
+    const auto &str = strings.strings[i];
+    PyObject *item = PyUnicode_FromStringAndSize(str.data(), str.size());
+    if (item == nullptr) {
+      Py_DECREF(list);
+      return nullptr;
+    }
+    PyList_SET_ITEM(list, i, item);
+  }
+
+  return list;
+}
+
+static PyObject *columnar_to_python(const std::string &filename,
+                                    const ColumnarAST &columnar) {
   PyObject *extract_results = PyDict_New();
-  if (!extract_results) {
-    PyErr_SetString(PyExc_MemoryError, "Allocation failed for dict");
+  if (extract_results == nullptr) {
     return nullptr;
   }
-  PyDict_SetItem(extract_results, PyUnicode_FromString("module_name"),
-                 PyUnicode_FromString(filename.c_str()));
 
-  run_clang_tool<ASTExporterFrontendAction>(data, is_cxx, extract_results);
+  bool ok =
+      set_item_steal(extract_results, "module_name",
+                     PyUnicode_DecodeFSDefault(filename.c_str())) &&
+      set_item_steal(extract_results, "strings",
+                     strings_to_python(columnar.strings)) &&
+      set_item_steal(extract_results, "functions",
+                     table_to_python({
+                         {"coords", column_to_python(columnar.function_coords)},
+                         {"name", column_to_python(columnar.function_name)},
+                     })) &&
+      set_item_steal(extract_results, "globals",
+                     var_decls_to_python(columnar.globals, false)) &&
+      set_item_steal(extract_results, "var_decls",
+                     var_decls_to_python(columnar.var_decls, true)) &&
+      set_item_steal(
+          extract_results, "calls",
+          table_to_python({
+              {"function", column_to_python(columnar.call_function)},
+              {"coords", column_to_python(columnar.call_coords)},
+              {"expr", column_to_python(columnar.call_expr)},
+              {"name", column_to_python(columnar.call_name)},
+              {"arg_count", column_to_python(columnar.call_arg_count)},
+          })) &&
+      set_item_steal(extract_results, "arguments",
+                     table_to_python({
+                         {"name", column_to_python(columnar.argument_name)},
+                         {"type", column_to_python(columnar.argument_type)},
+                     })) &&
+      set_item_steal(extract_results, "statements",
+                     table_to_python({
+                         {"function", column_to_python(columnar.stmt_function)},
+                         {"coords", column_to_python(columnar.stmt_coords)},
+                         {"expr", column_to_python(columnar.stmt_expr)},
+                     }));
 
-  // Return the python dictionary back to the python code.
+  if (!ok) {
+    Py_DECREF(extract_results);
+    return nullptr;
+  }
   return extract_results;
 }
 
-static PyObject *transform(PyObject *self, PyObject *args) {
+static PyObject *extract_ast_columnar(PyObject *self, PyObject *args,
+                                      PyObject *kwds) {
+  static const char *kwlist[] = {"filename", "is_cxx", "args", nullptr};
+  PyObject *filename_bytes;
+  int is_cxx;
+  std::vector<std::string> compiler_args;
+  if (!PyArg_ParseTupleAndKeywords(
+          args, kwds, "O&p|O&", const_cast<char **>(kwlist),
+          PyUnicode_FSConverter, &filename_bytes, &is_cxx,
+          compiler_args_converter, &compiler_args)) {
+    return nullptr;
+  }
+
+  std::string filename = PyBytes_AsString(filename_bytes);
+  Py_DECREF(filename_bytes);
+
+  // NOTE: As with extract_ast, only the final conversion holds the GIL.
+  std::string data;
+  ColumnarAST columnar;
+  bool read_ok;
+  Py_BEGIN_ALLOW_THREADS;
+  read_ok = read_file_to_string(filename, data);
+  if (read_ok) {
+    ExtractedAST ast;
+    run_clang_tool<ASTExporterFrontendAction>(filename, data, is_cxx,
+                                              compiler_args, &ast);
+    build_columnar(ast, columnar);
+  }
+  Py_END_ALLOW_THREADS;
+
+  if (!read_ok) {
+    PyErr_SetString(PyExc_IOError, "Failed to open file for extraction");
+    return nullptr;
+  }
+
+  return columnar_to_python(filename, columnar);
+}
+
+static PyObject *transform(PyObject *self, PyObject *args, PyObject *kwds) {
+  static const char *kwlist[] = {"filename",   "is_cxx",    "replacement",
+                                 "start_line", "start_col", "end_line",
+                                 "end_col",    "args",      nullptr};
   PyObject *filename_bytes;
   char *replacement;
   int is_cxx;
   int start_line, start_col, end_line, end_col;
-  if (!PyArg_ParseTuple(args, "O&psiiii", PyUnicode_FSConverter,
-                        &filename_bytes, &is_cxx, &replacement, &start_line,
-                        &start_col, &end_line, &end_col)) {
+  std::vector<std::string> compiler_args;
+  if (!PyArg_ParseTupleAndKeywords(
+          args, kwds, "O&psiiii|O&", const_cast<char **>(kwlist),
+          PyUnicode_FSConverter, &filename_bytes, &is_cxx, &replacement,
+          &start_line, &start_col, &end_line, &end_col, compiler_args_converter,
+          &compiler_args)) {
     return nullptr;
   }
 
@@ -86,29 +551,474 @@ static PyObject *transform(PyObject *self, PyObject *args) {
   Py_DECREF(filename_bytes);
 
   std::string data;
-  if (!read_file_to_string(filename, data)) {
-    PyErr_SetString(PyExc_IOError, "Failed to open file for patching");
+  std::string error;
+  std::string replacement_str(replacement);
+  Py_BEGIN_ALLOW_THREADS;
+  if (read_file_to_string(filename, data)) {
+    run_clang_tool<ASTPatchAction>(filename, data, is_cxx, compiler_args,
+                                   start_line, start_col, end_line, end_col,
+                                   replacement_str, filename, &error);
+  } else {
+    error = "Failed to open file for patching";
+  }
+  Py_END_ALLOW_THREADS;
+
+  // The patching action might have failed on an I/O error. If so, raise
+  // an appropriate Python exception now that we hold the GIL again.
+  if (!error.empty()) {
+    PyErr_SetString(PyExc_IOError, error.c_str());
     return nullptr;
   }
 
-  run_clang_tool<ASTPatchAction>(data, is_cxx, start_line, start_col, end_line,
-                                 end_col, std::string(replacement), filename);
+  Py_RETURN_TRUE;
+}
+
+/*
+ * ParsedUnit: a Python handle on a translation unit that's parsed once, when
+ * the handle is created. Extraction and rewriting queries then reuse that
+ * parse, rather than running the clang frontend again for each query.
+ */
+typedef struct {
+  PyObject_HEAD ParsedUnit *unit;
+} ParsedUnitObject;
 
-  // The patching action might have failed (and set an appropriate Python
-  // exception) on an I/O error. If so, return nullptr and allow the exception
-  // to propagate.
-  if (PyErr_Occurred()) {
+// Converts each string with the given function (e.g.
+// PyBytes_FromStringAndSize), and returns a new list of the results.
+static PyObject *strings_to_list(const std::vector<std::string> &strings,
+                                 PyObject *(*convert)(const char *,
+                                                      Py_ssize_t)) {
+  PyObject *result = PyList_New(strings.size());
+  if (result == nullptr) {
     return nullptr;
   }
 
-  Py_RETURN_TRUE;
+  for (size_t i = 0; i < strings.size(); ++i) {
+    PyObject *item = convert(strings[i].data(), strings[i].size());
+    if (item == nullptr) {
+      Py_DECREF(result);
+      return nullptr;
+    }
+    PyList_SET_ITEM(result, i, item);
+  }
+
+  return result;
+}
+
+// Parses the given file, releasing the GIL while Clang runs. Returns nullptr
+// and sets a Python exception on failure.
+static std::unique_ptr<ParsedUnit>
+parse_unit(const std::string &filename, int is_cxx,
+           const std::vector<std::string> &compiler_args) {
+  std::string data;
+  std::string error;
+  std::unique_ptr<ParsedUnit> unit;
+  bool read_ok;
+  Py_BEGIN_ALLOW_THREADS;
+  read_ok = read_file_to_string(filename, data);
+  if (read_ok) {
+    unit = ParsedUnit::Parse(filename, data,
+                             clang_args(filename, data, is_cxx, compiler_args),
+                             error);
+  }
+  Py_END_ALLOW_THREADS;
+
+  if (!read_ok) {
+    PyErr_SetString(PyExc_IOError, "Failed to open file for parsing");
+    return nullptr;
+  }
+  if (unit == nullptr) {
+    PyErr_SetString(PyExc_RuntimeError, error.c_str());
+    return nullptr;
+  }
+
+  return unit;
+}
+
+// Converts a single (replacement, start_line, start_col, end_line, end_col)
+// edit tuple. Sets a Python exception on failure.
+static bool edit_from_python(PyObject *obj, SourceEdit &edit) {
+  const char *replacement;
+  if (!PyTuple_Check(obj)) {
+    PyErr_SetString(PyExc_TypeError,
+                    "edits must be (replacement, start_line, start_col, "
+                    "end_line, end_col) tuples");
+    return false;
+  }
+  if (!PyArg_ParseTuple(obj, "sIIII", &replacement, &edit.start_line,
+                        &edit.start_col, &edit.end_line, &edit.end_col)) {
+    return false;
+  }
+
+  edit.replacement = replacement;
+  return true;
+}
+
+// Converts a sequence of candidates, each of which is either a single edit or
+// a sequence of edits to apply together. Sets a Python exception on failure.
+static bool
+candidates_from_python(PyObject *obj,
+                       std::vector<std::vector<SourceEdit>> &candidates) {
+  PyObject *seq = PySequence_Fast(obj, "edits must be a sequence");
+  if (seq == nullptr) {
+    return false;
+  }
+
+  Py_ssize_t size = PySequence_Fast_GET_SIZE(seq);
+  for (Py_ssize_t i = 0; i < size && !PyErr_Occurred(); ++i) {
+    // NOTE: PySequence_Fast_GET_ITEM returns a borrowed reference.
+    PyObject *candidate = PySequence_Fast_GET_ITEM(seq, i);
+    candidates.emplace_back();
+    auto &edits = candidates.back();
+
+    // A lone edit is a candidate of its own.
+    if (PyTuple_Check(candidate) && PyTuple_GET_SIZE(candidate) > 0 &&
+        PyUnicode_Check(PyTuple_GET_ITEM(candidate, 0))) {
+      edits.emplace_back();
+      edit_from_python(candidate, edits.back());
+      continue;
+    }
+
+    PyObject *edit_seq =
+        PySequence_Fast(candidate, "each candidate must be an edit or a "
+                                   "sequence of edits");
+    if (edit_seq == nullptr) {
+      break;
+    }
+    Py_ssize_t edit_count = PySequence_Fast_GET_SIZE(edit_seq);
+    for (Py_ssize_t j = 0; j < edit_count; ++j) {
+      edits.emplace_back();
+      if (!edit_from_python(PySequence_Fast_GET_ITEM(edit_seq, j),
+                            edits.back())) {
+        break;
+      }
+    }
+    Py_DECREF(edit_seq);
+  }
+
+  Py_DECREF(seq);
+  return !PyErr_Occurred();
+}
+
+// Rewrites every candidate against the given unit, without the GIL. Returns
+// false and fills in error (prefixed with the failing candidate's index) if
+// any candidate can't be applied.
+static bool
+rewrite_candidates(ParsedUnit &unit,
+                   const std::vector<std::vector<SourceEdit>> &candidates,
+                   std::vector<std::string> &outputs, std::string &error) {
+  outputs.resize(candidates.size());
+  for (size_t i = 0; i < candidates.size(); ++i) {
+    if (!unit.Rewrite(candidates[i], outputs[i], error)) {
+      error = "candidate " + std::to_string(i) + ": " + error;
+      return false;
+    }
+  }
+
+  return true;
+}
+
+// Writes each output to <out_dir>/<index>/<basename of filename>, storing
+// the paths written. Returns false and fills in error on failure.
+static bool write_outputs(const std::string &filename,
+                          const std::string &out_dir,
+                          const std::vector<std::string> &outputs,
+                          std::vector<std::string> &paths, std::string &error) {
+  auto basename = llvm::sys::path::filename(filename);
+  for (size_t i = 0; i < outputs.size(); ++i) {
+    llvm::SmallString<256> dir(out_dir);
+    llvm::sys::path::append(dir, std::to_string(i));
+    llvm::SmallString<256> path(dir);
+    llvm::sys::path::append(path, basename);
+
+    if (llvm::sys::fs::create_directories(dir)) {
+      error = "Failed to create " + dir.str().str();
+      return false;
+    }
+    std::ofstream out(path.str().str(), std::ofstream::binary);
+    out.write(outputs[i].data(), outputs[i].size());
+    out.close();
+    if (out.fail()) {
+      error = "Failed to write " + path.str().str();
+      return false;
+    }
+    paths.push_back(path.str().str());
+  }
+
+  return true;
+}
+
+static PyObject *transform_many(PyObject *self, PyObject *args,
+                                PyObject *kwds) {
+  static const char *kwlist[] = {"filename", "is_cxx", "edits",
+                                 "out_dir",  "args",   nullptr};
+  PyObject *filename_bytes;
+  int is_cxx;
+  PyObject *edits;
+  PyObject *out_dir = Py_None;
+  std::vector<std::string> compiler_args;
+  if (!PyArg_ParseTupleAndKeywords(
+          args, kwds, "O&pO|OO&", const_cast<char **>(kwlist),
+          PyUnicode_FSConverter, &filename_bytes, &is_cxx, &edits, &out_dir,
+          compiler_args_converter, &compiler_args)) {
+    return nullptr;
+  }
+
+  std::string filename = PyBytes_AsString(filename_bytes);
+  Py_DECREF(filename_bytes);
+
+  std::string out_dir_str;
+  if (out_dir != Py_None) {
+    PyObject *out_dir_bytes;
+    if (!PyUnicode_FSConverter(out_dir, &out_dir_bytes)) {
+      return nullptr;
+    }
+    out_dir_str = PyBytes_AsString(out_dir_bytes);
+    Py_DECREF(out_dir_bytes);
+  }
+
+  std::vector<std::vector<SourceEdit>> candidates;
+  if (!candidates_from_python(edits, candidates)) {
+    return nullptr;
+  }
+
+  auto unit = parse_unit(filename, is_cxx, compiler_args);
+  if (unit == nullptr) {
+    return nullptr;
+  }
+
+  std::vector<std::string> outputs;
+  std::vector<std::string> paths;
+  std::string error;
+  bool rewrite_ok, write_ok = true;
+  Py_BEGIN_ALLOW_THREADS;
+  rewrite_ok = rewrite_candidates(*unit, candidates, outputs, error);
+  if (rewrite_ok && out_dir != Py_None) {
+    write_ok = write_outputs(filename, out_dir_str, outputs, paths, error);
+  }
+  Py_END_ALLOW_THREADS;
+
+  if (!rewrite_ok) {
+    PyErr_SetString(PyExc_ValueError, error.c_str());
+    return nullptr;
+  }
+  if (!write_ok) {
+    PyErr_SetString(PyExc_IOError, error.c_str());
+    return nullptr;
+  }
+
+  if (out_dir != Py_None) {
+    return strings_to_list(paths, PyUnicode_DecodeFSDefaultAndSize);
+  }
+  return strings_to_list(outputs, PyBytes_FromStringAndSize);
+}
+
+static PyObject *ParsedUnit_new(PyTypeObject *type, PyObject *args,
+                                PyObject *kwds) {
+  static const char *kwlist[] = {"filename", "is_cxx", "args", nullptr};
+  PyObject *filename_bytes;
+  int is_cxx;
+  std::vector<std::string> compiler_args;
+  if (!PyArg_ParseTupleAndKeywords(
+          args, kwds, "O&p|O&", const_cast<char **>(kwlist),
+          PyUnicode_FSConverter, &filename_bytes, &is_cxx,
+          compiler_args_converter, &compiler_args)) {
+    return nullptr;
+  }
+
+  std::string filename = PyBytes_AsString(filename_bytes);
+  Py_DECREF(filename_bytes);
+
+  auto unit = parse_unit(filename, is_cxx, compiler_args);
+  if (unit == nullptr) {
+    return nullptr;
+  }
+
+  auto self = reinterpret_cast<ParsedUnitObject *>(type->tp_alloc(type, 0));
+  if (self == nullptr) {
+    return nullptr;
+  }
+  self->unit = unit.release();
+
+  return reinterpret_cast<PyObject *>(self);
+}
+
+static void ParsedUnit_dealloc(ParsedUnitObject *self) {
+  delete self->unit;
+  Py_TYPE(self)->tp_free(reinterpret_cast<PyObject *>(self));
+}
+
+static PyObject *ParsedUnit_extract_ast(ParsedUnitObject *self,
+                                        PyObject *Py_UNUSED(ignored)) {
+  ExtractedAST ast;
+  Py_BEGIN_ALLOW_THREADS;
+  self->unit->Extract(ast);
+  Py_END_ALLOW_THREADS;
+
+  return extracted_to_python(self->unit->Filename(), ast);
+}
+
+static PyObject *ParsedUnit_extract_ast_columnar(ParsedUnitObject *self,
+                                                 PyObject *Py_UNUSED(ignored)) {
+  ColumnarAST columnar;
+  Py_BEGIN_ALLOW_THREADS;
+  ExtractedAST ast;
+  self->unit->Extract(ast);
+  build_columnar(ast, columnar);
+  Py_END_ALLOW_THREADS;
+
+  return columnar_to_python(self->unit->Filename(), columnar);
+}
+
+static PyObject *ParsedUnit_rewrite(ParsedUnitObject *self, PyObject *args) {
+  char *replacement;
+  unsigned int start_line, start_col, end_line, end_col;
+  if (!PyArg_ParseTuple(args, "sIIII", &replacement, &start_line, &start_col,
+                        &end_line, &end_col)) {
+    return nullptr;
+  }
+
+  std::string replacement_str(replacement);
+  std::string output;
+  std::string error;
+  bool ok;
+  Py_BEGIN_ALLOW_THREADS;
+  ok = self->unit->Rewrite(replacement_str, start_line, start_col, end_line,
+                           end_col, output, error);
+  Py_END_ALLOW_THREADS;
+
+  if (!ok) {
+    PyErr_SetString(PyExc_ValueError, error.c_str());
+    return nullptr;
+  }
+
+  return PyBytes_FromStringAndSize(output.data(), output.size());
+}
+
+static PyObject *ParsedUnit_rewrite_many(ParsedUnitObject *self,
+                                         PyObject *args) {
+  PyObject *edits;
+  if (!PyArg_ParseTuple(args, "O", &edits)) {
+    return nullptr;
+  }
+
+  std::vector<std::vector<SourceEdit>> candidates;
+  if (!candidates_from_python(edits, candidates)) {
+    return nullptr;
+  }
+
+  std::vector<std::string> outputs;
+  std::string error;
+  bool ok;
+  Py_BEGIN_ALLOW_THREADS;
+  ok = rewrite_candidates(*self->unit, candidates, outputs, error);
+  Py_END_ALLOW_THREADS;
+
+  if (!ok) {
+    PyErr_SetString(PyExc_ValueError, error.c_str());
+    return nullptr;
+  }
+
+  return strings_to_list(outputs, PyBytes_FromStringAndSize);
+}
+
+static PyMethodDef ParsedUnit_methods[] = {
+    {"extract_ast", reinterpret_cast<PyCFunction>(ParsedUnit_extract_ast),
+     METH_NOARGS,
+     "Returns a dictionary containing AST info for the parsed unit"},
+    {"extract_ast_columnar",
+     reinterpret_cast<PyCFunction>(ParsedUnit_extract_ast_columnar),
+     METH_NOARGS,
+     "Returns a dictionary containing AST info for the parsed unit, in "
+     "columnar form"},
+    {"rewrite", reinterpret_cast<PyCFunction>(ParsedUnit_rewrite), METH_VARARGS,
+     "Returns the parsed unit's source, with a replacement applied"},
+    {"rewrite_many", reinterpret_cast<PyCFunction>(ParsedUnit_rewrite_many),
+     METH_VARARGS,
+     "Returns the parsed unit's source once per candidate, with each "
+     "candidate's edits applied"},
+    {nullptr, nullptr, 0, nullptr},
+};
+
+static PyTypeObject ParsedUnitType = {PyVarObject_HEAD_INIT(nullptr, 0)};
+
+static PyObject *set_preamble_cache(PyObject *self, PyObject *args) {
+  PyObject *directory;
+  if (!PyArg_ParseTuple(args, "O", &directory)) {
+    return nullptr;
+  }
+
+  if (directory == Py_None) {
+    preamble_cache.SetDirectory("");
+    Py_RETURN_NONE;
+  }
+
+  PyObject *directory_bytes;
+  if (!PyUnicode_FSConverter(directory, &directory_bytes)) {
+    return nullptr;
+  }
+  preamble_cache.SetDirectory(PyBytes_AsString(directory_bytes));
+  Py_DECREF(directory_bytes);
+
+  Py_RETURN_NONE;
+}
+
+static PyObject *preamble_cache_stats(PyObject *self,
+                                      PyObject *Py_UNUSED(ignored)) {
+  auto directory = preamble_cache.Directory();
+  auto stats = preamble_cache.Stats();
+
+  PyObject *directory_obj;
+  if (directory.empty()) {
+    Py_INCREF(Py_None);
+    directory_obj = Py_None;
+  } else {
+    directory_obj = PyUnicode_DecodeFSDefault(directory.c_str());
+  }
+
+  return Py_BuildValue("{s:N,s:K,s:K,s:K}", "directory", directory_obj, "hits",
+                       static_cast<unsigned long long>(stats.hits), "misses",
+                       static_cast<unsigned long long>(stats.misses),
+                       "failures",
+                       static_cast<unsigned long long>(stats.failures));
+}
+
+static PyObject *reset_preamble_cache_stats(PyObject *self,
+                                            PyObject *Py_UNUSED(ignored)) {
+  preamble_cache.ResetStats();
+  Py_RETURN_NONE;
+}
+
+// The preamble cache is opt-in, since its entries are large and it's never
+// pruned: it's enabled at import only if $TOURNIQUET_PREAMBLE_CACHE names a
+// directory (e.g. ~/.cache/tourniquet/preambles).
+static std::string default_preamble_cache_directory() {
+  if (const char *directory = std::getenv("TOURNIQUET_PREAMBLE_CACHE")) {
+    return directory;
+  }
+  return "";
 }
 
 PyMethodDef extractor_methods[] = {
-    {"extract_ast", extract_ast, METH_VARARGS,
+    {"extract_ast", reinterpret_cast<PyCFunction>(extract_ast),
+     METH_VARARGS | METH_KEYWORDS,
      "Returns a dictionary containing AST info for a file"},
-    {"transform", transform, METH_VARARGS,
+    {"extract_ast_columnar",
+     reinterpret_cast<PyCFunction>(extract_ast_columnar),
+     METH_VARARGS | METH_KEYWORDS,
+     "Returns a dictionary containing AST info for a file, in columnar form"},
+    {"transform", reinterpret_cast<PyCFunction>(transform),
+     METH_VARARGS | METH_KEYWORDS,
      "Transforms the target program with a replacement"},
+    {"transform_many", reinterpret_cast<PyCFunction>(transform_many),
+     METH_VARARGS | METH_KEYWORDS,
+     "Parses a file once, and rewrites it once per candidate"},
+    {"set_preamble_cache", set_preamble_cache, METH_VARARGS,
+     "Sets the directory that precompiled preambles are cached in, or "
+     "disables the cache if None"},
+    {"preamble_cache_stats", preamble_cache_stats, METH_NOARGS,
+     "Returns the preamble cache's directory, hits, misses, and failures"},
+    {"reset_preamble_cache_stats", reset_preamble_cache_stats, METH_NOARGS,
+     "Resets the preamble cache's hit, miss, and failure counts"},
     {nullptr, nullptr, 0, nullptr},
 };
 
@@ -122,6 +1032,33 @@ static struct PyModuleDef extractor_definition = {
 };
 
 PyMODINIT_FUNC PyInit_extractor(void) {
+  preamble_cache.SetDirectory(default_preamble_cache_directory());
+
+  ParsedUnitType.tp_name = "tourniquet.extractor.ParsedUnit";
+  ParsedUnitType.tp_doc = "A translation unit that's parsed once, and can be "
+                          "queried and rewritten many times";
+  ParsedUnitType.tp_basicsize = sizeof(ParsedUnitObject);
+  ParsedUnitType.tp_itemsize = 0;
+  ParsedUnitType.tp_flags = Py_TPFLAGS_DEFAULT;
+  ParsedUnitType.tp_new = ParsedUnit_new;
+  ParsedUnitType.tp_dealloc = reinterpret_cast<destructor>(ParsedUnit_dealloc);
+  ParsedUnitType.tp_methods = ParsedUnit_methods;
+  if (PyType_Ready(&ParsedUnitType) < 0) {
+    return nullptr;
+  }
+
   PyObject *m = PyModule_Create(&extractor_definition);
+  if (m == nullptr) {
+    return nullptr;
+  }
+
+  Py_INCREF(&ParsedUnitType);
+  if (PyModule_AddObject(m, "ParsedUnit",
+                         reinterpret_cast<PyObject *>(&ParsedUnitType)) < 0) {
+    Py_DECREF(&ParsedUnitType);
+    Py_DECREF(m);
+    return nullptr;
+  }
+
   return m;
 }